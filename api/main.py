@@ -1,15 +1,20 @@
+import asyncio
+import json
 import os
+import signal
+import threading
 import time
 from typing import Optional
 
-import uvicorn
 from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
-from fastapi.responses import HTMLResponse, Response
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.datastructures import Headers
+from starlette.requests import ClientDisconnect
 
 from config import Config
-from services.ai_service import AIService
+from services.image_pipeline import SNIFF_BYTES, SUPPORTED_FORMATS, probe_image_size, sniff_image_format
 
 app = FastAPI(title="多语言智能客服", description="支持文字和图片输入的智能客服系统")
 
@@ -26,47 +31,298 @@ templates = Jinja2Templates(directory="templates")
 # 全局AI服务实例
 ai_service = None
 
-@app.on_event("startup")
-async def startup_event():
-    """应用启动时预加载AI服务和知识库"""
-    global ai_service
-    print("🚀 系统启动中，正在预加载AI模型和知识库...")
-
+# 聊天请求中除图片外表单字段允许的最大字节数
+CHAT_FORM_OVERHEAD = 64 * 1024
+
+# 启动时分阶段加载的组件：ai_service 和 keyword_index 就绪后即可提供服务（关键词检索），
+# embedding_model 和 vector_index 就绪后切换为 BM25 + 向量混合检索
+STARTUP_COMPONENTS = ("ai_service", "keyword_index", "embedding_model", "vector_index")
+# 组件状态: pending / loading / ready / unavailable（依赖或模型不可用）/ remote（由独立检索进程提供）/ failed
+startup_state = {name: {"state": "pending"} for name in STARTUP_COMPONENTS}
+STARTED_AT = time.time()
+
+# 批量聊天请求中单行JSON允许的最大字节数
+CHAT_BATCH_MAX_LINE = 64 * 1024
+
+# 选择租户知识库的请求头（也可以用 tenant 参数），见 services/tenants.py
+TENANT_HEADER = "X-Tenant-ID"
+
+# pre-fork 模式：当前进程是否为工作进程，以及主进程上次检查时的知识库文件签名
+prefork_worker = False
+master_source_signature = None
+
+# 无论就绪与否都可以访问的接口（存活检查和就绪检查）
+UNGATED_PATHS = ("/api/health", "/api/ready")
+
+class LimitChatBodySize:
+    """
+    聊天请求体大小限制（ASGI中间件）：Content-Length 超限时在解析multipart之前直接拒绝；
+    没有 Content-Length（chunked 传输）或声明值不实时，边接收边计数，超限立即中止读取
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/api/chat":
+            await self.app(scope, receive, send)
+            return
+        limit = Config.MAX_IMAGE_SIZE + CHAT_FORM_OVERHEAD
+        detail = f"图片文件过大 (最大 {Config.MAX_IMAGE_SIZE/1024/1024:.1f}MB)"
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    print(f"❌ 聊天请求体超过限制: >{limit}")
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(LimitChatBodySize)
+
+@app.middleware("http")
+async def gate_until_serving(request: Request, call_next):
+    """关键词索引就绪之前，除存活/就绪检查外的API请求直接返回503"""
+    if ai_service is None and is_starting() and request.url.path.startswith("/api/") \
+            and request.url.path not in UNGATED_PATHS:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "服务正在启动，请稍后重试"},
+            headers={"Retry-After": "2"}
+        )
+    return await call_next(request)
+
+def create_ai_service(**kwargs):
+    """创建AI服务实例；services.ai_service（openai、numpy、知识库检索等）在这里才导入，
+    服务器不必等这些依赖加载完才开始监听端口"""
+    from services.ai_service import AIService
+    return AIService(**kwargs)
+
+def set_component_state(name: str, state: str, started: Optional[float] = None, error: Optional[str] = None):
+    """更新启动组件状态（started 为开始加载的时间，用于记录耗时）"""
+    entry = {"state": state}
+    if started is not None:
+        entry["seconds"] = round(time.time() - started, 2)
+    if error:
+        entry["error"] = error
+    startup_state[name] = entry
+
+def is_starting() -> bool:
+    """AI服务或关键词索引仍在加载"""
+    return any(startup_state[name]["state"] in ("pending", "loading") for name in ("ai_service", "keyword_index"))
+
+def load_vectors(knowledge_base):
+    """加载向量化模型并为已加载的文档生成向量索引"""
+    started = time.time()
+    set_component_state("embedding_model", "loading")
     try:
-        print("📚 正在加载知识库...")
-        start_time = time.time()
-
-        # 预加载AI服务
-        print("🤖 初始化AI服务...")
-        ai_service = AIService()
+        model = knowledge_base.load_embedding_model()
+        set_component_state("embedding_model", "ready" if model is not None else "unavailable", started)
+    except Exception as e:
+        print(f"⚠️ 向量化模型加载失败: {e}")
+        set_component_state("embedding_model", "failed", started, str(e))
+        model = None
+
+    if model is None:
+        set_component_state("vector_index", "unavailable")
+    elif startup_state["keyword_index"]["state"] == "ready":
+        started = time.time()
+        set_component_state("vector_index", "loading")
+        try:
+            knowledge_base.attach_vectors()
+            set_component_state("vector_index", "ready", started)
+        except Exception as e:
+            print(f"⚠️ 向量索引构建失败，继续使用关键词检索: {e}")
+            set_component_state("vector_index", "failed", started, str(e))
 
-        # 预加载知识库
-        print("📖 加载知识库数据...")
-        ai_service.knowledge_base.load_knowledge_base()
+def load_services(watch: bool = True):
+    """分阶段加载：AI服务 → 关键词索引（开始提供服务）→ 向量化模型 → 向量索引
 
-        load_time = time.time() - start_time
-        print(f"✅ AI模型和知识库预加载完成！耗时: {load_time:.2f}秒")
-        print(f"📊 知识库条目数: {len(ai_service.knowledge_base.documents)}")
-        print("🌐 Web服务器已准备就绪！")
+    配置了独立检索进程（RETRIEVAL_SIDECAR_SOCKET）时不加载向量化模型，检索进程不可用时使用关键词索引。
+    watch=False 时不启动知识库文件监控线程（pre-fork 模式下由各工作进程在 fork 之后启动）。
+    """
+    global ai_service
+    start_time = time.time()
 
+    started = time.time()
+    set_component_state("ai_service", "loading")
+    try:
+        service = create_ai_service(load_knowledge=False)
+        set_component_state("ai_service", "ready", started)
     except Exception as e:
-        print(f"❌ AI服务预加载失败: {e}")
-        print("⚠️ 系统将继续运行，但AI功能可能不可用")
+        print(f"❌ AI服务初始化失败: {e}")
         print("💡 请检查网络连接和API配置")
-        ai_service = None
+        set_component_state("ai_service", "failed", started, str(e))
+        set_component_state("keyword_index", "failed", error="AI服务初始化失败")
+        return
+    knowledge_base = service.knowledge_base
+
+    # 没有向量化模型时知识库只构建BM25索引，几秒内即可提供关键词检索
+    started = time.time()
+    set_component_state("keyword_index", "loading")
+    print("📖 加载知识库数据（关键词索引）...")
+    try:
+        knowledge_base.load_knowledge_base()
+        set_component_state("keyword_index", "ready", started)
+    except Exception as e:
+        print(f"❌ 知识库加载失败: {e}")
+        set_component_state("keyword_index", "failed", started, str(e))
+    ai_service = service
+    print(f"🌐 Web服务已可用（关键词检索），耗时: {time.time() - start_time:.2f}秒")
+
+    if Config.RETRIEVAL_SIDECAR_SOCKET:
+        # 向量化模型和向量索引在独立检索进程中（retrieval_server.py），这里只保留关键词索引用于回退
+        print(f"🔌 使用独立检索进程: {Config.RETRIEVAL_SIDECAR_SOCKET}")
+        set_component_state("embedding_model", "remote")
+        set_component_state("vector_index", "remote")
+    else:
+        load_vectors(knowledge_base)
+
+    # 知识库文件变化时自动重新加载
+    if watch:
+        knowledge_base.start_watcher()
+    print(f"✅ AI模型和知识库加载完成！耗时: {time.time() - start_time:.2f}秒")
+    print(f"📊 知识库条目数: {sum(knowledge_base.get_partition_stats().values())}")
+
+def init_worker():
+    """pre-fork 工作进程启动时调用（见 run.py --workers）
+
+    模型权重、文档存储和向量在主进程中加载，fork 后以写时复制的方式共享；
+    这里只重建不能跨 fork 使用的部分：锁和推理线程池。
+    工作进程不监控知识库文件：由主进程统一重新加载后重新 fork（见 reload_knowledge_in_master）。
+    """
+    global prefork_worker
+    prefork_worker = True
+    if ai_service is None:
+        return
+    ai_service.knowledge_base.after_fork(Config.WORKER_THREADS)
+
+def reload_knowledge_in_master(force: bool = False) -> bool:
+    """pre-fork 主进程中调用：知识库文件变化（或 force）时重新加载，返回索引是否已更新"""
+    global master_source_signature
+    if ai_service is None:
+        return False
+    knowledge_base = ai_service.knowledge_base
+    signature = knowledge_base._source_signature()
+    if master_source_signature is None:
+        master_source_signature = signature
+    if not force and signature == master_source_signature:
+        return False
+    master_source_signature = signature
+    return bool(knowledge_base.reload_knowledge_base().get("changed"))
+
+def ensure_knowledge_writable():
+    """单条写入只修改处理该请求的进程中的索引，无法同步到其他工作进程时拒绝写入"""
+    if prefork_worker:
+        raise HTTPException(
+            status_code=409,
+            detail="多进程模式下不支持在线修改知识库，请修改知识库文件后调用 /api/admin/knowledge/reload"
+        )
+
+@app.on_event("startup")
+async def startup_event():
+    """应用启动时加载AI服务和知识库
+
+    BACKGROUND_LOADING 开启时在后台线程中加载，服务器立即开始监听端口；
+    关键词索引就绪前API返回503，向量索引就绪前聊天使用关键词检索。
+    pre-fork 模式下主进程已经加载完成，工作进程直接提供服务。
+    """
+    if ai_service is not None:
+        return
+    if Config.BACKGROUND_LOADING:
+        print("🚀 系统启动中，AI模型和知识库在后台加载（进度见 /api/ready）...")
+        threading.Thread(target=load_services, name="startup-loader", daemon=True).start()
+    else:
+        print("🚀 系统启动中，正在预加载AI模型和知识库...")
+        load_services()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """关闭图片预处理进程池、知识库文件监控和检索进程连接"""
+    if ai_service is not None:
+        ai_service.image_pipeline.shutdown()
+        ai_service.knowledge_base.stop_watcher()
+        if ai_service.retrieval_client is not None:
+            await ai_service.retrieval_client.close()
 
 def get_ai_service():
     """获取AI服务实例"""
     global ai_service
     if ai_service is None:
+        if is_starting():
+            return None
         print("⚠️ AI服务未初始化，尝试重新初始化...")
         try:
-            ai_service = AIService()
+            ai_service = create_ai_service()
         except Exception as e:
             print(f"❌ AI服务初始化失败: {e}")
             return None
     return ai_service
 
+async def read_image_upload(image: UploadFile) -> Optional[bytes]:
+    """分块读取上传图片，超过大小限制立即中止，并根据文件头校验格式和尺寸"""
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"图片文件过大 (最大 {Config.MAX_IMAGE_SIZE/1024/1024:.1f}MB)"
+    )
+    if image.size is not None and image.size > Config.MAX_IMAGE_SIZE:
+        print(f"❌ 图片大小超过限制: {image.size} > {Config.MAX_IMAGE_SIZE}")
+        raise too_large
+
+    buffer = bytearray()
+    image_format = None
+    while True:
+        chunk = await image.read(Config.UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        if len(buffer) > Config.MAX_IMAGE_SIZE:
+            print(f"❌ 图片大小超过限制: >{Config.MAX_IMAGE_SIZE}")
+            raise too_large
+        if image_format is None and len(buffer) >= SNIFF_BYTES:
+            image_format = sniff_image_format(bytes(buffer[:SNIFF_BYTES]))
+            if image_format is None or image_format not in SUPPORTED_FORMATS:
+                print(f"❌ 不支持的图片类型: {image.content_type}")
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"只支持以下图片格式: {', '.join(Config.SUPPORTED_IMAGE_FORMATS)}"
+                )
+
+    if not buffer:
+        return None
+    if image_format is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"只支持以下图片格式: {', '.join(Config.SUPPORTED_IMAGE_FORMATS)}"
+        )
+
+    image_data = bytes(buffer)
+    print(f"📊 图片大小: {len(image_data)/1024:.2f}KB")
+
+    # 只解析文件头检查尺寸，避免解码超大像素的图片
+    try:
+        width, height = probe_image_size(image_data)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"图片文件已损坏: {e}")
+    if width * height > Config.MAX_IMAGE_PIXELS:
+        print(f"❌ 图片像素超过限制: {width}x{height}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"图片分辨率过大 ({width}x{height})"
+        )
+
+    return image_data
+
 @app.get("/favicon.ico")
 async def favicon():
     """返回favicon图标"""
@@ -98,40 +354,25 @@ async def home(request: Request):
 
 @app.post("/api/chat")
 async def chat(
+    request: Request,
     message: str = Form(...),
     image: Optional[UploadFile] = File(None),
     language: str = Form('zh'),
-    user_info: Optional[str] = Form(None)
+    user_info: Optional[str] = Form(None),
+    tenant: Optional[str] = Form(None)
 ):
-    """处理聊天请求"""
+    """处理聊天请求（tenant 参数或 X-Tenant-ID 请求头选择租户知识库）"""
     try:
-        # 处理图片上传
+        # 处理图片上传（格式以文件头为准，不信任content_type）
         image_data = None
-        if image and image.content_type:
-            # 验证图片格式
-            if not image.content_type.startswith('image/'):
-                print(f"❌ 不支持的图片类型: {image.content_type}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"只支持以下图片格式: {', '.join(Config.SUPPORTED_IMAGE_FORMATS)}"
-                )
-
-            # 读取图片数据
-            image_data = await image.read()
-            print(f"📊 图片大小: {len(image_data)/1024:.2f}KB")
-
-            # 验证图片大小
-            if len(image_data) > Config.MAX_IMAGE_SIZE:
-                print(f"❌ 图片大小超过限制: {len(image_data)} > {Config.MAX_IMAGE_SIZE}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"图片文件过大 (最大 {Config.MAX_IMAGE_SIZE/1024/1024:.1f}MB)"
-                )
+        if image is not None:
+            image_data = await read_image_upload(image)
 
         # 调用AI服务
         service = get_ai_service()
         if service is None:
             raise HTTPException(status_code=500, detail="AI服务未初始化")
+        tenant = resolve_tenant(service, request, tenant)
 
         # 检测消息语言，如果与当前语言设置不一致则更新
         if message and message.strip():
@@ -148,15 +389,130 @@ async def chat(
             user_question=message,
             image_data=image_data,
             lang=language,
-            user_info=user_info
+            user_info=user_info,
+            tenant=tenant
         )
         # 添加语言标识到响应中，供前端更新页面语言
         response['lang'] = language
         return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class RequestStreamingResponse(StreamingResponse):
+    """
+    一边读取请求体一边返回的流式响应。StreamingResponse 在 ASGI 2.4 之前会在后台监听连接断开，
+    监听会取走还没读取的请求体，所以这里和 2.4 一样只发送响应：客户端断开时读取请求体会抛出 ClientDisconnect
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+@app.post("/api/chat/batch")
+async def chat_batch(request: Request, concurrency: Optional[int] = None, tenant: Optional[str] = None):
+    """批量聊天：请求体为JSONL，每行 {"id", "message", "language", "user_info", "tenant"}
+
+    concurrency 只能调低本批的模型调用并发，所有批量请求合计不超过 CHAT_BATCH_CONCURRENCY。
+
+    结果按完成顺序以JSONL流式返回，每行带请求的 id（缺省时为行号，从0开始）；
+    单行格式错误只影响该行。tenant 参数或 X-Tenant-ID 请求头是没有 tenant 字段的行的默认租户。
+    """
+    service = get_ai_service()
+    if service is None:
+        raise HTTPException(status_code=500, detail="AI服务未初始化")
+    default_tenant = resolve_tenant(service, request, tenant)
+
+    limit_detail = f"批量请求超过限制（最大 {Config.CHAT_BATCH_MAX_BYTES} 字节、{Config.CHAT_BATCH_MAX_LINES} 行）"
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > Config.CHAT_BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=limit_detail)
+
+    # 边读取边处理：process_chat_batch 在进行中的请求过多时暂停读取，请求体不会整个留在内存中
+    limit_errors = []
+
+    async def requests():
+        line_no = 0
+        try:
+            async for line in read_body_lines(request, CHAT_BATCH_MAX_LINE,
+                                              Config.CHAT_BATCH_MAX_BYTES, Config.CHAT_BATCH_MAX_LINES):
+                if line is not None and not line.strip():
+                    continue
+                if line is None:
+                    item = {"error": f"单行超过 {CHAT_BATCH_MAX_LINE} 字节"}
+                else:
+                    try:
+                        item = json.loads(line)
+                    except ValueError as e:
+                        item = {"error": f"JSON格式错误: {e}"}
+                    if not isinstance(item, dict):
+                        item = {"error": "每行必须是JSON对象"}
+                item.setdefault("id", line_no)
+                if default_tenant:
+                    item.setdefault("tenant", default_tenant)
+                yield item
+                line_no += 1
+        except HTTPException as e:
+            # 响应已经开始，不能再返回413：已读取的行照常处理，最后一行报告超限
+            print(f"❌ 批量请求超过限制: {e.detail}")
+            limit_errors.append({"success": False, "status_code": e.status_code, "error": e.detail})
+
+    async def results():
+        async for result in service.process_chat_batch(requests(), concurrency=concurrency):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        for error in limit_errors:
+            yield json.dumps(error, ensure_ascii=False) + "\n"
+
+    return RequestStreamingResponse(results(), media_type="application/x-ndjson")
+
+async def read_body_lines(request: Request, max_line: int, max_bytes: Optional[int] = None,
+                          max_lines: Optional[int] = None):
+    """逐行读取请求体，超过 max_line 字节的行丢弃并产出 None；
+    请求体超过 max_bytes 字节或 max_lines 行时停止读取并抛出413"""
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"批量请求超过限制（最大 {max_bytes} 字节、{max_lines} 行）"
+    )
+    buffer = b""
+    oversized = False
+    received = 0
+    lines = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if max_bytes is not None and received > max_bytes:
+            raise too_large
+        buffer += chunk
+        while True:
+            newline = buffer.find(b"\n")
+            if newline < 0:
+                break
+            line, buffer = buffer[:newline], buffer[newline + 1:]
+            lines += 1
+            if max_lines is not None and lines > max_lines:
+                raise too_large
+            if oversized or len(line) > max_line:
+                oversized = False
+                yield None
+            else:
+                yield line.decode("utf-8", errors="replace")
+        if len(buffer) > max_line:
+            buffer = b""
+            oversized = True
+    if oversized or buffer:
+        lines += 1
+        if max_lines is not None and lines > max_lines:
+            raise too_large
+    if oversized:
+        yield None
+    elif buffer:
+        yield buffer.decode("utf-8", errors="replace")
+
 @app.post("/api/knowledge/add")
 async def add_knowledge(
     question: str = Form(...),
@@ -168,22 +524,126 @@ async def add_knowledge(
         service = get_ai_service()
         if service is None:
             raise HTTPException(status_code=500, detail="AI服务未初始化")
+        ensure_knowledge_writable()
 
-        result = service.add_to_knowledge_base(question, answer, category)
+        result = await service.add_to_knowledge_base_async(question, answer, category)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.put("/api/knowledge/{doc_id}")
+async def update_knowledge(
+    doc_id: str,
+    question: Optional[str] = Form(None),
+    answer: Optional[str] = Form(None),
+    category: Optional[str] = Form(None)
+):
+    """修改知识库文档（只修改提供的字段）"""
+    service = get_ai_service()
+    if service is None:
+        raise HTTPException(status_code=500, detail="AI服务未初始化")
+    ensure_knowledge_writable()
+
+    result = await service.update_knowledge_async(doc_id, question, answer, category)
+    if not result["success"] and result["error"].startswith("文档不存在"):
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.delete("/api/knowledge/{doc_id}")
+async def delete_knowledge(doc_id: str):
+    """删除知识库文档，检索立即不再返回该文档"""
+    service = get_ai_service()
+    if service is None:
+        raise HTTPException(status_code=500, detail="AI服务未初始化")
+    ensure_knowledge_writable()
+
+    result = await service.delete_knowledge_async(doc_id)
+    if not result["success"] and result["error"].startswith("文档不存在"):
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+def resolve_tenant(service, request: Request, tenant: Optional[str]) -> Optional[str]:
+    """请求选择的租户：tenant 参数优先，其次 X-Tenant-ID 请求头；都没有时使用默认知识库"""
+    tenant = tenant or request.headers.get(TENANT_HEADER)
+    if tenant and not service.tenants.exists(tenant):
+        raise HTTPException(status_code=404, detail=f"租户不存在: {tenant}")
+    return tenant
+
+def parse_filter_values(value: Optional[str]) -> Optional[list]:
+    """逗号分隔的过滤取值"""
+    if not value:
+        return None
+    values = [item.strip() for item in value.split(",") if item.strip()]
+    return values or None
+
 @app.get("/api/knowledge/search")
-async def search_knowledge(query: str, top_k: int = 5):
-    """搜索知识库"""
+async def search_knowledge(
+    request: Request,
+    query: str,
+    top_k: int = 5,
+    type: Optional[str] = None,
+    category: Optional[str] = None,
+    subcategory: Optional[str] = None,
+    lang: Optional[str] = None,
+    tenant: Optional[str] = None
+):
+    """搜索知识库，可按文档类型、分类、子分类过滤（多个取值用逗号分隔），lang 选择语言分区，
+    tenant 参数或 X-Tenant-ID 请求头选择租户知识库"""
     try:
         service = get_ai_service()
         if service is None:
             raise HTTPException(status_code=500, detail="AI服务未初始化")
-
-        result = service.search_knowledge_base(query, top_k)
+        tenant = resolve_tenant(service, request, tenant)
+
+        filters = {
+            "type": parse_filter_values(type),
+            "category": parse_filter_values(category),
+            "subcategory": parse_filter_values(subcategory)
+        }
+        result = await service.search_knowledge_base_async(query, top_k, {k: v for k, v in filters.items() if v},
+                                                           lang, tenant)
         return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/knowledge/search/batch")
+async def search_knowledge_batch(request: Request):
+    """多个查询一起搜索知识库：全部查询一次向量化，向量打分为一次矩阵乘法（或FAISS批量检索）
+
+    请求体为JSON: {"queries": [...], "top_k": 5, "filters": {"type": ..., "category": [...]}, "lang": ..., "tenant": ...}，
+    返回的 results 与 queries 一一对应。tenant 也可以用 X-Tenant-ID 请求头。
+    """
+    try:
+        service = get_ai_service()
+        if service is None:
+            raise HTTPException(status_code=500, detail="AI服务未初始化")
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="请求体必须是JSON")
+        if not isinstance(body, dict):
+            raise HTTPException(status_code=400, detail="请求体必须是JSON对象")
+
+        queries = body.get("queries")
+        if not isinstance(queries, list) or not queries or not all(isinstance(query, str) for query in queries):
+            raise HTTPException(status_code=400, detail="queries 必须是非空的字符串列表")
+        if len(queries) > Config.KNOWLEDGE_SEARCH_BATCH_MAX:
+            raise HTTPException(status_code=400, detail=f"一次最多 {Config.KNOWLEDGE_SEARCH_BATCH_MAX} 个查询")
+        top_k = body.get("top_k", 5)
+        if not isinstance(top_k, int) or top_k <= 0:
+            raise HTTPException(status_code=400, detail="top_k 必须是正整数")
+        filters = body.get("filters") or {}
+        if not isinstance(filters, dict):
+            raise HTTPException(status_code=400, detail="filters 必须是JSON对象")
+        tenant = resolve_tenant(service, request, body.get("tenant"))
+
+        return await service.search_knowledge_batch_async(queries, top_k, filters, body.get("lang"), tenant)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -217,16 +677,100 @@ async def update_settings(
         global ai_service
         if ai_service:
             print("🔄 重新初始化AI服务以应用新配置...")
-            ai_service = AIService()
+            ai_service = create_ai_service()
 
         return {"status": "success", "message": "API设置已更新"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/admin/router")
+async def router_status():
+    """查看模型端点健康状态和负载均衡权重"""
+    service = get_ai_service()
+    if service is None:
+        raise HTTPException(status_code=500, detail="AI服务未初始化")
+
+    return service.get_router_status()
+
+@app.get("/api/admin/images")
+async def image_stats():
+    """查看图片预处理耗时和图片缓存命中情况"""
+    service = get_ai_service()
+    if service is None:
+        raise HTTPException(status_code=500, detail="AI服务未初始化")
+
+    return service.get_image_stats()
+
+@app.get("/api/admin/prompt")
+async def prompt_stats():
+    """查看提示词消息前缀的稳定程度（前缀缓存命中的上限）"""
+    service = get_ai_service()
+    if service is None:
+        raise HTTPException(status_code=500, detail="AI服务未初始化")
+
+    return service.get_prompt_stats()
+
+@app.get("/api/admin/knowledge")
+async def knowledge_status():
+    """查看知识库索引版本、分区文档数、最近一次重新加载结果和检索耗时"""
+    service = get_ai_service()
+    if service is None:
+        raise HTTPException(status_code=500, detail="AI服务未初始化")
+
+    return service.get_knowledge_status()
+
+@app.get("/api/admin/tenants")
+async def tenant_stats():
+    """查看各租户知识库的加载状态、索引内存和检索耗时"""
+    service = get_ai_service()
+    if service is None:
+        raise HTTPException(status_code=500, detail="AI服务未初始化")
+
+    return service.get_tenant_stats()
+
+@app.post("/api/admin/knowledge/reload")
+async def reload_knowledge():
+    """重新加载知识库文件：在后台线程中构建新版本索引，完成后原子替换
+
+    pre-fork 模式下通知主进程重新加载，索引变化时主进程逐个重新启动工作进程。
+    """
+    service = get_ai_service()
+    if service is None:
+        raise HTTPException(status_code=500, detail="AI服务未初始化")
+    if prefork_worker:
+        os.kill(os.getppid(), signal.SIGHUP)
+        return {"changed": None, "scheduled": True, "message": "已通知主进程重新加载知识库"}
+
+    return await asyncio.to_thread(service.reload_knowledge_base)
+
 @app.get("/api/health")
 async def health_check():
-    """健康检查"""
+    """存活检查（进程在运行即返回200，不代表模型和索引已加载）"""
     return {"status": "healthy", "service": "多语言智能客服"}
 
+@app.get("/api/ready")
+async def readiness_check():
+    """就绪检查：各启动组件的加载状态
+
+    - ready: 全部组件加载完成（向量化模型不可用时为关键词检索模式）
+    - degraded: 已可提供服务，向量索引仍在加载或加载失败，检索只使用关键词索引
+    - starting / failed: 还不能提供服务，返回503
+    """
+    states = {name: entry["state"] for name, entry in startup_state.items()}
+    if ai_service is not None and states["keyword_index"] == "ready":
+        complete = all(state in ("ready", "unavailable", "remote") for state in states.values())
+        status = "ready" if complete else "degraded"
+    else:
+        status = "starting" if is_starting() else "failed"
+    return JSONResponse(
+        status_code=200 if status in ("ready", "degraded") else 503,
+        content={
+            "status": status,
+            "components": startup_state,
+            "uptime_seconds": round(time.time() - STARTED_AT, 2)
+        }
+    )
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -97,4 +97,4 @@ def main():
         print("💡 请下载模型: python download_model.py")
 
 if __name__ == "__main__":
-    main()    main()
\ No newline at end of file
+    main()
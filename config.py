@@ -15,19 +15,120 @@ class Config:
     TEXT_MODEL = TEXT_MODEL  # 使用AI千集模型
     VISION_MODEL = VISION_MODEL  # AI千集模型也支持视觉功能
     EMBEDDING_MODEL = "text-embedding-ada-002"  # 保持原有嵌入模型
+    CLASSIFICATION_MODEL = os.getenv("CLASSIFICATION_MODEL", "")  # 闲聊/语言分类模型，为空时使用TEXT_MODEL
+
+    # 多端点路由配置
+    # JSON列表，例如: [{"name": "a", "base_url": "http://host:8000/v1", "api_key": "...",
+    #                   "weight": 1, "models": {"text": "...", "vision": "...", "classification": "..."}}]
+    # 为空时使用上面的单一端点
+    MODEL_ENDPOINTS = os.getenv("MODEL_ENDPOINTS", "")
+    ROUTER_EWMA_ALPHA = 0.3  # 延迟/错误率EWMA平滑系数
+    ROUTER_ERROR_THRESHOLD = 0.5  # 错误率超过该值时端点进入冷却
+    ROUTER_COOLDOWN = 30  # 冷却时间（秒）
+    ROUTER_MAX_ATTEMPTS = 2  # 端点故障时最多尝试的端点数
 
     # 知识库配置
     KNOWLEDGE_BASE_PATH = "knowledge_base"
     VECTOR_DB_PATH = "vector_db"
+    KNOWLEDGE_SOURCE_LANG = "zh"  # 知识库源文件的语言
+    KNOWLEDGE_LANGUAGES = ["zh", "en", "hi"]  # 按语言分区加载的知识库
+    KNOWLEDGE_TRANSLATIONS_PATH = os.path.join("knowledge_base", "translations")  # 离线翻译结果目录
+    KNOWLEDGE_RELOAD_INTERVAL = float(os.getenv("KNOWLEDGE_RELOAD_INTERVAL", "10"))  # 知识库文件变化检测间隔（秒），0表示关闭
+    KNOWLEDGE_COMPACTION_RATIO = 0.2  # 删除/修改的文档占比超过该值时后台合并索引
+    KNOWLEDGE_DELTA_MAX_DOCS = 256  # 增量段文档数上限，超过后后台合并索引
+    KNOWLEDGE_SNAPSHOT_PATH = os.path.join(VECTOR_DB_PATH, "snapshot")  # 批量导入生成的快照，启动时合并
+
+    # 多租户知识库：TENANTS_PATH/<租户ID>/ 下放置该租户的 product_faq.json、product_categories.json
+    # （以及 translations/、snapshot/），首次请求时加载；加载后的文档和向量缓存在 TENANT_CACHE_PATH 下，
+    # 再次加载时内存映射向量，不重新向量化。已加载租户的索引超过内存预算时淘汰最久未使用的租户
+    TENANTS_PATH = os.path.join(KNOWLEDGE_BASE_PATH, "tenants")
+    TENANT_CACHE_PATH = os.path.join(VECTOR_DB_PATH, "tenants")
+    TENANT_MEMORY_BUDGET_MB = float(os.getenv("TENANT_MEMORY_BUDGET_MB", "512"))
+    TENANT_LATENCY_WINDOW = 1000  # 每个租户保留最近多少次检索耗时用于统计
+
+    # 启动配置：服务先监听端口并用关键词索引提供服务，向量化模型和向量索引在后台线程中加载
+    BACKGROUND_LOADING = os.getenv("BACKGROUND_LOADING", "true").lower() == "true"
+    STARTUP_READY_TIMEOUT = 300  # run.py 等待服务就绪的最长时间（秒）
+
+    # 多进程配置：WEB_WORKERS > 1 时主进程加载模型和索引后 fork 出工作进程，只读内存页在进程间共享
+    WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+    WORKER_THREADS = int(os.getenv("WORKER_THREADS", "1"))  # 每个工作进程的向量化推理线程数
+    WORKER_MEMORY_REPORT_INTERVAL = 300  # 主进程输出内存共享统计的间隔（秒），0表示只在启动时输出
+
+    # 独立检索进程（retrieval_server.py）：设置socket路径后，Web服务不加载向量化模型，
+    # 向量化和检索通过 Unix domain socket 交给检索进程，连接失败时回退到进程内关键词检索
+    RETRIEVAL_SIDECAR_SOCKET = os.getenv("RETRIEVAL_SIDECAR_SOCKET", "")
+    RETRIEVAL_SIDECAR_POOL_SIZE = 8  # 客户端连接池大小
+    RETRIEVAL_SIDECAR_TIMEOUT = 2.0  # 单次请求超时（秒）
+    RETRIEVAL_SIDECAR_MAX_BATCH = 64  # 检索进程一次向量化的最多查询数
+    RETRIEVAL_SIDECAR_BATCH_WAIT_MS = 2.0  # 检索进程合并并发查询的最长等待时间（毫秒）
+    RETRIEVAL_SIDECAR_THREADS = 4  # 检索进程执行检索的线程数
+
+    # 批量聊天（/api/chat/batch）：每 CHAT_BATCH_SIZE 个问题一起检索，同时进行的模型调用不超过 CHAT_BATCH_CONCURRENCY
+    CHAT_BATCH_SIZE = 32
+    CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+    CHAT_BATCH_MAX_BYTES = int(os.getenv("CHAT_BATCH_MAX_BYTES", str(32 * 1024 * 1024)))  # 单个批量请求体的最大字节数
+    CHAT_BATCH_MAX_LINES = int(os.getenv("CHAT_BATCH_MAX_LINES", "100000"))  # 单个批量请求的最多行数
+
+    # 批量导入配置（ingest_knowledge.py）
+    INGEST_BATCH_SIZE = 512  # 每批向量化的文档数
+    INGEST_CONCURRENCY = 4  # 并发读取的来源数
+    INGEST_CHUNK_SIZE = 256 * 1024  # 每次读取的字节数
+    INGEST_QUEUE_SIZE = 8  # 待向量化的文档块上限
+
+    # 文本向量化后端：torch 使用 SentenceTransformer；onnx 使用 export_onnx_model.py 导出的int8量化模型
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+    ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", os.path.join("model_cache", "onnx", "paraphrase-multilingual-MiniLM-L12-v2-int8"))
+    ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # ONNX Runtime 推理线程数，0表示使用默认值
+
+    # 检索配置：BM25 + 向量候选经倒数排名融合后，对前 RERANK_TOP_K 个候选重排
+    RETRIEVAL_CANDIDATES = 50  # 每路检索返回的候选数
+    RETRIEVAL_RRF_K = 60  # 倒数排名融合常数
+    RETRIEVAL_RERANKER = os.getenv("RETRIEVAL_RERANKER", "embedding")  # embedding: 向量余弦; cross_encoder: 交叉编码器; none: 不重排
+    RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+    RERANK_TOP_K = 20  # 参与重排的候选数
+    # 重排分数低于阈值的结果丢弃；两种重排器的分数尺度不同，分别设置
+    RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.35"))  # 向量重排：余弦相似度
+    CROSS_ENCODER_MIN_SCORE = float(os.getenv("CROSS_ENCODER_MIN_SCORE", "0.0"))  # 交叉编码器：模型原始输出（logit）
+    ANN_MIN_DOCS = 5000  # 文档数达到该值时使用FAISS HNSW近似检索，否则精确计算
+    ANN_HNSW_M = 32
+    ANN_EF_SEARCH = 64
+    VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "float32")  # float32; float16: 半精度; pq: 乘积量化（压缩编码常驻内存，float32向量在磁盘上）
+    PQ_SUBQUANTIZERS = 48  # 乘积量化的分段数（每个文档占用的字节数）
+    VECTOR_RESCORE_FACTOR = 10  # 压缩存储时用float32重新打分的候选数 = top_k × 该值
+    KNOWLEDGE_SEARCH_BATCH_MAX = 64  # /api/knowledge/search/batch 一次最多的查询数
 
     # 图片处理配置
     MAX_IMAGE_SIZE = 1024 * 1024  # 1MB
-    SUPPORTED_IMAGE_FORMATS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
+    SUPPORTED_IMAGE_FORMATS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
+    MAX_IMAGE_PIXELS = 40_000_000  # 上传图片的最大像素数（仅解析文件头判断）
+    UPLOAD_CHUNK_SIZE = 64 * 1024  # 上传文件分块读取大小
+    IMAGE_MAX_SIZE = 1024  # 发送给视觉模型的最长边（像素）
+    IMAGE_JPEG_QUALITY = 75  # 重新编码的JPEG质量
+    IMAGE_DETAIL_MODE = os.getenv("IMAGE_DETAIL_MODE", "adaptive")  # adaptive: 按问题类型选择分辨率; fixed: 固定尺寸
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))  # 图片预处理进程数，0表示使用线程池
+    IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 图片/回答缓存字节预算
+    IMAGE_CACHE_PHASH = os.getenv("IMAGE_CACHE_PHASH", "false").lower() == "true"  # 是否用感知哈希合并近似重复图片
+    IMAGE_CACHE_PHASH_DISTANCE = 4  # 感知哈希汉明距离阈值（64位）
 
     # 系统配置
     MAX_TOKENS = 2000
     TEMPERATURE = 0.7
 
+    # 提示词组装配置
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))  # 单次请求输入token预算（含系统提示词）
+    PROMPT_TOKENIZER = "cl100k_base"  # 本地tiktoken编码，不可用时按字符估算
+    PROMPT_CONTEXT_PRIORITY = ["knowledge_context", "conversation_context", "user_info"]  # 预算填充顺序
+    KNOWLEDGE_CONTEXT_TOP_K = 3  # 参与组装的知识库条目数
+    HISTORY_WINDOW_BLOCK = 6  # 历史消息窗口按该条数整块前移，保证消息前缀只追加（未启用滚动摘要时）
+    HISTORY_SUMMARY_ENABLED = os.getenv("HISTORY_SUMMARY_ENABLED", "true").lower() == "true"  # 是否启用滚动对话摘要
+    HISTORY_SUMMARY_THRESHOLD = int(os.getenv("HISTORY_SUMMARY_THRESHOLD", "1200"))  # 未摘要历史超过该token数时合并
+    HISTORY_SUMMARY_KEEP_MESSAGES = 4  # 合并时保留原文的最近消息条数
+    HISTORY_SUMMARY_MAX_TOKENS = 300  # 摘要最大token数
+    HISTORY_SELECTION = os.getenv("HISTORY_SELECTION", "recent")  # recent: 最近的对话（前缀稳定）; relevant: 按与当前问题的相似度选择历史
+    HISTORY_RELEVANT_TURNS = 3  # 除上一轮外最多选入的相关历史轮数
+    HISTORY_RELEVANCE_MIN_SCORE = 0.35  # 历史轮次入选的最低余弦相似度
+
     # 电商知识库配置
     TAOBAO_KNOWLEDGE_URLS = [
         "https://raw.githubusercontent.com/your-repo/taobao-knowledge/main/faq.json",
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+导出ONNX int8量化文本向量化模型，并与PyTorch模型对比检索效果
+
+步骤:
+    1. 用 SentenceTransformer 加载 paraphrase-multilingual-MiniLM-L12-v2，导出为 ONNX（float32）
+    2. onnxruntime 动态量化为 int8，保存 model.onnx + tokenizer.json
+    3. 用内置FAQ知识库对比两个后端：recall@k（ONNX前k个结果与PyTorch前k个结果的重合率）、
+       FAQ问题命中率、单条查询向量化耗时、模型加载后的内存增量
+
+用法:
+    python export_onnx_model.py              # 导出并验证
+    python export_onnx_model.py --verify-only --threads 2
+启用: EMBEDDING_BACKEND=onnx python run.py
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent))
+
+from config import Config  # noqa: E402
+
+MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+
+def rss_mb() -> float:
+    """当前进程常驻内存（MB）"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def export_model(output_dir: str, keep_fp32: bool = False):
+    """导出ONNX模型并做int8动态量化"""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    print(f"🔄 加载PyTorch模型: {MODEL_NAME}")
+    model = SentenceTransformer(MODEL_NAME, device="cpu")
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    fp32_path = os.path.join(output_dir, "model_fp32.onnx")
+    int8_path = os.path.join(output_dir, "model.onnx")
+
+    print("📦 导出ONNX模型...")
+    sample = tokenizer(["导出示例", "export sample"], padding=True, return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=14,
+        )
+
+    print("🗜️ int8动态量化...")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    if not keep_fp32:
+        os.remove(fp32_path)
+
+    # 只保留 tokenizer.json（tokenizers 库直接加载，不需要 transformers）
+    tokenizer_dir = os.path.join(output_dir, "_tokenizer")
+    tokenizer.save_pretrained(tokenizer_dir)
+    shutil.copy(os.path.join(tokenizer_dir, "tokenizer.json"), os.path.join(output_dir, "tokenizer.json"))
+    shutil.rmtree(tokenizer_dir, ignore_errors=True)
+
+    size = os.path.getsize(int8_path) / 1024 / 1024
+    print(f"✅ 已导出: {int8_path}（{size:.1f}MB）")
+
+
+def load_eval_set():
+    """内置FAQ知识库的文档，以及 (查询, 对应文档下标) 列表：FAQ问题、关键词、分类常见问题"""
+    from services.knowledge_base import KnowledgeBase
+
+    kb = KnowledgeBase(load_model=False)
+    documents = kb._read_source_documents(verbose=False)
+    documents = [doc for doc in documents if doc["lang"] == Config.KNOWLEDGE_SOURCE_LANG]
+
+    queries = []
+    for i, doc in enumerate(documents):
+        if doc["type"] == "faq":
+            queries.append((doc["question"], i))
+        for question in doc.get("common_questions", []):
+            queries.append((question, i))
+    return documents, queries
+
+
+def top_k(query_embeddings: np.ndarray, doc_embeddings: np.ndarray, k: int) -> np.ndarray:
+    scores = query_embeddings @ doc_embeddings.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def encode_latency_ms(model, texts, repeat: int = 1) -> float:
+    """单条查询逐条向量化的平均耗时"""
+    model.encode(texts[:5], convert_to_numpy=True, normalize_embeddings=True)  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            model.encode([text], convert_to_numpy=True, normalize_embeddings=True)
+    return (time.perf_counter() - start) * 1000 / (len(texts) * repeat)
+
+
+def verify(model_dir: str, threads: int, ks=(1, 3, 5), min_recall: float = 0.9) -> bool:
+    """对比ONNX int8与PyTorch后端的检索结果"""
+    from services.onnx_embedder import OnnxEmbedder
+
+    documents, queries = load_eval_set()
+    texts = [doc["content"] for doc in documents]
+    query_texts = [query for query, _ in queries]
+    expected = np.array([i for _, i in queries])
+    print(f"📚 评测集: {len(documents)} 个文档，{len(queries)} 条查询")
+
+    results = {}
+    # 先加载ONNX模型，内存增量不包含PyTorch
+    for backend in ("onnx", "torch"):
+        before = rss_mb()
+        start = time.perf_counter()
+        if backend == "onnx":
+            model = OnnxEmbedder(model_dir, threads)
+        else:
+            from sentence_transformers import SentenceTransformer
+            if threads > 0:
+                import torch
+                torch.set_num_threads(threads)
+            model = SentenceTransformer(MODEL_NAME, device="cpu")
+        load_seconds = time.perf_counter() - start
+        rss = rss_mb() - before
+
+        doc_embeddings = np.asarray(model.encode(texts, convert_to_numpy=True, normalize_embeddings=True), dtype=np.float32)
+        query_embeddings = np.asarray(model.encode(query_texts, convert_to_numpy=True, normalize_embeddings=True),
+                                      dtype=np.float32)
+        results[backend] = {
+            "top": top_k(query_embeddings, doc_embeddings, max(ks)),
+            "latency_ms": encode_latency_ms(model, query_texts),
+            "load_seconds": load_seconds,
+            "rss_mb": rss,
+        }
+
+    print(f"\n{'指标':<24}{'PyTorch':>12}{'ONNX int8':>12}")
+    for name, key, fmt in (("模型加载耗时(秒)", "load_seconds", "{:.2f}"),
+                           ("加载后内存增量(MB)", "rss_mb", "{:.0f}"),
+                           ("单条查询向量化(毫秒)", "latency_ms", "{:.2f}")):
+        print(f"{name:<20}{fmt.format(results['torch'][key]):>12}{fmt.format(results['onnx'][key]):>12}")
+    for k in ks:
+        hits = [np.mean([expected[i] in results[b]["top"][i, :k] for i in range(len(queries))]) for b in ("torch", "onnx")]
+        print(f"{f'FAQ命中率@{k}':<22}{hits[0]:>12.3f}{hits[1]:>12.3f}")
+
+    passed = True
+    print()
+    for k in ks:
+        overlap = np.mean([
+            len(set(results["onnx"]["top"][i, :k]) & set(results["torch"]["top"][i, :k])) / k
+            for i in range(len(queries))
+        ])
+        ok = overlap >= min_recall
+        passed &= ok
+        print(f"{'✅' if ok else '⚠️'} recall@{k}（相对PyTorch）: {overlap:.3f}")
+    speedup = results["torch"]["latency_ms"] / max(results["onnx"]["latency_ms"], 1e-9)
+    print(f"🚀 查询向量化加速: {speedup:.2f}x")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出ONNX int8文本向量化模型")
+    parser.add_argument("--output", default=Config.ONNX_MODEL_PATH, help="模型输出目录")
+    parser.add_argument("--threads", type=int, default=Config.ONNX_THREADS, help="推理线程数（0为默认）")
+    parser.add_argument("--verify-only", action="store_true", help="只对比已导出的模型")
+    parser.add_argument("--skip-verify", action="store_true", help="只导出，不对比")
+    parser.add_argument("--keep-fp32", action="store_true", help="保留量化前的float32模型")
+    parser.add_argument("--min-recall", type=float, default=0.9, help="recall@k 低于该值时返回非零退出码")
+    args = parser.parse_args()
+
+    if not args.verify_only:
+        export_model(args.output, args.keep_fp32)
+    if not args.skip_verify and not verify(args.output, args.threads, min_recall=args.min_recall):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
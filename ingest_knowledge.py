@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+外部知识库批量导入脚本
+并发流式读取JSON/JSONL文件或URL，批量向量化后写入知识库快照（vector_db/snapshot），
+服务启动时自动合并快照，无需重新向量化
+
+用法:
+    python ingest_knowledge.py dumps/faq_part1.jsonl https://example.com/faq.json --batch-size 1024
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from config import Config  # noqa: E402
+from services.kb_ingest import KnowledgeIngestor  # noqa: E402
+from services.knowledge_base import KnowledgeBase  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="外部知识库批量导入")
+    parser.add_argument("sources", nargs="*", default=Config.TAOBAO_KNOWLEDGE_URLS,
+                        help="JSON/JSONL文件路径或URL（默认 Config.TAOBAO_KNOWLEDGE_URLS）")
+    parser.add_argument("--output", default=Config.KNOWLEDGE_SNAPSHOT_PATH, help="快照输出目录")
+    parser.add_argument("--lang", default=Config.KNOWLEDGE_SOURCE_LANG, help="导入文档的语言分区")
+    parser.add_argument("--batch-size", type=int, default=Config.INGEST_BATCH_SIZE, help="每批向量化的文档数")
+    parser.add_argument("--concurrency", type=int, default=Config.INGEST_CONCURRENCY, help="并发读取的来源数")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="进度输出间隔（秒）")
+    args = parser.parse_args()
+
+    print(f"📥 开始导入 {len(args.sources)} 个来源 -> {args.output}")
+    start_time = time.time()
+
+    ingestor = KnowledgeIngestor(
+        KnowledgeBase(),
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        lang=args.lang,
+        progress_interval=args.progress_interval
+    )
+    result = asyncio.run(ingestor.ingest(args.sources, args.output))
+
+    print(f"✅ 快照已写入: {result['path']}（向量维度: {result['dim'] or '无'}）")
+    print(f"📊 条目 {result['items']}，文档 {result['documents']}，批次 {result['batches']}，"
+          f"读取 {result['bytes'] / 1024 / 1024:.1f}MB")
+    print(f"🚀 吞吐: {result['docs_per_second']} 文档/秒，{result['mb_per_second']} MB/秒，"
+          f"向量化耗时 {result['embed_seconds']}秒")
+    for failed in result["failed_sources"]:
+        print(f"❌ 失败: {failed['source']} ({failed['error']})")
+    print(f"⏱️ 总耗时: {time.time() - start_time:.2f}秒")
+    sys.exit(0 if result["success"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -42,9 +42,9 @@ def install_torch():
 
     # 尝试不同的安装方式
     commands = [
-        "pip install torch torchvision --index-url https://download.pytorch.org/whl/cpu",
-        "pip install torch torchvision",
-        "conda install pytorch torchvision cpuonly -c pytorch"
+        "pip install torch --index-url https://download.pytorch.org/whl/cpu",
+        "pip install torch",
+        "conda install pytorch cpuonly -c pytorch"
     ]
 
     for i, command in enumerate(commands):
@@ -62,11 +62,9 @@ def install_other_dependencies():
         "uvicorn",
         "python-multipart",
         "pillow",
-        "opencv-python",
         "transformers",
         "sentence-transformers",
         "faiss-cpu",
-        "pandas",
         "numpy",
         "requests",
         "python-dotenv",
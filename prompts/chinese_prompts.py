@@ -1,3 +1,6 @@
+from prompts.prompt_engine import get_template
+
+
 class ChinesePrompts:
     """多语言智能客服提示词系统"""
 
@@ -63,6 +66,70 @@ class ChinesePrompts:
 - 保持专业友好的态度
 - 保持对话的连贯性，参考之前的对话内容"""
 
+    # 多轮对话消息布局：静态说明放在系统消息中（跨轮次字节稳定，便于上游前缀缓存），
+    # 每轮变化的内容放在最后一条用户消息中
+    TEXT_CHAT_INSTRUCTIONS = """请根据每轮提供的知识库相关内容回答用户问题，并按照以下格式回答：
+1. 直接回答用户问题
+2. 如果涉及具体操作步骤，请详细说明
+3. 如果用户问题不明确，请主动询问更多信息
+4. 提供相关的建议或注意事项
+5. 保持对话的连贯性，参考之前的对话内容
+
+回答要求：
+- 语言简洁明了
+- 态度友好专业
+- 信息准确可靠
+- 提供实用的解决方案
+- 保持对话的连贯性和上下文理解"""
+
+    TEXT_CHAT_TURN_PROMPT = """用户信息：{user_info}
+
+知识库相关内容：
+{knowledge_context}
+
+用户问题：{user_question}"""
+
+    IMAGE_ANALYSIS_INSTRUCTIONS = """用户上传商品图片时，请分析图片中的商品信息，并回答用户的问题。
+
+请根据图片内容提供以下信息：
+1. 识别图片中的商品类型和特征
+2. 分析商品可能存在的问题或用户关注点
+3. 提供相关的购买建议或解决方案
+4. 如果涉及售后问题，给出处理建议
+
+回答要求：
+- 准确识别图片内容
+- 结合用户问题给出针对性建议
+- 提供实用的解决方案
+- 保持专业友好的态度
+- 保持对话的连贯性，参考之前的对话内容"""
+
+    IMAGE_ANALYSIS_TURN_PROMPT = """图片描述：{image_description}
+
+用户信息：{user_info}
+
+用户问题：{user_question}"""
+
+    # 滚动对话摘要：把较早的对话合并进摘要，摘要作为系统消息放在历史对话之前
+    CONVERSATION_SUMMARY_PROMPT = """请把以下客服对话合并进已有摘要，生成一份新的对话摘要。
+
+已有摘要：
+{previous_summary}
+
+对话主题：{topics}
+
+新增对话：
+{conversation}
+
+要求：
+- 保留用户的诉求、订单/商品信息、已给出的解决方案和尚未解决的问题
+- 省略寒暄和重复内容
+- 使用对话所用的语言，不超过200字
+- 只输出摘要内容"""
+
+    SUMMARY_CONTEXT_PROMPT = """此前对话摘要（主题：{topics}）：
+{summary}"""
+
     # 商品推荐提示词
     PRODUCT_RECOMMENDATION_PROMPT = """根据用户的需求和偏好，推荐合适的商品。
 
@@ -129,17 +196,27 @@ class ChinesePrompts:
 - 提供最优惠的购买方案
 - 说明优惠使用条件"""
 
+    # 提示词类型 -> 模板属性名
+    PROMPT_TEMPLATES = {
+        "text_chat": "TEXT_CHAT_PROMPT",
+        "image_analysis": "IMAGE_ANALYSIS_PROMPT",
+        "product_recommendation": "PRODUCT_RECOMMENDATION_PROMPT",
+        "after_sales": "AFTER_SALES_PROMPT",
+        "logistics_query": "LOGISTICS_QUERY_PROMPT",
+        "price_discount": "PRICE_DISCOUNT_PROMPT",
+        "text_chat_turn": "TEXT_CHAT_TURN_PROMPT",
+        "image_analysis_turn": "IMAGE_ANALYSIS_TURN_PROMPT",
+        "conversation_summary": "CONVERSATION_SUMMARY_PROMPT",
+        "summary_context": "SUMMARY_CONTEXT_PROMPT"
+    }
+
+    # 多轮消息布局中放入系统消息的静态说明
+    PROMPT_INSTRUCTIONS = {
+        "text_chat": "TEXT_CHAT_INSTRUCTIONS",
+        "image_analysis": "IMAGE_ANALYSIS_INSTRUCTIONS"
+    }
+
     @classmethod
     def get_prompt_by_type(cls, prompt_type: str, **kwargs):
-        """根据类型获取对应的提示词"""
-        prompt_map = {
-            "text_chat": cls.TEXT_CHAT_PROMPT,
-            "image_analysis": cls.IMAGE_ANALYSIS_PROMPT,
-            "product_recommendation": cls.PRODUCT_RECOMMENDATION_PROMPT,
-            "after_sales": cls.AFTER_SALES_PROMPT,
-            "logistics_query": cls.LOGISTICS_QUERY_PROMPT,
-            "price_discount": cls.PRICE_DISCOUNT_PROMPT
-        }
-
-        prompt_template = prompt_map.get(prompt_type, cls.TEXT_CHAT_PROMPT)
-        return prompt_template.format(**kwargs)
\ No newline at end of file
+        """根据类型获取对应的提示词（模板只在首次使用时编译）"""
+        return get_template(cls, prompt_type).render(**kwargs)
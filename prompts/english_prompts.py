@@ -1,3 +1,6 @@
+from prompts.prompt_engine import get_template
+
+
 class EnglishPrompts:
     """English prompts for enterprise customer service"""
 
@@ -38,16 +41,84 @@ Response requirements:
 - Provide practical solutions
 - Maintain conversation continuity and contextual understanding"""
 
-    @staticmethod
-    def get_prompt_by_type(prompt_type: str, **kwargs) -> str:
-        """Get prompt template based on type and fill with variables"""
-        templates = {
-            "text_chat": EnglishPrompts.TEXT_CHAT_PROMPT,
-            "image_analysis": (
-                "Image description: {image_description}\n\n"
-                "User Question: {user_question}\n\n"
-                "Conversation Context:\n{conversation_context}\n\n"
-                "Please answer the user's question based on the image."
-            )
-        }
-        return templates[prompt_type].format(**kwargs)
\ No newline at end of file
+    IMAGE_ANALYSIS_PROMPT = (
+        "Image description: {image_description}\n\n"
+        "User Question: {user_question}\n\n"
+        "Conversation Context:\n{conversation_context}\n\n"
+        "Please answer the user's question based on the image."
+    )
+
+    # Multi-turn message layout: static instructions live in the system message (byte-stable
+    # across turns for upstream prefix caching), per-turn content goes into the last user message
+    TEXT_CHAT_INSTRUCTIONS = """Please answer the user's question based on the relevant knowledge base content provided with each turn.
+
+Response format:
+1. Answer the user's question directly
+2. If involving specific steps, explain in detail
+3. If the user question is unclear, proactively ask for more information
+4. Provide relevant suggestions or precautions
+5. Maintain conversation continuity, reference previous conversation content
+
+Response requirements:
+- Communication can only be conducted in English
+- Use concise language
+- Maintain a professional and friendly attitude
+- Ensure information is accurate and reliable
+- Provide practical solutions
+- Maintain conversation continuity and contextual understanding"""
+
+    TEXT_CHAT_TURN_PROMPT = """User information: {user_info}
+
+Relevant knowledge base content:
+{knowledge_context}
+
+User Question: {user_question}"""
+
+    IMAGE_ANALYSIS_INSTRUCTIONS = "When the user uploads an image, please answer the user's question based on the image."
+
+    IMAGE_ANALYSIS_TURN_PROMPT = (
+        "Image description: {image_description}\n\n"
+        "User Question: {user_question}"
+    )
+
+    # Rolling conversation summary: older turns are folded into a summary that is sent
+    # as a system message ahead of the recent turns
+    CONVERSATION_SUMMARY_PROMPT = """Merge the following customer service conversation into the existing summary and write an updated summary.
+
+Existing summary:
+{previous_summary}
+
+Topics: {topics}
+
+New conversation:
+{conversation}
+
+Requirements:
+- Keep the user's requests, order/product details, solutions already given and open issues
+- Drop greetings and repetition
+- Use the language of the conversation, at most 120 words
+- Output only the summary"""
+
+    SUMMARY_CONTEXT_PROMPT = (
+        "Summary of the earlier conversation (topics: {topics}):\n"
+        "{summary}"
+    )
+
+    PROMPT_TEMPLATES = {
+        "text_chat": "TEXT_CHAT_PROMPT",
+        "image_analysis": "IMAGE_ANALYSIS_PROMPT",
+        "text_chat_turn": "TEXT_CHAT_TURN_PROMPT",
+        "image_analysis_turn": "IMAGE_ANALYSIS_TURN_PROMPT",
+        "conversation_summary": "CONVERSATION_SUMMARY_PROMPT",
+        "summary_context": "SUMMARY_CONTEXT_PROMPT"
+    }
+
+    PROMPT_INSTRUCTIONS = {
+        "text_chat": "TEXT_CHAT_INSTRUCTIONS",
+        "image_analysis": "IMAGE_ANALYSIS_INSTRUCTIONS"
+    }
+
+    @classmethod
+    def get_prompt_by_type(cls, prompt_type: str, **kwargs) -> str:
+        """Get prompt template based on type and fill with variables (templates are compiled once)"""
+        return get_template(cls, prompt_type).render(**kwargs)
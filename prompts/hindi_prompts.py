@@ -1,3 +1,6 @@
+from prompts.prompt_engine import get_template
+
+
 class HindiPrompts:
     """Hindi prompts for enterprise customer service"""
 
@@ -36,16 +39,82 @@ class HindiPrompts:
 - व्यावहारिक समाधान प्रदान करें
 - वार्तालाप की निरंतरता और संदर्भपूर्ण समझ बनाए रखें"""
 
-    @staticmethod
-    def get_prompt_by_type(prompt_type: str, **kwargs) -> str:
-        """Get prompt template based on type and fill with variables"""
-        templates = {
-            "text_chat": HindiPrompts.TEXT_CHAT_PROMPT,
-            "image_analysis": (
-                "छवि विवरण: {image_description}\n\n"
-                "उपयोगकर्ता प्रश्न: {user_question}\n\n"
-                "वार्तालाप संदर्भ:\n{conversation_context}\n\n"
-                "कृपया छवि के आधार पर उपयोगकर्ता के प्रश्न का उत्तर दें।"
-            )
-        }
-        return templates[prompt_type].format(**kwargs)
\ No newline at end of file
+    IMAGE_ANALYSIS_PROMPT = (
+        "छवि विवरण: {image_description}\n\n"
+        "उपयोगकर्ता प्रश्न: {user_question}\n\n"
+        "वार्तालाप संदर्भ:\n{conversation_context}\n\n"
+        "कृपया छवि के आधार पर उपयोगकर्ता के प्रश्न का उत्तर दें।"
+    )
+
+    # Multi-turn message layout: static instructions live in the system message (byte-stable
+    # across turns for upstream prefix caching), per-turn content goes into the last user message
+    TEXT_CHAT_INSTRUCTIONS = """कृपया हर बार दी गई प्रासंगिक ज्ञान आधार सामग्री के आधार पर उपयोगकर्ता के प्रश्न का उत्तर दें।
+
+उत्तर प्रारूप:
+1. सीधे उपयोगकर्ता के प्रश्न का उत्तर दें
+2. यदि विशिष्ट चरण शामिल हैं, तो विस्तार से समझाएं
+3. यदि उपयोगकर्ता का प्रश्न अस्पष्ट है, तो सक्रिय रूप से अधिक जानकारी मांगें
+4. प्रासंगिक सुझाव या सावधानियां प्रदान करें
+5. वार्तालाप की निरंतरता बनाए रखें, पिछले वार्तालाप सामग्री का संदर्भ लें
+
+उत्तर आवश्यकताएँ:
+- केवल हिंदी में संवाद करें
+- संक्षिप्त भाषा का प्रयोग करें
+- पेशेवर और मित्रवत रवैया बनाए रखें
+- सुनिश्चित करें कि जानकारी सटीक और विश्वसनीय है
+- व्यावहारिक समाधान प्रदान करें
+- वार्तालाप की निरंतरता और संदर्भपूर्ण समझ बनाए रखें"""
+
+    TEXT_CHAT_TURN_PROMPT = """उपयोगकर्ता जानकारी: {user_info}
+
+प्रासंगिक ज्ञान आधार सामग्री:
+{knowledge_context}
+
+उपयोगकर्ता प्रश्न: {user_question}"""
+
+    IMAGE_ANALYSIS_INSTRUCTIONS = "जब उपयोगकर्ता छवि अपलोड करे, तो कृपया छवि के आधार पर उपयोगकर्ता के प्रश्न का उत्तर दें।"
+
+    IMAGE_ANALYSIS_TURN_PROMPT = (
+        "छवि विवरण: {image_description}\n\n"
+        "उपयोगकर्ता प्रश्न: {user_question}"
+    )
+
+    CONVERSATION_SUMMARY_PROMPT = """निम्नलिखित ग्राहक सेवा बातचीत को मौजूदा सारांश में जोड़कर एक नया सारांश लिखें।
+
+मौजूदा सारांश:
+{previous_summary}
+
+विषय: {topics}
+
+नई बातचीत:
+{conversation}
+
+आवश्यकताएं:
+- उपयोगकर्ता की मांगें, ऑर्डर/उत्पाद जानकारी, दिए गए समाधान और अनसुलझे मुद्दे रखें
+- अभिवादन और दोहराव छोड़ दें
+- बातचीत की भाषा का उपयोग करें, अधिकतम 120 शब्द
+- केवल सारांश लिखें"""
+
+    SUMMARY_CONTEXT_PROMPT = (
+        "पिछली बातचीत का सारांश (विषय: {topics}):\n"
+        "{summary}"
+    )
+
+    PROMPT_TEMPLATES = {
+        "text_chat": "TEXT_CHAT_PROMPT",
+        "image_analysis": "IMAGE_ANALYSIS_PROMPT",
+        "text_chat_turn": "TEXT_CHAT_TURN_PROMPT",
+        "image_analysis_turn": "IMAGE_ANALYSIS_TURN_PROMPT",
+        "conversation_summary": "CONVERSATION_SUMMARY_PROMPT",
+        "summary_context": "SUMMARY_CONTEXT_PROMPT"
+    }
+
+    PROMPT_INSTRUCTIONS = {
+        "text_chat": "TEXT_CHAT_INSTRUCTIONS",
+        "image_analysis": "IMAGE_ANALYSIS_INSTRUCTIONS"
+    }
+
+    @classmethod
+    def get_prompt_by_type(cls, prompt_type: str, **kwargs) -> str:
+        """Get prompt template based on type and fill with variables (templates are compiled once)"""
+        return get_template(cls, prompt_type).render(**kwargs)
@@ -0,0 +1,313 @@
+import json
+import os
+import re
+import string
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from config import Config
+
+# 尝试导入tiktoken，如果失败则使用按字符类别估算的计数方式
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+
+# 估算模式下的分词规则：CJK/天城文每个字符算一个token，拉丁字母和数字每4个字符算一个token
+_TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff\u3400-\u4dbf\u0900-\u097f]|[A-Za-z0-9]+|[^\sA-Za-z0-9]")
+
+
+class TokenCounter:
+    """本地token计数器，优先使用tiktoken"""
+
+    def __init__(self, encoding_name: Optional[str] = None):
+        self._encoding = None
+        if TIKTOKEN_AVAILABLE:
+            try:
+                self._encoding = tiktoken.get_encoding(encoding_name or Config.PROMPT_TOKENIZER)
+            except Exception:
+                self._encoding = None
+
+    @staticmethod
+    def _piece_tokens(piece: str) -> int:
+        if piece[0].isascii() and piece[0].isalnum():
+            return (len(piece) + 3) // 4
+        return 1
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return sum(self._piece_tokens(m.group()) for m in _TOKEN_PATTERN.finditer(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截断到最多 max_tokens 个token（保留开头，结果确定）"""
+        if max_tokens <= 0 or not text:
+            return ""
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            return self._encoding.decode(tokens[:max_tokens]).rstrip("\ufffd")
+
+        used = 0
+        for match in _TOKEN_PATTERN.finditer(text):
+            used += self._piece_tokens(match.group())
+            if used > max_tokens:
+                return text[:match.start()]
+        return text
+
+
+class CompiledTemplate:
+    """预编译的提示词模板：解析一次，渲染时只做字符串拼接"""
+
+    def __init__(self, template: str, counter: TokenCounter):
+        self.segments: List[Tuple[str, Optional[str]]] = [
+            (literal, field) for literal, field, _, _ in string.Formatter().parse(template)
+        ]
+        self.fields = [field for _, field in self.segments if field]
+        self.static_tokens = counter.count("".join(literal for literal, _ in self.segments))
+
+    def render(self, **values: Any) -> str:
+        parts = []
+        for literal, field in self.segments:
+            parts.append(literal)
+            if field:
+                value = values.get(field)
+                parts.append("" if value is None else str(value))
+        return "".join(parts)
+
+
+# 所有语言共享的模板缓存：(提示词类, 提示词类型) -> CompiledTemplate
+_TEMPLATE_CACHE: Dict[Tuple[type, str], CompiledTemplate] = {}
+_SYSTEM_MESSAGE_CACHE: Dict[Tuple[type, str], Tuple[str, int]] = {}
+_DEFAULT_COUNTER: Optional[TokenCounter] = None
+
+
+def get_token_counter() -> TokenCounter:
+    global _DEFAULT_COUNTER
+    if _DEFAULT_COUNTER is None:
+        _DEFAULT_COUNTER = TokenCounter()
+    return _DEFAULT_COUNTER
+
+
+def get_template(prompt_cls: type, prompt_type: str) -> CompiledTemplate:
+    """获取预编译模板，未知类型回退到 text_chat"""
+    key = (prompt_cls, prompt_type)
+    compiled = _TEMPLATE_CACHE.get(key)
+    if compiled is None:
+        templates = prompt_cls.PROMPT_TEMPLATES
+        attr = templates.get(prompt_type, templates["text_chat"])
+        compiled = CompiledTemplate(getattr(prompt_cls, attr), get_token_counter())
+        _TEMPLATE_CACHE[key] = compiled
+    return compiled
+
+
+def get_system_message(prompt_cls: type, prompt_type: str) -> Tuple[str, int]:
+    """多轮消息布局的系统消息：系统提示词 + 该类型的静态说明（跨轮次保持不变），返回 (内容, token数)"""
+    key = (prompt_cls, prompt_type)
+    cached = _SYSTEM_MESSAGE_CACHE.get(key)
+    if cached is None:
+        message = prompt_cls.SYSTEM_PROMPT
+        instructions = getattr(prompt_cls, "PROMPT_INSTRUCTIONS", {}).get(prompt_type)
+        if instructions:
+            message = f"{message}\n\n{getattr(prompt_cls, instructions)}"
+        cached = (message, get_token_counter().count(message))
+        _SYSTEM_MESSAGE_CACHE[key] = cached
+    return cached
+
+
+class PrefixStabilityTracker:
+    """统计相邻请求之间消息前缀的稳定程度
+
+    stable_ratio：本次请求与上一次请求的最长公共前缀（按序列化字符计）占本次请求总长度的比例；
+    prefix_reused：上一次请求除最后一条消息外的全部消息是否原样出现在本次请求开头。
+    """
+
+    def __init__(self):
+        self._previous: List[str] = []
+        self.requests = 0
+        self.prefix_reused = 0
+        self.ratio_sum = 0.0
+        self.last_ratio = 0.0
+
+    @staticmethod
+    def _serialize(message: Dict[str, Any]) -> str:
+        content = message.get("content")
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False, sort_keys=True)
+        return f"{message.get('role')}\x00{content}"
+
+    def observe(self, messages: Sequence[Dict[str, Any]]) -> float:
+        current = [self._serialize(message) for message in messages]
+        total = sum(len(item) for item in current) or 1
+
+        common = 0
+        for previous, item in zip(self._previous, current):
+            if previous != item:
+                common += len(os.path.commonprefix([previous, item]))
+                break
+            common += len(item)
+
+        stable_prefix = self._previous[:-1]
+        if self._previous and current[:len(stable_prefix)] == stable_prefix:
+            self.prefix_reused += 1
+
+        ratio = common / total
+        self._previous = current
+        self.requests += 1
+        self.ratio_sum += ratio
+        self.last_ratio = ratio
+        return ratio
+
+    def stats(self) -> Dict[str, Any]:
+        compared = max(self.requests - 1, 1)
+        return {
+            "requests": self.requests,
+            "avg_stable_ratio": round(self.ratio_sum / max(self.requests, 1), 4),
+            "last_stable_ratio": round(self.last_ratio, 4),
+            "prefix_reuse_rate": round(self.prefix_reused / compared, 4)
+        }
+
+
+class PromptEngine:
+    """按token预算组装提示词
+
+    问题等固定字段完整保留；知识库上下文、对话上下文、用户信息按
+    Config.PROMPT_CONTEXT_PRIORITY 的顺序依次填入剩余预算：
+    - 列表字段按条目整体放入，放不下的第一条截断后停止（对话上下文保留最近的条目）
+    - 字符串字段直接截断
+    """
+
+    # 预算不足时保留最近条目的字段
+    KEEP_LATEST = {"conversation_context"}
+    SEPARATORS = {"knowledge_context": "\n\n", "conversation_context": "\n"}
+    # 截断后剩余不足该token数的条目直接丢弃
+    MIN_PARTIAL_TOKENS = 16
+
+    def __init__(self, token_budget: Optional[int] = None, counter: Optional[TokenCounter] = None):
+        self.token_budget = token_budget or Config.PROMPT_TOKEN_BUDGET
+        self.counter = counter or get_token_counter()
+        self.priority = list(Config.PROMPT_CONTEXT_PRIORITY)
+
+    def _fit_items(self, name: str, items: Sequence[str], budget: int) -> Tuple[str, int]:
+        separator = self.SEPARATORS.get(name, "\n")
+        separator_tokens = self.counter.count(separator)
+        ordered = list(reversed(items)) if name in self.KEEP_LATEST else list(items)
+
+        kept, used = [], 0
+        for item in ordered:
+            cost = self.counter.count(item) + (separator_tokens if kept else 0)
+            if used + cost <= budget:
+                kept.append(item)
+                used += cost
+                continue
+            remaining = budget - used - (separator_tokens if kept else 0)
+            if remaining >= self.MIN_PARTIAL_TOKENS:
+                kept.append(self.counter.truncate(item, remaining))
+                used = budget
+            break
+
+        if name in self.KEEP_LATEST:
+            kept.reverse()
+        return separator.join(kept), used
+
+    def _fit_history(self, history: Sequence[Dict[str, Any]], budget: int) -> Tuple[List[Dict[str, str]], int]:
+        """保留预算内的历史消息（整条保留或丢弃，不截断）
+
+        超出预算时从开头按 HISTORY_WINDOW_BLOCK 条整块丢弃，块边界按消息序号（seq）对齐：
+        历史只在末尾增长时保留起点只会整块前移，两次前移之间消息前缀保持字节稳定。
+        最后一块也放不下时才退回到逐条保留最近的消息。
+        """
+        costs = [item.get("tokens") or self.counter.count(item["content"]) for item in history]
+        block = max(1, Config.HISTORY_WINDOW_BLOCK)
+        start, used = 0, sum(costs)
+        while used > budget and start < len(history):
+            seq = history[start].get("seq", start)
+            end = min(start + (seq // block + 1) * block - seq, len(history))
+            used -= sum(costs[start:end])
+            start = end
+
+        if start >= len(history):
+            # 最近一块超出预算：保留放得下的最近消息
+            start, used = len(history), 0
+            while start > 0 and used + costs[start - 1] <= budget:
+                start -= 1
+                used += costs[start]
+        return [{"role": item["role"], "content": item["content"]} for item in history[start:]], used
+
+    def _fill(self, template: CompiledTemplate, usage: Dict[str, int], fields: Dict[str, Any],
+              history: Optional[Sequence[Dict[str, Any]]] = None) -> Tuple[Dict[str, Any], List[Dict[str, str]]]:
+        """固定字段完整保留，其余字段按优先级填入剩余预算"""
+        values: Dict[str, Any] = {}
+        for name, value in fields.items():
+            if name not in self.priority:
+                values[name] = value
+                usage[name] = self.counter.count("" if value is None else str(value))
+
+        history_messages: List[Dict[str, str]] = []
+        remaining = self.token_budget - sum(usage.values())
+        for name in self.priority:
+            if history is not None and name == "conversation_context":
+                history_messages, used = self._fit_history(history, max(remaining, 0))
+                usage[name] = used
+                remaining -= used
+                continue
+            if name not in template.fields:
+                continue
+            value = fields.get(name)
+            if not value:
+                values[name] = ""
+                continue
+            items = [value] if isinstance(value, str) else list(value)
+            values[name], used = self._fit_items(name, items, max(remaining, 0))
+            usage[name] = used
+            remaining -= used
+
+        usage["total"] = sum(usage.values())
+        return values, history_messages
+
+    def build_prompt(self, prompt_cls: type, prompt_type: str,
+                     **fields: Union[str, Sequence[str], None]) -> Tuple[str, Dict[str, int]]:
+        """渲染单条提示词，返回 (提示词, 各部分token用量)"""
+        template = get_template(prompt_cls, prompt_type)
+        usage = {
+            "system": self.counter.count(prompt_cls.SYSTEM_PROMPT),
+            "template": template.static_tokens
+        }
+        values, _ = self._fill(template, usage, fields)
+        return template.render(**values), usage
+
+    def build_messages(self, prompt_cls: type, prompt_type: str, history: Sequence[Dict[str, Any]],
+                       summary: Optional[str] = None, summary_topics: Sequence[str] = (),
+                       **fields: Union[str, Sequence[str], None]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """组装前缀稳定的多轮消息，返回 (消息列表, 各部分token用量)
+
+        消息顺序：系统消息（系统提示词 + 静态说明）→ 对话摘要（可选）→ 历史对话（只在末尾追加）→
+        本轮用户消息（用户信息、知识库上下文、问题）。对话摘要完整保留，历史对话按
+        conversation_context 的优先级参与预算分配。
+        """
+        system_message, system_tokens = get_system_message(prompt_cls, prompt_type)
+        template = get_template(prompt_cls, f"{prompt_type}_turn")
+        usage = {
+            "system": system_tokens,
+            "template": template.static_tokens
+        }
+
+        summary_message = None
+        if summary:
+            summary_message = get_template(prompt_cls, "summary_context").render(
+                summary=summary, topics=", ".join(summary_topics) or "-"
+            )
+            usage["summary"] = self.counter.count(summary_message)
+
+        values, history_messages = self._fill(template, usage, fields, history)
+
+        messages = [{"role": "system", "content": system_message}]
+        if summary_message:
+            messages.append({"role": "system", "content": summary_message})
+        messages.extend(history_messages)
+        messages.append({"role": "user", "content": template.render(**values)})
+        return messages, usage
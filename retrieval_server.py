@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+独立检索进程
+加载向量化模型和知识库索引，通过 Unix domain socket 为Web服务提供批量向量化和检索，
+模型推理不再与Web服务的请求处理争用GIL，两者可以分别扩容
+
+用法:
+    python retrieval_server.py --socket /tmp/ai_customer_retrieval.sock
+    RETRIEVAL_SIDECAR_SOCKET=/tmp/ai_customer_retrieval.sock python run.py
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from config import Config  # noqa: E402
+from services.knowledge_base import KnowledgeBase  # noqa: E402
+from services.retrieval_ipc import MSGPACK_AVAILABLE, RetrievalServer  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="独立检索进程")
+    parser.add_argument("--socket", default=Config.RETRIEVAL_SIDECAR_SOCKET or "/tmp/ai_customer_retrieval.sock",
+                        help="Unix domain socket 路径（默认 RETRIEVAL_SIDECAR_SOCKET）")
+    parser.add_argument("--max-batch", type=int, default=Config.RETRIEVAL_SIDECAR_MAX_BATCH,
+                        help="一次向量化的最多查询数")
+    parser.add_argument("--batch-wait-ms", type=float, default=Config.RETRIEVAL_SIDECAR_BATCH_WAIT_MS,
+                        help="合并并发查询的最长等待时间（毫秒）")
+    parser.add_argument("--threads", type=int, default=Config.RETRIEVAL_SIDECAR_THREADS, help="检索线程数")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    knowledge_base = KnowledgeBase()
+    knowledge_base.load_knowledge_base()
+    knowledge_base.start_watcher()
+    print(f"✅ 知识库加载完成，耗时: {time.time() - start_time:.2f}秒")
+    print(f"📦 消息编码: {'msgpack' if MSGPACK_AVAILABLE else 'JSON（未安装msgpack）'}")
+
+    server = RetrievalServer(knowledge_base, args.socket, args.max_batch, args.batch_wait_ms, args.threads)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("👋 检索服务已停止")
+    finally:
+        knowledge_base.stop_watcher()
+
+
+if __name__ == "__main__":
+    main()
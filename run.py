@@ -3,6 +3,7 @@
 多语言智能客服系统启动脚本
 """
 
+import argparse
 import os
 import sys
 import threading
@@ -19,47 +20,75 @@ sys.path.append(str(Path(__file__).parent))  # 确保当前目录在PYTHONPATH
 from api.main import app  # 显式导入app
 
 
-def open_browser():
-    """等待系统完全启动后打开浏览器"""
-    print("⏳ 等待系统完全启动...")
-
-    # 增加等待时间，因为AI模型加载可能需要更长时间
-    print("🔄 正在预加载AI模型和知识库，这可能需要几分钟...")
-    time.sleep(15)  # 等待15秒
-    # 检查服务器是否真的启动
-    max_retries = 15  # 增加重试次数
-    for i in range(max_retries):
+def wait_until_ready(url: str = 'http://localhost:8000/api/ready', timeout: float = Config.STARTUP_READY_TIMEOUT):
+    """轮询就绪检查接口，组件状态变化时打印进度；返回最后一次的就绪状态（超时返回None）"""
+    deadline = time.time() + timeout
+    last_states = None
+    while time.time() < deadline:
         try:
-            print(f"🔍 检查服务器状态... ({i+1}/{max_retries})")
-            response = requests.get('http://localhost:8000/api/health', timeout=5)  # 增加超时时间
+            response = requests.get(url, timeout=2)
+            data = response.json()
+            states = {name: entry["state"] for name, entry in data["components"].items()}
+            if states != last_states:
+                print("🔍 启动进度: " + ", ".join(f"{name}={state}" for name, state in states.items()))
+                last_states = states
             if response.status_code == 200:
-                print("✅ 系统启动完成！")
-                break
-        except requests.exceptions.ConnectionError:
-            if i < max_retries - 1:
-                print(f"⏳ 服务器尚未启动，继续等待... ({i+1}/{max_retries})")
-                time.sleep(3)  # 增加等待间隔
-            else:
-                print("⚠️ 服务器启动超时，但仍尝试打开浏览器")
-        except Exception as e:
-            if i < max_retries - 1:
-                print(f"⚠️ 连接检查失败: {e}，继续等待... ({i+1}/{max_retries})")
-                time.sleep(3)
-            else:
-                print(f"❌ 连接检查最终失败: {e}")
+                return data
+            if data["status"] == "failed":
+                print("❌ AI服务加载失败，请查看服务器日志")
+                return data
+        except requests.exceptions.RequestException:
+            pass  # 服务器尚未开始监听
+        time.sleep(0.5)
+    return None
+
+
+def open_browser():
+    """服务可以处理请求后打开浏览器"""
+    print("⏳ 等待系统启动...")
+    start_time = time.time()
+    data = wait_until_ready()
+    if data is None:
+        print("⚠️ 服务器启动超时，但仍尝试打开浏览器")
+    elif data["status"] == "degraded":
+        print(f"✅ 系统已可用（耗时 {time.time() - start_time:.1f}秒），向量索引仍在后台加载，暂时使用关键词检索")
+    elif data["status"] == "ready":
+        print(f"✅ 系统启动完成！耗时 {time.time() - start_time:.1f}秒")
 
     try:
         print("🌐 正在打开浏览器...")
         webbrowser.open('http://localhost:8000')
-        print("✅ 浏览器已打开！系统完全准备就绪！")
+        print("✅ 浏览器已打开！")
         print("🎉 现在可以开始使用智能客服系统了！")
         print("💡 如果浏览器没有自动打开，请手动访问: http://localhost:8000")
     except Exception as e:
         print(f"⚠️ 自动打开浏览器失败: {e}")
         print("💡 请手动访问: http://localhost:8000")
 
+def run_prefork(workers: int):
+    """主进程加载模型和知识库后 fork 出多个工作进程，模型权重和索引在进程间共享"""
+    from api import main as api_main
+    from services.prefork import PreforkServer
+
+    print(f"📝 多进程模式：主进程先加载AI模型和知识库，再启动 {workers} 个工作进程")
+    api_main.load_services(watch=False)
+    if api_main.ai_service is None:
+        print("❌ AI服务加载失败，无法启动工作进程")
+        return
+
+    browser_thread = threading.Thread(target=open_browser)
+    browser_thread.daemon = True
+    PreforkServer(app, host="0.0.0.0", port=8000, workers=workers,
+                  after_fork=api_main.init_worker, log_level="info",
+                  reload=api_main.reload_knowledge_in_master).run(on_started=browser_thread.start)
+
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="多语言智能客服系统")
+    parser.add_argument("--workers", type=int, default=Config.WEB_WORKERS,
+                        help="工作进程数，大于1时模型和索引只加载一次并在进程间共享（默认读取 WEB_WORKERS）")
+    args = parser.parse_args()
+
     print("🚀 启动多语言智能客服系统...")
 
     # 检查API配置
@@ -72,8 +101,14 @@ def main():
         Path(dir_name).mkdir(exist_ok=True)
 
     print("✅ 环境检查完成")
+    if args.workers > 1:
+        if hasattr(os, "fork"):
+            run_prefork(args.workers)
+            return
+        print("⚠️ 当前系统不支持 fork，使用单进程模式")
+
     print("🌐 启动Web服务器...")
-    print("📝 注意：首次启动时AI模型加载可能需要几分钟，请耐心等待...")
+    print("📝 注意：AI模型在后台加载，加载完成前使用关键词检索")
 
     # 启动浏览器线程
     browser_thread = threading.Thread(target=open_browser)
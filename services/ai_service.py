@@ -1,25 +1,35 @@
 import asyncio
-import base64
-import io
 import json
 import logging
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Union
 
+import numpy as np
 import openai
-from PIL import Image
 
 from config import Config  # 确保Config可用
 from prompts.chinese_prompts import ChinesePrompts
 from prompts.english_prompts import EnglishPrompts
 from prompts.hindi_prompts import HindiPrompts
+from prompts.prompt_engine import PrefixStabilityTracker, PromptEngine
+from services.conversation_memory import ConversationMemory
+from services.image_cache import ImageCache, content_hash
+from services.image_pipeline import ImagePipeline
 from services.knowledge_base import KnowledgeBase
+from services.model_router import ModelRouter
+from services.retrieval_ipc import RetrievalClient, RetrievalError, RetrievalUnavailable
+from services.tenants import TenantRegistry
+
+
+# 各语言的提示词
+PROMPT_CLASSES = {'zh': ChinesePrompts, 'en': EnglishPrompts, 'hi': HindiPrompts}
 
 
 class AIService:
     """AI服务类，处理文字和图片查询"""
 
-    def __init__(self):
+    def __init__(self, load_knowledge: bool = True):
+        """load_knowledge=False 时不加载向量化模型和知识库，由调用方分阶段加载（见 api/main.py）"""
         print("🤖 初始化AI服务...")
         self.config = Config()
         self.logger = logging.getLogger(__name__)
@@ -27,19 +37,41 @@ class AIService:
         print("🔧 初始化API客户端...")
 
         print(f"✅ 使用API: {self.config.TEXT_MODEL}")
-        self.client = openai.OpenAI(
-            api_key=self.config.AIQIANJI_API_KEY,
-            base_url=self.config.AIQIANJI_BASE_URL
-        )
+        # 多端点路由器，按请求类型分池并做延迟感知的负载均衡
+        self.router = ModelRouter.from_config(self.config)
+        print(f"🔀 已配置 {len(self.router.endpoints)} 个模型端点")
 
         print("📚 初始化知识库...")
         # 初始化知识库
-        self.knowledge_base = KnowledgeBase()
-        self.knowledge_base.load_knowledge_base()
+        self.knowledge_base = KnowledgeBase(load_model=load_knowledge)
+        if load_knowledge:
+            self.knowledge_base.load_knowledge_base()
+
+        # 多租户知识库：默认租户即上面的知识库，其他租户首次请求时加载
+        self.tenants = TenantRegistry(self.knowledge_base)
+
+        # 独立检索进程的客户端；未配置或连接失败时使用进程内检索
+        self.retrieval_client = RetrievalClient(self.config.RETRIEVAL_SIDECAR_SOCKET) \
+            if self.config.RETRIEVAL_SIDECAR_SOCKET else None
+
+        # 所有批量聊天共用的模型调用并发上限（CHAT_BATCH_CONCURRENCY），不挤占交互式聊天；首次使用时创建
+        self.batch_governor: Optional[asyncio.Semaphore] = None
+
+        # 图片预处理流水线（进程池）
+        self.image_pipeline = ImagePipeline()
+        # 按图片内容哈希缓存预处理结果和视觉回答
+        self.image_cache = ImageCache()
+
+        # 按token预算组装提示词，并统计相邻请求间消息前缀的稳定程度
+        self.prompt_engine = PromptEngine()
+        self.prefix_trackers = {"text": PrefixStabilityTracker(), "vision": PrefixStabilityTracker()}
 
         # 对话历史管理
         self.conversation_history = []
         self.max_history_length = 10  # 保留最近10轮对话
+        self.history_dropped = 0  # 已从历史记录开头移除的消息数
+        # 滚动对话摘要：较早的对话在后台合并为摘要，每轮输入token保持平稳
+        self.memory = ConversationMemory(self.router, self._extract_topics)
 
         print("✅ AI服务初始化完成！")
 
@@ -49,35 +81,193 @@ class AIService:
             "role": role,
             "content": content,
             "timestamp": time.time(),
-            "has_image": image_data is not None
+            "has_image": image_data is not None,
+            "tokens": self.prompt_engine.counter.count(content),
+            "seq": self.history_dropped + len(self.conversation_history),  # 消息序号，按块裁剪历史时对齐块边界
+            "embedding": None  # 按相关度选择历史时才计算（见 _embed_history）
         }
 
         self.conversation_history.append(conversation_item)
 
         # 保持历史记录在合理长度内
         if len(self.conversation_history) > self.max_history_length * 2:  # 用户和AI各一条
-            self.conversation_history = self.conversation_history[-self.max_history_length * 2:]
+            overflow = len(self.conversation_history) - self.max_history_length * 2
+            if self.memory.enabled:
+                # 尚未合并进摘要的消息保留到摘要完成
+                overflow = min(overflow, max(0, self.memory.summarized_until - self.history_dropped))
+            self.conversation_history = self.conversation_history[overflow:]
+            self.history_dropped += overflow
+
+    def _history_candidates(self) -> List[Dict[str, Any]]:
+        """可按相关度选择的历史消息：启用滚动摘要时不包括已合并进摘要的消息"""
+        if self.memory.enabled:
+            return self.memory.unsummarized(self.conversation_history, self.history_dropped)
+        return self.conversation_history
+
+    def _unembedded_history(self) -> List[Dict[str, Any]]:
+        """尚未向量化的候选历史消息（空消息不计算向量，选择历史时跳过）"""
+        return [item for item in self._history_candidates()
+                if item.get("embedding") is None and item["content"].strip()]
+
+    @staticmethod
+    def _attach_history_embeddings(pending: List[Dict[str, Any]], embeddings) -> Optional[np.ndarray]:
+        """保存历史消息向量（每条只向量化一次），返回最后一行的问题向量"""
+        if embeddings is None:
+            return None
+        for item, embedding in zip(pending, embeddings):
+            item["embedding"] = embedding
+        return embeddings[-1]
+
+    def _embed_history(self, question: str) -> Optional[np.ndarray]:
+        """为尚未向量化的历史消息和当前问题一次生成向量，返回问题向量（失败或没有模型时返回None）"""
+        pending = self._unembedded_history()
+        try:
+            embeddings = self.knowledge_base.encode_texts([item["content"] for item in pending] + [question])
+        except Exception as e:
+            self.logger.warning(f"历史消息向量化失败: {str(e)}")
+            return None
+        return self._attach_history_embeddings(pending, embeddings)
 
-    def get_conversation_context(self) -> str:
-        """获取对话上下文"""
-        if not self.conversation_history:
-            return ""
+    async def encode_texts_async(self, texts: List[str]) -> Optional[np.ndarray]:
+        """异步向量化：配置了检索进程时由检索进程完成（与检索查询合并批次），否则在线程池中执行"""
+        if self.retrieval_client is not None:
+            try:
+                return await self.retrieval_client.encode(texts)
+            except (RetrievalUnavailable, RetrievalError) as e:
+                self.logger.warning(f"检索进程不可用，使用进程内向量化: {str(e)}")
+        return await asyncio.get_running_loop().run_in_executor(None, self.knowledge_base.encode_texts, texts)
+
+    async def get_history_messages_async(self, question: Optional[str]) -> List[Dict[str, Any]]:
+        """异步请求使用的 get_history_messages：向量化不阻塞事件循环"""
+        if not question or self.config.HISTORY_SELECTION != "relevant" or \
+                len(self._group_turns(self._history_candidates())) <= self.config.HISTORY_RELEVANT_TURNS + 1:
+            return self.get_history_messages()
+        pending = self._unembedded_history()
+        try:
+            embeddings = await self.encode_texts_async([item["content"] for item in pending] + [question])
+        except Exception as e:
+            self.logger.warning(f"历史消息向量化失败: {str(e)}")
+            return self.get_history_messages()
+        query_embedding = self._attach_history_embeddings(pending, embeddings)
+        if query_embedding is None:
+            return self.get_history_messages()
+        return self.get_history_messages(question, query_embedding)
+
+    @staticmethod
+    def _group_turns(history: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """把历史消息按 用户消息 + 后续助手回答 分组为轮次"""
+        turns: List[List[Dict[str, Any]]] = []
+        for item in history:
+            if item["role"] == "user" or not turns:
+                turns.append([item])
+            else:
+                turns[-1].append(item)
+        return turns
+
+    def _select_relevant_history(self, question: str,
+                                 query_embedding: Optional[np.ndarray] = None) -> Optional[List[Dict[str, Any]]]:
+        """选择与当前问题最相关的历史轮次，外加紧邻的上一轮（按时间顺序返回）
+
+        query_embedding 为异步请求中已经生成的问题向量（见 get_history_messages_async），否则在这里向量化。
+        向量化模型不可用时返回None，由调用方退回按时间选择。
+        """
+        turns = self._group_turns(self._history_candidates())
+        if len(turns) <= self.config.HISTORY_RELEVANT_TURNS + 1:
+            return None
+        if query_embedding is None:
+            query_embedding = self._embed_history(question)
+            if query_embedding is None:
+                return None
+
+        # 轮次得分取用户消息和助手回答中相似度较高者；没有向量的消息（空消息）不参与打分
+        scored = []
+        for index, turn in enumerate(turns[:-1]):
+            scores = [float(np.dot(query_embedding, item["embedding"])) for item in turn
+                      if item.get("embedding") is not None]
+            if scores and max(scores) >= self.config.HISTORY_RELEVANCE_MIN_SCORE:
+                scored.append((max(scores), index))
+        scored.sort(reverse=True)
+
+        selected = sorted(index for _, index in scored[:self.config.HISTORY_RELEVANT_TURNS])
+        selected.append(len(turns) - 1)
+        return [item for index in selected for item in turns[index]]
+
+    def get_history_messages(self, question: Optional[str] = None,
+                             query_embedding: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """获取放入消息前缀的历史对话
+
+        HISTORY_SELECTION=relevant 且传入当前问题时，只从尚未合并进摘要的历史中选择与问题相关的轮次和上一轮
+        （相关轮次随问题变化，消息前缀不再稳定，因此默认按时间选择）；
+        启用滚动摘要时返回尚未合并进摘要的全部消息（摘要完成前只在末尾追加）；
+        否则窗口起点按 HISTORY_WINDOW_BLOCK 条消息整块前移，相邻两轮之间历史只在末尾追加，
+        消息前缀保持字节稳定；窗口内保留 [block, 2*block) 条消息。
+        """
+        if question and self.config.HISTORY_SELECTION == "relevant":
+            selected = self._select_relevant_history(question, query_embedding)
+            if selected is not None:
+                return selected
+
+        if self.memory.enabled:
+            return self.memory.unsummarized(self.conversation_history, self.history_dropped)
 
+        block = self.config.HISTORY_WINDOW_BLOCK
+        total = self.history_dropped + len(self.conversation_history)
+        start = max(0, (total // block - 1) * block)
+        return self.conversation_history[max(0, start - self.history_dropped):]
+
+    def get_conversation_lines(self) -> List[str]:
+        """获取对话上下文条目（按时间顺序）"""
         context_parts = []
         for item in self.conversation_history[-6:]:  # 只取最近6条记录
             role_name = "用户" if item["role"] == "user" else "助手"
             context_parts.append(f"{role_name}: {item['content']}")
+        return context_parts
+
+    def get_conversation_context(self) -> str:
+        """获取对话上下文"""
+        return "\n".join(self.get_conversation_lines())
 
-        return "\n".join(context_parts)
+    def _build_messages(self, prompt_cls, prompt_type: str, knowledge_entries: List[str],
+                        image_url: Optional[Dict[str, str]] = None,
+                        history: Optional[List[Dict[str, Any]]] = None, **fields) -> List[Dict[str, Any]]:
+        """按token预算组装前缀稳定的多轮消息，记录各部分用量和前缀稳定度
+
+        history 为异步请求中已选好的历史（见 get_history_messages_async），否则在这里选择。
+        """
+        if history is None:
+            history = self.get_history_messages(fields.get("user_question"))
+        messages, usage = self.prompt_engine.build_messages(
+            prompt_cls,
+            prompt_type,
+            history,
+            summary=self.memory.summary,
+            summary_topics=self.memory.topics,
+            knowledge_context=knowledge_entries,
+            **fields
+        )
+        # 未摘要历史超过阈值时在后台合并，下一轮请求使用新摘要
+        self.memory.maybe_schedule(
+            self.conversation_history, self.history_dropped, prompt_cls, self.max_history_length * 2
+        )
+        if image_url is not None:
+            messages[-1]["content"] = [
+                {"type": "text", "text": messages[-1]["content"]},
+                {"type": "image_url", "image_url": image_url}
+            ]
+
+        tracker = self.prefix_trackers["vision" if image_url is not None else "text"]
+        stable_ratio = tracker.observe(messages)
+        self.logger.info(f"提示词token用量: {usage} 前缀稳定度: {stable_ratio:.2%}")
+        return messages
 
     def process_text_query(self, user_question: str, lang: str = 'zh', user_info: Optional[str] = None) -> Dict[str, Any]:
         """处理文字查询"""
         try:
-            # 从知识库获取相关上下文
-            knowledge_context = self.knowledge_base.get_context_for_query(user_question)
-
-            # 获取对话历史上下文
-            conversation_context = self.get_conversation_context()
+            # 从知识库获取相关上下文条目
+            knowledge_entries = self.knowledge_base.get_context_entries(
+                user_question, top_k=self.config.KNOWLEDGE_CONTEXT_TOP_K, lang=lang
+            )
+            knowledge_context = "\n\n".join(knowledge_entries)
 
             # 根据语言选择提示词
             if lang == 'zh':
@@ -90,21 +280,18 @@ class AIService:
                 prompt_cls = ChinesePrompts  # 默认使用中文
 
             # 构建提示词 - 添加用户信息
-            prompt = prompt_cls.get_prompt_by_type(
+            messages = self._build_messages(
+                prompt_cls,
                 "text_chat",
+                knowledge_entries,
                 user_question=user_question,
-                user_info=user_info,  # 新增用户信息参数
-                knowledge_context=knowledge_context,
-                conversation_context=conversation_context
+                user_info=user_info
             )
 
             # 调用AI千集API
-            response = self.client.chat.completions.create(
-                model=self.config.TEXT_MODEL,
-                messages=[
-                    {"role": "system", "content": prompt_cls.SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt}
-                ],
+            response = self.router.chat_completion(
+                "text",
+                messages=messages,
                 max_tokens=self.config.MAX_TOKENS,
                 temperature=self.config.TEMPERATURE,
                 extra_body={"chat_template_kwargs": {"thinking": False}}
@@ -120,7 +307,7 @@ class AIService:
                 "success": True,
                 "answer": answer,
                 "knowledge_context": knowledge_context,
-                "model_used": self.config.TEXT_MODEL,
+                "model_used": response.model or self.config.TEXT_MODEL,
                 "conversation_length": len(self.conversation_history)
             }
 
@@ -136,11 +323,10 @@ class AIService:
     def process_image_query(self, image_data: bytes, user_question: str, lang: str = 'zh', user_info: Optional[str] = None) -> Dict[str, Any]:
         """处理图片查询"""
         try:
-            # 处理图片
+            # 处理图片：解码、压缩并转换为base64
             try:
-                image = Image.open(io.BytesIO(image_data))
-                if image.format.lower() not in [fmt.strip('.') for fmt in Config.SUPPORTED_IMAGE_FORMATS]:
-                    raise ValueError(f"不支持的图片格式: {image.format}")
+                options = self.image_pipeline.select_options(image_data, user_question)
+                processed = self.image_pipeline.process_sync(image_data, **options)
             except Exception as e:
                 print(f"❌ 图片处理失败: {str(e)}")
                 return {
@@ -149,35 +335,11 @@ class AIService:
                     "answer": "抱歉，无法处理您上传的图片，请检查图片格式是否正确"
                 }
 
-            # 压缩图片以符合API要求
-            try:
-                image = self._resize_image(image)
-            except Exception as e:
-                print(f"❌ 图片压缩失败: {str(e)}")
-                return {
-                    "success": False,
-                    "error": f"图片压缩失败: {str(e)}",
-                    "answer": "抱歉，处理图片时出现错误"
-                }
-
-            # 转换为base64
-            try:
-                buffered = io.BytesIO()
-                image.save(buffered, format="JPEG" if image.format.lower() in ['jpg', 'jpeg'] else image.format)
-                img_base64 = base64.b64encode(buffered.getvalue()).decode()
-            except Exception as e:
-                print(f"❌ 图片编码失败: {str(e)}")
-                return {
-                    "success": False,
-                    "error": f"图片编码失败: {str(e)}",
-                    "answer": "抱歉，处理图片时出现错误"
-                }
-
-            # 从知识库获取相关上下文
-            knowledge_context = self.knowledge_base.get_context_for_query(user_question)
-
-            # 获取对话历史上下文
-            conversation_context = self.get_conversation_context()
+            # 从知识库获取相关上下文条目
+            knowledge_entries = self.knowledge_base.get_context_entries(
+                user_question, top_k=self.config.KNOWLEDGE_CONTEXT_TOP_K, lang=lang
+            )
+            knowledge_context = "\n\n".join(knowledge_entries)
 
             # 根据语言选择提示词
             if lang == 'zh':
@@ -197,32 +359,20 @@ class AIService:
                 image_desc = "उपयोगकर्ता द्वारा अपलोड की गई उत्पाद छवि"
 
             # 构建提示词 - 添加用户信息
-            prompt = prompt_cls.get_prompt_by_type(
+            messages = self._build_messages(
+                prompt_cls,
                 "image_analysis",
+                knowledge_entries,
+                image_url={"url": processed["data_url"], "detail": options["detail"]},
                 image_description=image_desc,
                 user_question=user_question,
-                user_info=user_info,  # 新增用户信息参数
-                conversation_context=conversation_context
+                user_info=user_info
             )
 
             # 调用OpenAI Vision API
-            response = self.client.chat.completions.create(
-                model=self.config.VISION_MODEL,
-                messages=[
-                    {"role": "system", "content": prompt_cls.SYSTEM_PROMPT},
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{img_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ],
+            response = self.router.chat_completion(
+                "vision",
+                messages=messages,
                 max_tokens=self.config.MAX_TOKENS,
                 temperature=self.config.TEMPERATURE
             )
@@ -237,7 +387,7 @@ class AIService:
                 "success": True,
                 "answer": answer,
                 "knowledge_context": knowledge_context,
-                "model_used": self.config.VISION_MODEL,
+                "model_used": response.model or self.config.VISION_MODEL,
                 "image_processed": True,
                 "conversation_length": len(self.conversation_history)
             }
@@ -249,24 +399,6 @@ class AIService:
                 "answer": "抱歉，处理图片时出现了错误，请检查图片格式或稍后重试。"
             }
 
-    def _resize_image(self, image: Image.Image, max_size: int = 1024) -> Image.Image:
-        """调整图片大小"""
-        # 获取图片尺寸
-        width, height = image.size
-
-        # 如果图片太大，按比例缩小
-        if width > max_size or height > max_size:
-            if width > height:
-                new_width = max_size
-                new_height = int(height * max_size / width)
-            else:
-                new_height = max_size
-                new_width = int(width * max_size / height)
-
-            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-        return image
-
     def classify_query_type(self, user_question: str) -> str:
         """分类查询类型"""
         query_lower = user_question.lower()
@@ -334,8 +466,8 @@ class AIService:
             chat_prompt = f"""请判断用户输入是否为闲聊（与博彩APP无关的问候、寒暄等）。如果是闲聊请回复"是"，否则回复"否"。
 用户输入: {user_question}"""
 
-            response = self.client.chat.completions.create(
-                model=self.config.TEXT_MODEL,
+            response = self.router.chat_completion(
+                "classification",
                 messages=[
                     {"role": "system", "content": "你是一个分类器，只需回答'是'或'否'。"},
                     {"role": "user", "content": chat_prompt}
@@ -378,8 +510,8 @@ class AIService:
             ]
 
             # 调用AI千集API
-            response = self.client.chat.completions.create(
-                model=self.config.TEXT_MODEL,
+            response = self.router.chat_completion(
+                "text",
                 messages=messages,
                 max_tokens=self.config.MAX_TOKENS,
                 temperature=self.config.TEMPERATURE
@@ -396,8 +528,9 @@ class AIService:
                 "error": str(e)
             }
 
-    async def get_enhanced_response(self, user_question: str, image_data: Optional[bytes] = None, lang: str = 'zh', user_info: Optional[str] = None) -> Dict[str, Any]:
-        """获取增强回复，失败时用本地关键词兜底（并发版本）"""
+    async def get_enhanced_response(self, user_question: str, image_data: Optional[bytes] = None, lang: str = 'zh',
+                                    user_info: Optional[str] = None, tenant: Optional[str] = None) -> Dict[str, Any]:
+        """获取增强回复，失败时用本地关键词兜底（并发版本）；tenant 选择租户知识库"""
         try:
             # 检查是否为闲聊
             if not image_data and self.is_chitchat_by_model(user_question):
@@ -431,9 +564,9 @@ class AIService:
 
             # 并发处理图片和文本请求
             if image_data:
-                return await self.process_image_query_async(image_data, user_question, lang, user_info)
+                return await self.process_image_query_async(image_data, user_question, lang, user_info, tenant)
             else:
-                return await self.process_text_query_async(user_question, lang, user_info)
+                return await self.process_text_query_async(user_question, lang, user_info, tenant)
 
         except Exception as e:
             # 兜底本地关键词回复
@@ -448,7 +581,8 @@ class AIService:
                 "conversation_length": len(self.conversation_history)
             }
 
-    async def process_text_query_async(self, user_question: str, lang: str = 'zh', user_info: Optional[str] = None) -> Dict[str, Any]:
+    async def process_text_query_async(self, user_question: str, lang: str = 'zh', user_info: Optional[str] = None,
+                                       tenant: Optional[str] = None) -> Dict[str, Any]:
         """异步处理文字查询（带错误重试）"""
         # 最大重试次数和初始延迟
         max_retries = 3
@@ -456,9 +590,9 @@ class AIService:
 
         for attempt in range(max_retries):
             try:
-                # 并发获取知识库上下文和对话历史
-                knowledge_context = self.knowledge_base.get_context_for_query(user_question)
-                conversation_context = self.get_conversation_context()
+                # 从知识库获取相关上下文条目
+                knowledge_entries = await self.get_context_entries_async(user_question, lang, tenant)
+                knowledge_context = "\n\n".join(knowledge_entries)
 
                 # 根据语言选择提示词
                 if lang == 'zh':
@@ -470,27 +604,20 @@ class AIService:
                 else:
                     prompt_cls = ChinesePrompts  # 默认使用中文
 
-                # 构建提示词
-                prompt = prompt_cls.get_prompt_by_type(
+                # 构建提示词（按相关度选择历史时先在线程池中向量化）
+                messages = self._build_messages(
+                    prompt_cls,
                     "text_chat",
+                    knowledge_entries,
+                    history=await self.get_history_messages_async(user_question),
                     user_question=user_question,
-                    user_info=user_info,
-                    knowledge_context=knowledge_context,
-                    conversation_context=conversation_context
+                    user_info=user_info
                 )
 
-                # 使用异步客户端调用API
-                async_client = openai.AsyncOpenAI(
-                    api_key=self.config.AIQIANJI_API_KEY,
-                    base_url=self.config.AIQIANJI_BASE_URL
-                )
-
-                response = await async_client.chat.completions.create(
-                    model=self.config.TEXT_MODEL,
-                    messages=[
-                        {"role": "system", "content": prompt_cls.SYSTEM_PROMPT},
-                        {"role": "user", "content": prompt}
-                    ],
+                # 通过路由器异步调用API
+                response = await self.router.achat_completion(
+                    "text",
+                    messages=messages,
                     max_tokens=self.config.MAX_TOKENS,
                     temperature=self.config.TEMPERATURE
                 )
@@ -505,7 +632,7 @@ class AIService:
                     "success": True,
                     "answer": answer,
                     "knowledge_context": knowledge_context,
-                    "model_used": self.config.TEXT_MODEL,
+                    "model_used": response.model or self.config.TEXT_MODEL,
                     "conversation_length": len(self.conversation_history)
                 }
 
@@ -544,23 +671,52 @@ class AIService:
                     "answer": "抱歉，处理您的问题时出现了错误，请稍后重试。"
                 }
 
-    async def process_image_query_async(self, image_data: bytes, user_question: str, lang: str = 'zh', user_info: Optional[str] = None) -> Dict[str, Any]:
+    async def process_image_query_async(self, image_data: bytes, user_question: str, lang: str = 'zh',
+                                        user_info: Optional[str] = None, tenant: Optional[str] = None) -> Dict[str, Any]:
         """异步处理图片查询（带错误重试）"""
         max_retries = 3
         retry_delay = 1.0
 
+        # 同一租户的相同图片、问题和语言直接返回缓存的回答，跳过预处理和视觉模型调用
+        image_key = content_hash(image_data)
+        cached_answer = self.image_cache.get_answer(image_key, user_question, lang, tenant)
+        if cached_answer is not None:
+            return self._cached_image_response(user_question, image_data, cached_answer)
+
+        # 在进程池中处理图片（CPU密集型操作，不阻塞事件循环），重试时复用结果
+        try:
+            # 根据问题类型和图片尺寸选择分辨率、JPEG质量和detail参数
+            options = self.image_pipeline.select_options(image_data, user_question)
+            processed = self.image_cache.get_payload(image_key, options["level"])
+            if processed is None:
+                processed = await self.image_pipeline.process(
+                    image_data, phash=self.image_cache.phash_enabled, **options
+                )
+                self.image_cache.put_payload(image_key, processed, options["level"])
+                self.logger.info(
+                    f"图片预处理完成: 级别={options['level']} {processed['original_size']} -> {processed['size']} "
+                    f"上传 {processed['input_bytes']}B -> 载荷 {len(processed['data_url'])}B "
+                    f"各阶段耗时(ms): {processed['timings_ms']}"
+                )
+
+                # 近似重复的图片复用已有回答
+                if self.image_cache.match_phash(image_key, processed.get("phash")) != image_key:
+                    cached_answer = self.image_cache.get_answer(image_key, user_question, lang, tenant)
+                    if cached_answer is not None:
+                        return self._cached_image_response(user_question, image_data, cached_answer)
+        except Exception as e:
+            print(f"❌ 图片处理失败: {str(e)}")
+            return {
+                "success": False,
+                "error": f"图片处理失败: {str(e)}",
+                "answer": "抱歉，无法处理您上传的图片，请检查图片格式是否正确"
+            }
+
         for attempt in range(max_retries):
             try:
-                # 处理图片（CPU密集型操作，保持同步）
-                image = Image.open(io.BytesIO(image_data))
-                image = self._resize_image(image)
-                buffered = io.BytesIO()
-                image.save(buffered, format="JPEG")
-                img_base64 = base64.b64encode(buffered.getvalue()).decode()
-
-                # 并发获取知识库上下文和对话历史
-                knowledge_context = self.knowledge_base.get_context_for_query(user_question)
-                conversation_context = self.get_conversation_context()
+                # 从知识库获取相关上下文条目
+                knowledge_entries = await self.get_context_entries_async(user_question, lang, tenant)
+                knowledge_context = "\n\n".join(knowledge_entries)
 
                 # 根据语言选择提示词
                 if lang == 'zh':
@@ -579,41 +735,34 @@ class AIService:
                 elif lang == 'hi':
                     image_desc = "उपयोगकर्ता द्वारा अपलोड की गई उत्पाद छवि"
 
-                prompt = prompt_cls.get_prompt_by_type(
+                messages = self._build_messages(
+                    prompt_cls,
                     "image_analysis",
+                    knowledge_entries,
+                    image_url={"url": processed["data_url"], "detail": options["detail"]},
                     image_description=image_desc,
+                    history=await self.get_history_messages_async(user_question),
                     user_question=user_question,
-                    user_info=user_info,
-                    conversation_context=conversation_context
+                    user_info=user_info
                 )
 
-                # 使用异步客户端调用API
-                async_client = openai.AsyncOpenAI(
-                    api_key=self.config.AIQIANJI_API_KEY,
-                    base_url=self.config.AIQIANJI_BASE_URL
-                )
-
-                response = await async_client.chat.completions.create(
-                    model=self.config.VISION_MODEL,
-                    messages=[
-                        {"role": "system", "content": prompt_cls.SYSTEM_PROMPT},
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{img_base64}"
-                                    }
-                                }
-                            ]
-                        }
-                    ],
+                # 通过路由器异步调用API
+                vision_start = time.perf_counter()
+                response = await self.router.achat_completion(
+                    "vision",
+                    messages=messages,
                     max_tokens=self.config.MAX_TOKENS,
                     temperature=self.config.TEMPERATURE
                 )
-                answer = response.choices[0].message.content[0]["text"]
+                vision_latency = time.perf_counter() - vision_start
+                self.image_pipeline.record_vision_latency(options["level"], vision_latency)
+                self.logger.info(
+                    f"视觉模型调用完成: 级别={options['level']} 载荷 {len(processed['data_url'])}B "
+                    f"耗时 {vision_latency * 1000:.0f}ms"
+                )
+
+                answer = self._message_text(response)
+                self.image_cache.put_answer(image_key, user_question, lang, answer, tenant)
 
                 # 添加到对话历史
                 self.add_to_conversation_history("user", f"{user_question} [图片]", image_data)
@@ -623,8 +772,10 @@ class AIService:
                     "success": True,
                     "answer": answer,
                     "knowledge_context": knowledge_context,
-                    "model_used": self.config.VISION_MODEL,
+                    "model_used": response.model or self.config.VISION_MODEL,
                     "image_processed": True,
+                    "image_timings_ms": processed["timings_ms"],
+                    "image_detail": options["level"],
                     "conversation_length": len(self.conversation_history)
                 }
 
@@ -661,6 +812,27 @@ class AIService:
                     "answer": "抱歉，处理图片时出现了错误，请检查图片格式或稍后重试。"
                 }
 
+    @staticmethod
+    def _message_text(response) -> str:
+        """提取回复文本（兼容字符串和分段列表两种content格式）"""
+        content = response.choices[0].message.content
+        if isinstance(content, list):
+            return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        return content or ""
+
+    def _cached_image_response(self, user_question: str, image_data: bytes, answer: str) -> Dict[str, Any]:
+        """使用缓存的视觉回答构造响应"""
+        self.add_to_conversation_history("user", f"{user_question} [图片]", image_data)
+        self.add_to_conversation_history("assistant", answer)
+        return {
+            "success": True,
+            "answer": answer,
+            "cached": True,
+            "model_used": self.config.VISION_MODEL,
+            "image_processed": True,
+            "conversation_length": len(self.conversation_history)
+        }
+
     async def process_chitchat_async(self, user_question: str, lang: str = 'zh', user_info: Optional[str] = None) -> Dict[str, Any]:
         """异步处理闲聊查询（带错误重试）"""
         max_retries = 2  # 闲聊请求使用较少重试次数
@@ -684,14 +856,9 @@ class AIService:
                     {"role": "user", "content": full_question}
                 ]
 
-                # 使用异步客户端调用API
-                async_client = openai.AsyncOpenAI(
-                    api_key=self.config.AIQIANJI_API_KEY,
-                    base_url=self.config.AIQIANJI_BASE_URL
-                )
-
-                response = await async_client.chat.completions.create(
-                    model=self.config.TEXT_MODEL,
+                # 通过路由器异步调用API
+                response = await self.router.achat_completion(
+                    "text",
                     messages=messages,
                     max_tokens=self.config.MAX_TOKENS,
                     temperature=self.config.TEMPERATURE
@@ -733,6 +900,8 @@ class AIService:
     def clear_conversation_history(self):
         """清空对话历史"""
         self.conversation_history = []
+        self.history_dropped = 0
+        self.memory.reset()
         return {"success": True, "message": "对话历史已清空"}
 
     def detect_language(self, text: str) -> str:
@@ -760,8 +929,8 @@ class AIService:
                 "zh=中文, en=英文, hi=印地语。其他语言返回'en'。只返回语言代码。"
             )
 
-            response = self.client.chat.completions.create(
-                model=self.config.TEXT_MODEL,
+            response = self.router.chat_completion(
+                "classification",
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": text}
@@ -795,17 +964,21 @@ class AIService:
                 "user_messages": len(user_messages),
                 "assistant_messages": len(assistant_messages),
                 "conversation_duration": self.conversation_history[-1]["timestamp"] - self.conversation_history[0]["timestamp"] if len(self.conversation_history) > 1 else 0,
-                "topics": self._extract_topics()
+                "topics": self._extract_topics(),
+                "rolling_summary": self.memory.summary,
+                "summarized_messages": self.memory.summarized_until
             }
 
             return {"success": True, "summary": summary}
         except Exception as e:
             return {"success": False, "error": str(e)}
 
-    def _extract_topics(self) -> List[str]:
-        """提取对话主题"""
+    def _extract_topics(self, messages: Optional[List[Dict[str, Any]]] = None) -> List[str]:
+        """提取对话主题（默认使用全部对话历史）"""
         topics = []
-        all_content = " ".join([msg["content"] for msg in self.conversation_history])
+        if messages is None:
+            messages = self.conversation_history
+        all_content = " ".join([msg["content"] for msg in messages])
 
         # 简单的关键词提取
         keywords = {
@@ -821,24 +994,410 @@ class AIService:
 
         return topics
 
+    def _custom_knowledge_document(self, question: str, answer: str, category: str) -> Dict[str, Any]:
+        return self.knowledge_base.make_custom_document(
+            content=f"问题：{question}\n答案：{answer}",
+            knowledge_type="custom",
+            category=category,
+            question=question,
+            answer=answer
+        )
+
+    def _updated_knowledge_document(self, doc_id: str, question: Optional[str], answer: Optional[str],
+                                    category: Optional[str]) -> Optional[Dict[str, Any]]:
+        """修改后的文档（未提供的字段保持不变），文档不存在时返回None"""
+        document = self.knowledge_base.get_document(doc_id)
+        if document is None:
+            return None
+        fields = {key: value for key, value in
+                  (("question", question), ("answer", answer), ("category", category)) if value is not None}
+        content = None
+        if question is not None or answer is not None:
+            content = f"问题：{fields.get('question', document.get('question', ''))}\n" \
+                      f"答案：{fields.get('answer', document.get('answer', ''))}"
+        return self.knowledge_base.merge_document(doc_id, content, **fields)
+
     def add_to_knowledge_base(self, question: str, answer: str, category: str = "custom"):
         """添加新知识到知识库"""
         try:
-            self.knowledge_base.add_custom_knowledge(
-                content=f"问题：{question}\n答案：{answer}",
-                knowledge_type="custom",
-                category=category,
-                question=question,
-                answer=answer
+            document = self._custom_knowledge_document(question, answer, category)
+            self.knowledge_base.upsert_documents([document])
+            return {"success": True, "message": "知识已添加到知识库", "id": document["id"]}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def update_knowledge(self, doc_id: str, question: Optional[str] = None, answer: Optional[str] = None,
+                         category: Optional[str] = None) -> Dict[str, Any]:
+        """修改知识库文档（未提供的字段保持不变）"""
+        try:
+            document = self._updated_knowledge_document(doc_id, question, answer, category)
+            if document is None:
+                return {"success": False, "error": f"文档不存在: {doc_id}"}
+            self.knowledge_base.upsert_documents([document])
+            return {"success": True, "message": "知识已更新", "id": doc_id}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def delete_knowledge(self, doc_id: str) -> Dict[str, Any]:
+        """删除知识库文档"""
+        try:
+            if not self.knowledge_base.delete_document(doc_id):
+                return {"success": False, "error": f"文档不存在: {doc_id}"}
+            return {"success": True, "message": "知识已删除", "id": doc_id}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    async def _write_knowledge_async(self, op: str, **args) -> Optional[str]:
+        """知识库写操作：配置了检索进程时先转发给检索进程，成功后再写入本进程的索引
+
+        检索进程不可用或写入失败时本进程也不修改（两边索引保持一致），返回错误信息；成功返回None。
+        向量化和写入索引在线程池中执行，不阻塞事件循环。
+        """
+        if self.retrieval_client is not None:
+            try:
+                await self.retrieval_client.call(op, **args)
+            except (RetrievalUnavailable, RetrievalError) as e:
+                self.logger.warning(f"检索进程写入失败，知识未修改: {str(e)}")
+                return f"检索进程不可用，知识未修改: {str(e)}"
+        loop = asyncio.get_running_loop()
+        if op == "upsert":
+            await loop.run_in_executor(None, self.knowledge_base.upsert_documents, args["documents"])
+        else:
+            await loop.run_in_executor(None, self.knowledge_base.delete_document, args["doc_id"])
+        return None
+
+    async def add_to_knowledge_base_async(self, question: str, answer: str, category: str = "custom"):
+        """添加新知识到知识库（API使用，同时写入检索进程）"""
+        try:
+            document = self._custom_knowledge_document(question, answer, category)
+            error = await self._write_knowledge_async("upsert", documents=[document])
+            if error is not None:
+                return {"success": False, "error": error}
+            return {"success": True, "message": "知识已添加到知识库", "id": document["id"]}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    async def update_knowledge_async(self, doc_id: str, question: Optional[str] = None,
+                                     answer: Optional[str] = None, category: Optional[str] = None) -> Dict[str, Any]:
+        """修改知识库文档（API使用，同时写入检索进程）"""
+        try:
+            document = self._updated_knowledge_document(doc_id, question, answer, category)
+            if document is None:
+                return {"success": False, "error": f"文档不存在: {doc_id}"}
+            error = await self._write_knowledge_async("upsert", documents=[document])
+            if error is not None:
+                return {"success": False, "error": error}
+            return {"success": True, "message": "知识已更新", "id": doc_id}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    async def delete_knowledge_async(self, doc_id: str) -> Dict[str, Any]:
+        """删除知识库文档（API使用，同时写入检索进程）"""
+        try:
+            if self.knowledge_base.get_document(doc_id) is None:
+                return {"success": False, "error": f"文档不存在: {doc_id}"}
+            error = await self._write_knowledge_async("delete", doc_id=doc_id)
+            if error is not None:
+                return {"success": False, "error": error}
+            return {"success": True, "message": "知识已删除", "id": doc_id}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def reload_knowledge_base(self) -> Dict[str, Any]:
+        """重新加载知识库文件（只处理有变化的文档）"""
+        try:
+            return {"success": True, **self.knowledge_base.reload_knowledge_base()}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def get_knowledge_status(self) -> Dict[str, Any]:
+        """获取知识库索引版本和检索耗时统计"""
+        return {
+            "success": True,
+            **self.knowledge_base.get_status(),
+            "retrieval": self.knowledge_base.get_retrieval_stats(),
+            "sidecar": self.retrieval_client.get_stats() if self.retrieval_client is not None else None
+        }
+
+    def get_tenant_stats(self) -> Dict[str, Any]:
+        """获取各租户知识库的加载状态、索引内存和检索耗时"""
+        return {"success": True, **self.tenants.get_stats()}
+
+    def get_router_status(self) -> Dict[str, Any]:
+        """获取模型端点健康状态和权重"""
+        return {"success": True, **self.router.status()}
+
+    def get_image_stats(self) -> Dict[str, Any]:
+        """获取图片预处理耗时和缓存命中统计"""
+        return {
+            "success": True,
+            "pipeline": self.image_pipeline.stats(),
+            "cache": self.image_cache.stats()
+        }
+
+    def get_prompt_stats(self) -> Dict[str, Any]:
+        """获取消息前缀稳定度统计（按文本/视觉分别统计）"""
+        return {
+            "success": True,
+            "token_budget": self.prompt_engine.token_budget,
+            "history_window_block": self.config.HISTORY_WINDOW_BLOCK,
+            "prefix": {name: tracker.stats() for name, tracker in self.prefix_trackers.items()},
+            "summary": self.memory.stats()
+        }
+
+    async def process_chat_batch(self, requests: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]],
+                                 concurrency: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """批量处理文字问题（离线评测、预热缓存），按完成顺序逐个产出结果
+
+        每个请求: {"id": ..., "message": "...", "language": "zh", "user_info": ..., "tenant": ...}，
+        没有 id 时使用请求在输入中的序号。每 CHAT_BATCH_SIZE 个请求按租户和语言分组，
+        一次向量化后检索。所有批量请求共用 CHAT_BATCH_CONCURRENCY 个模型调用名额，
+        concurrency 只能把本批的并发调低，不能超过该上限。
+        输入可以是任意长的（异步）迭代器：未完成的请求过多时暂停读取。
+        批量请求相互独立，不读取也不写入对话历史和对话摘要，不做闲聊判断和语言检测。
+        """
+        limit = self.config.CHAT_BATCH_CONCURRENCY
+        concurrency = max(1, min(concurrency or limit, limit))
+        if self.batch_governor is None:
+            self.batch_governor = asyncio.Semaphore(limit)
+        governor = self.batch_governor
+        semaphore = asyncio.Semaphore(concurrency)
+        results: asyncio.Queue = asyncio.Queue()
+        pending = set()
+
+        async def complete(item: Dict[str, Any], entries: List[str]):
+            try:
+                async with semaphore, governor:
+                    result = await self._complete_batch_item(item, entries)
+            except Exception as e:
+                # 单个请求出错只影响该请求的结果
+                result = {"id": item["id"], "success": False, "error": f"{type(e).__name__}: {e}"}
+            await results.put(result)
+
+        async def produce():
+            try:
+                position = 0
+                chunk = []
+                async for item in _aiter(requests):
+                    if not isinstance(item, dict):
+                        item = {"error": "请求必须是JSON对象"}
+                    chunk.append({**item, "id": item.get("id", position)})
+                    position += 1
+                    if len(chunk) >= self.config.CHAT_BATCH_SIZE:
+                        await dispatch(chunk)
+                        chunk = []
+                if chunk:
+                    await dispatch(chunk)
+                if pending:
+                    await asyncio.gather(*pending)
+            finally:
+                await results.put(None)
+
+        async def dispatch(chunk: List[Dict[str, Any]]):
+            # 背压：进行中的请求超过 2 × concurrency 时等待，再读取下一批
+            while len(pending) >= concurrency * 2:
+                await asyncio.wait(set(pending), return_when=asyncio.FIRST_COMPLETED)
+            valid = []
+            for item in chunk:
+                error = self._validate_batch_item(item)
+                if error:
+                    await results.put({"id": item["id"], "success": False, "error": error})
+                else:
+                    valid.append(item)
+            for item, entries in zip(valid, await self._batch_context_entries(valid)):
+                task = asyncio.create_task(complete(item, entries))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                yield result
+            await producer  # 读取输入出错时在这里抛出
+        finally:
+            # 调用方提前停止（例如客户端断开）时取消未完成的请求
+            producer.cancel()
+            for task in list(pending):
+                task.cancel()
+
+    def _validate_batch_item(self, item: Dict[str, Any]) -> Optional[str]:
+        message = item.get("message")
+        if not isinstance(message, str) or not message.strip():
+            return item.get("error") or "缺少 message"
+        for field in ("language", "tenant", "user_info"):
+            if item.get(field) is not None and not isinstance(item[field], str):
+                return f"{field} 必须是字符串"
+        if not self.tenants.exists(item.get("tenant")):
+            return f"租户不存在: {item.get('tenant')}"
+        return None
+
+    async def _batch_context_entries(self, items: List[Dict[str, Any]]) -> List[List[str]]:
+        """按租户和语言分组，每组的问题一次向量化后检索"""
+        groups: Dict[tuple, List[int]] = {}
+        for i, item in enumerate(items):
+            groups.setdefault((item.get("tenant"), item.get("language") or 'zh'), []).append(i)
+
+        entries: List[List[str]] = [[] for _ in items]
+        for (tenant, lang), positions in groups.items():
+            questions = [items[i]["message"] for i in positions]
+            try:
+                if self.retrieval_client is not None and self.tenants.is_default(tenant):
+                    # 检索进程会把并发的查询合并成一批向量化
+                    group_entries = await asyncio.gather(
+                        *(self.get_context_entries_async(question, lang) for question in questions)
+                    )
+                else:
+                    knowledge_base = await self.get_tenant_knowledge_base(tenant)
+                    start = time.perf_counter()
+                    group_entries = await asyncio.get_running_loop().run_in_executor(
+                        None, knowledge_base.get_context_entries_batch, questions,
+                        self.config.KNOWLEDGE_CONTEXT_TOP_K, lang
+                    )
+                    elapsed = (time.perf_counter() - start) * 1000 / len(questions)
+                    for _ in questions:
+                        self.tenants.record_search(tenant, elapsed)
+            except Exception as e:
+                self.logger.warning(f"批量检索失败，不使用知识库上下文: {str(e)}")
+                group_entries = [[] for _ in questions]
+            for i, group_entry in zip(positions, group_entries):
+                entries[i] = group_entry
+        return entries
+
+    async def _complete_batch_item(self, item: Dict[str, Any], knowledge_entries: List[str]) -> Dict[str, Any]:
+        """单个批量请求的模型调用（不带对话历史），速率限制和连接错误时重试"""
+        lang = item.get("language") or 'zh'
+        messages, _ = self.prompt_engine.build_messages(
+            PROMPT_CLASSES.get(lang, ChinesePrompts),
+            "text_chat",
+            [],
+            knowledge_context=knowledge_entries,
+            user_question=item["message"],
+            user_info=item.get("user_info")
+        )
+        start = time.perf_counter()
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                response = await self.router.achat_completion(
+                    "text",
+                    messages=messages,
+                    max_tokens=self.config.MAX_TOKENS,
+                    temperature=self.config.TEMPERATURE
+                )
+                return {
+                    "id": item["id"],
+                    "success": True,
+                    "answer": response.choices[0].message.content,
+                    "knowledge_context": "\n\n".join(knowledge_entries),
+                    "model_used": response.model or self.config.TEXT_MODEL,
+                    "latency_ms": round((time.perf_counter() - start) * 1000, 1)
+                }
+            except (openai.RateLimitError, openai.APIConnectionError) as e:
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                error = str(e)
+            except Exception as e:
+                error = str(e)
+            return {"id": item["id"], "success": False, "error": error,
+                    "latency_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+    async def get_tenant_knowledge_base(self, tenant: Optional[str] = None) -> KnowledgeBase:
+        """租户的知识库；尚未加载的租户在线程池中加载，不阻塞事件循环"""
+        if self.tenants.is_default(tenant):
+            return self.knowledge_base
+        return await asyncio.get_running_loop().run_in_executor(None, self.tenants.get, tenant)
+
+    async def get_context_entries_async(self, question: str, lang: str, tenant: Optional[str] = None) -> List[str]:
+        """知识库上下文条目（tenant 选择租户知识库）
+
+        默认租户配置了独立检索进程时由检索进程向量化和检索，不可用时在进程内检索。
+        """
+        if self.retrieval_client is not None and self.tenants.is_default(tenant):
+            start = time.perf_counter()
+            try:
+                entries = await self.retrieval_client.context_entries(
+                    question, top_k=self.config.KNOWLEDGE_CONTEXT_TOP_K, lang=lang
+                )
+                self.tenants.record_search(tenant, (time.perf_counter() - start) * 1000)
+                return entries
+            except (RetrievalUnavailable, RetrievalError) as e:
+                self.logger.warning(f"检索进程不可用，使用进程内检索: {str(e)}")
+        knowledge_base = await self.get_tenant_knowledge_base(tenant)
+        start = time.perf_counter()
+        # 查询向量化和检索是CPU密集型操作，在线程池中执行，不阻塞事件循环
+        entries = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: knowledge_base.get_context_entries(
+                question, top_k=self.config.KNOWLEDGE_CONTEXT_TOP_K, lang=lang
             )
-            return {"success": True, "message": "知识已添加到知识库"}
+        )
+        self.tenants.record_search(tenant, (time.perf_counter() - start) * 1000)
+        return entries
+
+    async def search_knowledge_base_async(self, query: str, top_k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                                          lang: Optional[str] = None, tenant: Optional[str] = None):
+        """搜索知识库，默认租户配置了独立检索进程时优先由检索进程处理"""
+        if self.retrieval_client is not None and self.tenants.is_default(tenant):
+            start = time.perf_counter()
+            try:
+                result = await self.retrieval_client.search(query, top_k, filters, lang)
+                self.tenants.record_search(tenant, (time.perf_counter() - start) * 1000)
+                return {"success": True, **result, "served_by": "sidecar"}
+            except (RetrievalUnavailable, RetrievalError) as e:
+                self.logger.warning(f"检索进程不可用，使用进程内检索: {str(e)}")
+        # 租户加载、查询向量化和检索都在线程池中执行，不阻塞事件循环
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.search_knowledge_base, query, top_k, filters, lang, tenant
+        )
+
+    async def search_knowledge_batch_async(self, queries: List[str], top_k: int = 5,
+                                           filters: Optional[Dict[str, Any]] = None, lang: Optional[str] = None,
+                                           tenant: Optional[str] = None):
+        """多个查询一起搜索知识库（一次向量化、一次向量打分），默认租户配置了独立检索进程时优先由检索进程处理"""
+        if self.retrieval_client is not None and self.tenants.is_default(tenant):
+            start = time.perf_counter()
+            try:
+                result = await self.retrieval_client.search_batch(queries, top_k, filters, lang)
+                self.tenants.record_search(tenant, (time.perf_counter() - start) * 1000)
+                return {"success": True, **result, "served_by": "sidecar"}
+            except (RetrievalUnavailable, RetrievalError) as e:
+                self.logger.warning(f"检索进程不可用，使用进程内检索: {str(e)}")
+        try:
+            knowledge_base = await self.get_tenant_knowledge_base(tenant)
+            start = time.perf_counter()
+            results, timings = await asyncio.get_running_loop().run_in_executor(
+                None, knowledge_base.search_batch, queries, top_k, filters, lang
+            )
+            self.tenants.record_search(tenant, (time.perf_counter() - start) * 1000)
+            return {
+                "success": True,
+                "results": [[dict(result) for result in hits] for hits in results],
+                "timings_ms": timings
+            }
         except Exception as e:
             return {"success": False, "error": str(e)}
 
-    def search_knowledge_base(self, query: str, top_k: int = 5):
-        """搜索知识库"""
+    def search_knowledge_base(self, query: str, top_k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                              lang: Optional[str] = None, tenant: Optional[str] = None):
+        """搜索知识库（可按 type / category / subcategory 过滤，lang 选择语言分区，tenant 选择租户知识库）"""
         try:
-            results = self.knowledge_base.search(query, top_k)
-            return {"success": True, "results": results}
+            knowledge_base = self.tenants.get(tenant)
+            start = time.perf_counter()
+            results, timings = knowledge_base.hybrid_search(query, top_k, filters, lang)
+            self.tenants.record_search(tenant, (time.perf_counter() - start) * 1000)
+            return {"success": True, "results": [dict(result) for result in results], "timings_ms": timings}
         except Exception as e:
-            return {"success": False, "error": str(e)}
\ No newline at end of file
+            return {"success": False, "error": str(e)}
+
+
+async def _aiter(items: Union[Iterable[Any], AsyncIterable[Any]]) -> AsyncIterator[Any]:
+    """把普通迭代器和异步迭代器统一为异步迭代"""
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from config import Config
+from prompts.prompt_engine import get_template, get_token_counter
+
+
+# 抽取式摘要按句切分
+_SENTENCE_END = re.compile(r"(?<=[。！？!?])|(?<=\.)\s|\n")
+
+
+class ConversationMemory:
+    """滚动对话摘要
+
+    未摘要的历史超过 HISTORY_SUMMARY_THRESHOLD 个token（或消息条数超过上限）时，
+    把除最近 HISTORY_SUMMARY_KEEP_MESSAGES 条以外的消息合并进摘要。摘要在后台生成
+    （classification 池的模型，失败时退化为抽取式摘要），不阻塞当前请求；生成完成前
+    请求仍携带完整的未摘要历史。消息按绝对序号记录，历史列表被截断后依然可以定位。
+    """
+
+    def __init__(self, router, topic_extractor: Callable[[Sequence[Dict[str, Any]]], List[str]],
+                 enabled: Optional[bool] = None, threshold: Optional[int] = None,
+                 keep_messages: Optional[int] = None, max_tokens: Optional[int] = None):
+        self.router = router
+        self.extract_topics = topic_extractor
+        self.enabled = Config.HISTORY_SUMMARY_ENABLED if enabled is None else enabled
+        self.threshold = threshold or Config.HISTORY_SUMMARY_THRESHOLD
+        self.keep_messages = Config.HISTORY_SUMMARY_KEEP_MESSAGES if keep_messages is None else keep_messages
+        self.max_tokens = max_tokens or Config.HISTORY_SUMMARY_MAX_TOKENS
+        self.counter = get_token_counter()
+        self.logger = logging.getLogger(__name__)
+
+        self.summary = ""
+        self.summary_tokens = 0
+        self.topics: List[str] = []
+        self.summarized_until = 0  # 已合并进摘要的消息数（绝对序号）
+        self.generation = 0  # 清空历史后递增，丢弃过期的后台任务结果
+
+        self._pending = None
+        self._lock = threading.Lock()
+        self.stats_counter = {
+            "folds": 0, "model_folds": 0, "extractive_folds": 0,
+            "summarized_messages": 0, "last_fold_ms": 0.0
+        }
+
+    def unsummarized(self, history: Sequence[Dict[str, Any]], dropped: int) -> List[Dict[str, Any]]:
+        """尚未合并进摘要的历史消息"""
+        return list(history[max(0, self.summarized_until - dropped):])
+
+    def is_pending(self) -> bool:
+        pending = self._pending
+        if pending is None:
+            return False
+        if isinstance(pending, threading.Thread):
+            return pending.is_alive()
+        return not pending.done()
+
+    def maybe_schedule(self, history: Sequence[Dict[str, Any]], dropped: int, prompt_cls: type,
+                       max_messages: int) -> bool:
+        """未摘要历史超过阈值时在后台启动一次合并，返回是否已启动"""
+        if not self.enabled or self.is_pending():
+            return False
+
+        items = self.unsummarized(history, dropped)
+        tokens = sum(item.get("tokens") or self.counter.count(item["content"]) for item in items)
+        if tokens <= self.threshold and len(items) <= max_messages - self.keep_messages:
+            return False
+
+        fold_items = items[:len(items) - self.keep_messages] if self.keep_messages else items
+        if not fold_items:
+            return False
+        fold_until = self.summarized_until + len(fold_items)
+        args = (self.generation, fold_until, self.summary, fold_items, prompt_cls)
+
+        try:
+            loop = asyncio.get_running_loop()
+            self._pending = loop.create_task(self._fold_async(*args))
+        except RuntimeError:
+            # 同步调用路径没有事件循环，使用后台线程
+            self._pending = threading.Thread(target=self._fold_sync, args=args, daemon=True)
+            self._pending.start()
+        return True
+
+    def _fold_request(self, previous: str, items: Sequence[Dict[str, Any]], prompt_cls: type,
+                      topics: List[str]) -> Dict[str, Any]:
+        conversation = "\n".join(f"{item['role']}: {item['content']}" for item in items)
+        prompt = get_template(prompt_cls, "conversation_summary").render(
+            previous_summary=previous or "-",
+            topics=", ".join(topics) or "-",
+            conversation=conversation
+        )
+        return {
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": self.max_tokens,
+            "temperature": 0.3
+        }
+
+    def _extractive(self, previous: str, items: Sequence[Dict[str, Any]]) -> str:
+        """抽取式摘要：保留用户消息，助手回答只取第一句"""
+        lines = [previous] if previous else []
+        for item in items:
+            content = " ".join(item["content"].split())
+            if not content:
+                continue
+            if item["role"] == "assistant":
+                content = next((s for s in _SENTENCE_END.split(content) if s and s.strip()), content)
+            lines.append(f"{item['role']}: {content.strip()}")
+
+        # 超出长度时优先保留较新的内容
+        kept, used = [], 0
+        for line in reversed(lines):
+            cost = self.counter.count(line)
+            if used + cost > self.max_tokens:
+                break
+            kept.append(line)
+            used += cost
+        kept.reverse()
+        return "\n".join(kept)
+
+    def _merge_topics(self, items: Sequence[Dict[str, Any]]) -> List[str]:
+        topics = list(self.topics)
+        for topic in self.extract_topics(items):
+            if topic not in topics:
+                topics.append(topic)
+        return topics
+
+    async def _fold_async(self, generation: int, fold_until: int, previous: str,
+                          items: Sequence[Dict[str, Any]], prompt_cls: type):
+        start = time.perf_counter()
+        topics = self._merge_topics(items)
+        try:
+            response = await self.router.achat_completion(
+                "classification", **self._fold_request(previous, items, prompt_cls, topics)
+            )
+            summary, method = (response.choices[0].message.content or "").strip(), "model"
+        except Exception as e:
+            self.logger.warning(f"对话摘要生成失败，使用抽取式摘要: {str(e)}")
+            summary, method = "", "extractive"
+        if not summary:
+            summary, method = self._extractive(previous, items), "extractive"
+        self._apply(generation, fold_until, summary, topics, method, start)
+
+    def _fold_sync(self, generation: int, fold_until: int, previous: str,
+                   items: Sequence[Dict[str, Any]], prompt_cls: type):
+        start = time.perf_counter()
+        topics = self._merge_topics(items)
+        try:
+            response = self.router.chat_completion(
+                "classification", **self._fold_request(previous, items, prompt_cls, topics)
+            )
+            summary, method = (response.choices[0].message.content or "").strip(), "model"
+        except Exception as e:
+            self.logger.warning(f"对话摘要生成失败，使用抽取式摘要: {str(e)}")
+            summary, method = "", "extractive"
+        if not summary:
+            summary, method = self._extractive(previous, items), "extractive"
+        self._apply(generation, fold_until, summary, topics, method, start)
+
+    def _apply(self, generation: int, fold_until: int, summary: str, topics: List[str],
+               method: str, start: float):
+        with self._lock:
+            if generation != self.generation or fold_until <= self.summarized_until:
+                return
+            self.stats_counter["summarized_messages"] += fold_until - self.summarized_until
+            self.summary = self.counter.truncate(summary, self.max_tokens)
+            self.summary_tokens = self.counter.count(self.summary)
+            self.topics = topics
+            self.summarized_until = fold_until
+            self.stats_counter["folds"] += 1
+            self.stats_counter[f"{method}_folds"] += 1
+            self.stats_counter["last_fold_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    def reset(self):
+        """清空摘要，进行中的后台任务结果将被丢弃"""
+        with self._lock:
+            self.generation += 1
+            self.summary = ""
+            self.summary_tokens = 0
+            self.topics = []
+            self.summarized_until = 0
+            self._pending = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "threshold_tokens": self.threshold,
+            "summary_tokens": self.summary_tokens,
+            "summarized_until": self.summarized_until,
+            "topics": list(self.topics),
+            "pending": self.is_pending(),
+            **self.stats_counter
+        }
@@ -0,0 +1,290 @@
+import hashlib
+from collections.abc import Mapping, Sequence as SequenceABC
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+# 各语言文档内容和上下文条目使用的标签
+CONTENT_LABELS = {
+    'zh': {'question': '问题', 'answer': '答案', 'category': '分类', 'keywords': '关键词',
+           'product_category': '商品分类', 'products': '相关商品', 'common_questions': '常见问题',
+           'category_context': '商品分类信息', 'separator': '：', 'list_separator': ', '},
+    'en': {'question': 'Question', 'answer': 'Answer', 'category': 'Category', 'keywords': 'Keywords',
+           'product_category': 'Product category', 'products': 'Related products',
+           'common_questions': 'Common questions', 'category_context': 'Product category info',
+           'separator': ': ', 'list_separator': ', '},
+    'hi': {'question': 'प्रश्न', 'answer': 'उत्तर', 'category': 'श्रेणी', 'keywords': 'कीवर्ड',
+           'product_category': 'उत्पाद श्रेणी', 'products': 'संबंधित उत्पाद',
+           'common_questions': 'सामान्य प्रश्न', 'category_context': 'उत्पाद श्रेणी जानकारी',
+           'separator': ': ', 'list_separator': ', '},
+}
+
+# 字段存储方式：取值较少的字段驻留为整数编码，长文本放入连续的UTF-8缓冲区，列表字段按分隔符拼接
+INTERNED_FIELDS = ("type", "lang", "category", "subcategory", "source")
+TEXT_FIELDS = ("question", "answer")
+LIST_FIELDS = ("keywords", "common_questions")
+SCHEMA = ("id", "source", "content", "type", "lang", "category", "subcategory", "question", "answer",
+          "keywords", "common_questions")
+_FIELD_BITS = {field: 1 << i for i, field in enumerate(SCHEMA)}
+_LIST_SEPARATOR = "\x1f"
+
+
+def labels_for(lang: Optional[str]) -> Dict[str, str]:
+    return CONTENT_LABELS.get(lang, CONTENT_LABELS['zh'])
+
+
+def render_content(doc: Mapping) -> Optional[str]:
+    """按文档类型和语言拼出用于检索和向量化的 content；不是FAQ或商品分类文档时返回None"""
+    labels = labels_for(doc.get('lang'))
+    sep, list_sep = labels['separator'], labels['list_separator']
+    if doc.get('type') == 'faq' and 'question' in doc and 'answer' in doc:
+        content = (f"{labels['question']}{sep}{doc['question']}\n"
+                   f"{labels['answer']}{sep}{doc['answer']}\n"
+                   f"{labels['category']}{sep}{doc.get('category', '')}")
+        if 'keywords' in doc:
+            content += f"\n{labels['keywords']}{sep}{list_sep.join(doc['keywords'])}"
+        return content
+    if doc.get('type') == 'category' and 'subcategory' in doc:
+        return (f"{labels['product_category']}{sep}{doc.get('category', '')} - {doc['subcategory']}\n"
+                f"{labels['products']}{sep}{list_sep.join(doc.get('keywords', []))}\n"
+                f"{labels['common_questions']}{sep}{list_sep.join(doc.get('common_questions', []))}")
+    return None
+
+
+def _fits_column(field: str, value: Any) -> bool:
+    if field in LIST_FIELDS:
+        # [""] 拼接后与空列表无法区分
+        return isinstance(value, list) and value != [""] and \
+            all(isinstance(item, str) and _LIST_SEPARATOR not in item for item in value)
+    if field in INTERNED_FIELDS:
+        return value is None or isinstance(value, str)
+    return isinstance(value, str)
+
+
+def _id_hash(doc_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(doc_id.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+class StringTable:
+    """驻留字符串：取值 → 整数编码"""
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def code(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class TextColumn:
+    """连续UTF-8缓冲区 + 偏移量，按行取出字符串"""
+
+    def __init__(self, values: Iterable[str]):
+        buffer = bytearray()
+        offsets = [0]
+        for value in values:
+            buffer += value.encode("utf-8")
+            offsets.append(len(buffer))
+        self.buffer = bytes(buffer)
+        # 缓冲区小于2GB时偏移量用int32
+        self.offsets = np.asarray(offsets, dtype=np.int32 if len(buffer) < 2 ** 31 else np.int64)
+
+    def __getitem__(self, row: int) -> str:
+        return self.buffer[self.offsets[row]:self.offsets[row + 1]].decode("utf-8")
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.buffer) + self.offsets.nbytes
+
+
+class DocumentView(Mapping):
+    """文档存储中一行的只读视图，按需解码字段；copy() 返回普通字典"""
+
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store: "DocumentStore", row: int):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, key: str) -> Any:
+        return self._store.field(self._row, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return self._store.keys(self._row)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._store.keys(self._row))
+
+    def copy(self) -> Dict[str, Any]:
+        return dict(self)
+
+    def __repr__(self) -> str:
+        return f"DocumentView({self._store.field(self._row, 'id')!r})"
+
+
+class SearchHit(DocumentView):
+    """检索结果：文档视图 + 相似度分数（similarity_score 字段）"""
+
+    __slots__ = ("score",)
+
+    def __init__(self, store: "DocumentStore", row: int, score: float):
+        super().__init__(store, row)
+        self.score = score
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "similarity_score":
+            return self.score
+        return self._store.field(self._row, key)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._store.keys(self._row)
+        yield "similarity_score"
+
+
+class _ContentColumn(SequenceABC):
+    """按行惰性生成的 content 序列（构建BM25索引和向量化时使用）"""
+
+    def __init__(self, store: "DocumentStore"):
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self.store.field(i, "content") for i in range(*row.indices(len(self)))]
+        return self.store.field(row, "content")
+
+
+class DocumentStore(SequenceABC):
+    """列式文档存储（只读）
+
+    - 行号即整数文档ID，字符串文档ID通过64位哈希的有序数组定位
+    - type/lang/category/subcategory/source 驻留为 int32 编码
+    - question/answer/关键词等文本放在连续的UTF-8缓冲区中，按偏移量解码
+    - content 可以由其他字段拼出时不存储，读取时按需生成
+    - 不在固定字段中的自定义字段单独保存
+    store[i] 返回 DocumentView，不复制数据。
+    """
+
+    def __init__(self, documents: Iterable[Mapping]):
+        self.strings = {field: StringTable() for field in INTERNED_FIELDS}
+        codes = {field: [] for field in INTERNED_FIELDS}
+        texts = {field: [] for field in ("id",) + TEXT_FIELDS + LIST_FIELDS}
+        content_overrides: Dict[int, str] = {}
+        presence: List[int] = []
+        self.extras: Dict[int, Dict[str, Any]] = {}
+
+        for row, doc in enumerate(documents):
+            mask = 0
+            extra = {}
+            for key, value in doc.items():
+                if key in _FIELD_BITS and _fits_column(key, value):
+                    mask |= _FIELD_BITS[key]
+                elif key != "similarity_score":
+                    # 类型与列不符的值（例如数字分类）原样保存，视图中的取值不变
+                    extra[key] = value
+            presence.append(mask)
+            if extra:
+                self.extras[row] = extra
+            texts["id"].append(doc["id"] if mask & _FIELD_BITS["id"] else "")
+            for field in INTERNED_FIELDS:
+                codes[field].append(self.strings[field].code(doc[field] if mask & _FIELD_BITS[field] else None))
+            for field in TEXT_FIELDS:
+                texts[field].append(doc[field] if mask & _FIELD_BITS[field] else "")
+            for field in LIST_FIELDS:
+                texts[field].append(_LIST_SEPARATOR.join(doc[field]) if mask & _FIELD_BITS[field] else "")
+            if mask & _FIELD_BITS["content"] and doc["content"] != render_content(doc):
+                content_overrides[row] = doc["content"]
+
+        self.presence = np.asarray(presence, dtype=np.int32)
+        self.codes = {field: np.asarray(values, dtype=np.int32) for field, values in codes.items()}
+        self.columns = {field: TextColumn(values) for field, values in texts.items()}
+        self.content_overrides = content_overrides
+        del texts, codes
+
+        hashes = np.fromiter((_id_hash(self.columns["id"][row]) for row in range(len(presence))),
+                             dtype=np.int64, count=len(presence))
+        self._id_order = np.argsort(hashes, kind="stable")
+        self._id_hashes = hashes[self._id_order]
+        self.contents = _ContentColumn(self)
+
+    def __len__(self) -> int:
+        return len(self.presence)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [DocumentView(self, i) for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return DocumentView(self, row)
+
+    def has(self, row: int, field: str) -> bool:
+        bit = _FIELD_BITS.get(field)
+        if bit is not None and self.presence[row] & bit:
+            return True
+        return field in self.extras.get(row, ())
+
+    def keys(self, row: int) -> Iterator[str]:
+        mask = int(self.presence[row])
+        for field in SCHEMA:
+            if mask & _FIELD_BITS[field]:
+                yield field
+        yield from self.extras.get(row, ())
+
+    def field(self, row: int, field: str) -> Any:
+        bit = _FIELD_BITS.get(field)
+        if bit is None or not self.presence[row] & bit:
+            extra = self.extras.get(row)
+            if extra is None or field not in extra:
+                raise KeyError(field)
+            return extra[field]
+        if field in self.codes:
+            code = self.codes[field][row]
+            return None if code < 0 else self.strings[field].values[code]
+        if field == "content":
+            content = self.content_overrides.get(row)
+            return content if content is not None else render_content(DocumentView(self, row))
+        value = self.columns[field][row]
+        if field in LIST_FIELDS:
+            return value.split(_LIST_SEPARATOR) if value else []
+        return value
+
+    def row_of(self, doc_id: str) -> Optional[int]:
+        """字符串文档ID对应的行号（哈希有序数组二分查找，再核对原文）"""
+        target = _id_hash(doc_id)
+        position = int(np.searchsorted(self._id_hashes, target))
+        while position < len(self._id_hashes) and self._id_hashes[position] == target:
+            row = int(self._id_order[position])
+            if self.columns["id"][row] == doc_id:
+                return row
+            position += 1
+        return None
+
+    def value_rows(self, field: str) -> Dict[str, np.ndarray]:
+        """驻留字段每个取值对应的有序行号数组"""
+        codes = self.codes[field]
+        order = np.argsort(codes, kind="stable")
+        sorted_codes = codes[order]
+        values, starts = np.unique(sorted_codes, return_index=True)
+        groups = np.split(order.astype(np.int32), starts[1:])
+        table = self.strings[field].values
+        # 同一取值的行号在 stable 排序后保持有序
+        return {table[code]: rows for code, rows in zip(values, groups) if code >= 0 and table[code]}
+
+    @property
+    def memory_bytes(self) -> int:
+        """列数据占用的字节数（不含驻留字符串和自定义字段）"""
+        total = self.presence.nbytes + self._id_hashes.nbytes + self._id_order.nbytes
+        total += sum(codes.nbytes for codes in self.codes.values())
+        total += sum(column.nbytes for column in self.columns.values())
+        total += sum(len(content.encode("utf-8")) for content in self.content_overrides.values())
+        return total
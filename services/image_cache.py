@@ -0,0 +1,158 @@
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from config import Config
+from services.tenants import DEFAULT_TENANT
+
+
+def content_hash(image_data: bytes) -> str:
+    """图片内容哈希"""
+    return hashlib.blake2b(image_data, digest_size=16).hexdigest()
+
+
+class ImageCache:
+    """基于图片内容哈希的缓存
+
+    缓存两类数据，共享一个字节预算并按LRU淘汰：
+    - 预处理后的图片（data URL等），按 (内容哈希, 预处理参数) 缓存，命中时跳过解码和编码
+    - 视觉模型回答，按 (内容哈希, 问题, 语言, 租户) 缓存，命中时跳过视觉模型调用
+      （回答依据租户自己的知识库生成，不能跨租户复用）
+    可选的感知哈希（dHash）把近似重复的图片归并到同一个内容哈希上；感知哈希和别名只为
+    已缓存预处理结果的图片记录，随预处理结果一起淘汰，不会无限增长。
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, phash_enabled: Optional[bool] = None,
+                 phash_distance: Optional[int] = None):
+        self.max_bytes = Config.IMAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.phash_enabled = Config.IMAGE_CACHE_PHASH if phash_enabled is None else phash_enabled
+        self.phash_distance = Config.IMAGE_CACHE_PHASH_DISTANCE if phash_distance is None else phash_distance
+
+        self._entries: "OrderedDict[Tuple, Tuple[Any, int]]" = OrderedDict()
+        self._payload_counts: Dict[str, int] = {}  # 内容哈希 -> 已缓存的预处理结果数（不同细节级别）
+        self._phashes: Dict[str, int] = {}  # 已缓存预处理结果的图片 -> 感知哈希
+        self._aliases: Dict[str, str] = {}  # 近似重复的图片 -> 归并到的内容哈希
+        self._alias_sources: Dict[str, Set[str]] = {}  # 内容哈希 -> 归并到它的图片
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.stats_counter = {
+            "payload_hits": 0, "payload_misses": 0,
+            "answer_hits": 0, "answer_misses": 0,
+            "phash_matches": 0, "evictions": 0
+        }
+
+    def resolve(self, key: str) -> str:
+        """返回近似重复图片归并后的内容哈希"""
+        return self._aliases.get(key, key)
+
+    def _get(self, key: Tuple, stat: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            self.stats_counter[f"{stat}_hits" if entry is not None else f"{stat}_misses"] += 1
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _put(self, key: Tuple, value: Any, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            elif key[0] == "payload":
+                self._payload_counts[key[1]] = self._payload_counts.get(key[1], 0) + 1
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes and self._entries:
+                evicted_key, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.stats_counter["evictions"] += 1
+                if evicted_key[0] == "payload":
+                    self._release_payload(evicted_key[1])
+
+    def _release_payload(self, key: str):
+        """一个预处理结果被淘汰（需持有 _lock）：该图片没有剩余的预处理结果时，
+        删除它的感知哈希和别名，以及归并到它的其他图片的别名"""
+        count = self._payload_counts.get(key, 0) - 1
+        if count > 0:
+            self._payload_counts[key] = count
+            return
+        self._payload_counts.pop(key, None)
+        self._phashes.pop(key, None)
+        target = self._aliases.pop(key, None)
+        if target is not None:
+            sources = self._alias_sources.get(target)
+            if sources is not None:
+                sources.discard(key)
+                if not sources:
+                    del self._alias_sources[target]
+        for source in self._alias_sources.pop(key, ()):
+            self._aliases.pop(source, None)
+
+    def get_payload(self, key: str, variant: str = "") -> Optional[Dict[str, Any]]:
+        """获取预处理后的图片"""
+        return self._get(("payload", key, variant), "payload")
+
+    def put_payload(self, key: str, payload: Dict[str, Any], variant: str = ""):
+        """缓存预处理后的图片，体积按data URL长度计算"""
+        self._put(("payload", key, variant), payload, len(payload["data_url"]) + 512)
+
+    def match_phash(self, key: str, phash: Optional[int]) -> str:
+        """查找汉明距离在阈值内的已缓存图片，返回其内容哈希
+
+        只有预处理结果已缓存的图片才记录感知哈希和别名（先 put_payload 再调用）。
+        """
+        if not self.phash_enabled or phash is None:
+            return key
+
+        with self._lock:
+            canonical = key
+            for other_key, other_phash in self._phashes.items():
+                if other_key != key and bin(other_phash ^ phash).count("1") <= self.phash_distance:
+                    canonical = self._aliases.get(other_key, other_key)
+                    break
+            if canonical != key:
+                self.stats_counter["phash_matches"] += 1
+            if key in self._payload_counts:
+                self._phashes[key] = phash
+                if canonical != key:
+                    self._aliases[key] = canonical
+                    self._alias_sources.setdefault(canonical, set()).add(key)
+        return canonical
+
+    @staticmethod
+    def _answer_key(key: str, question: str, lang: str, tenant: Optional[str] = None) -> Tuple:
+        return ("answer", key, " ".join((question or "").split()), lang, tenant or DEFAULT_TENANT)
+
+    def get_answer(self, key: str, question: str, lang: str, tenant: Optional[str] = None) -> Optional[str]:
+        """获取 (图片, 问题, 语言, 租户) 对应的视觉模型回答"""
+        return self._get(self._answer_key(self.resolve(key), question, lang, tenant), "answer")
+
+    def put_answer(self, key: str, question: str, lang: str, answer: str, tenant: Optional[str] = None):
+        """缓存视觉模型回答"""
+        size = sys.getsizeof(answer) + len(question or "") + 256
+        self._put(self._answer_key(self.resolve(key), question, lang, tenant), answer, size)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "phashes": len(self._phashes),
+            "aliases": len(self._aliases),
+            **self.stats_counter
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._payload_counts.clear()
+            self._phashes.clear()
+            self._aliases.clear()
+            self._alias_sources.clear()
+            self.current_bytes = 0
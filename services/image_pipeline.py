@@ -0,0 +1,306 @@
+import asyncio
+import base64
+import io
+import multiprocessing
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+from config import Config
+
+# PIL 在第一次处理图片时导入（工作进程中也是），导入本模块只需要识别文件头的函数
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+SUPPORTED_FORMATS = [fmt.strip('.') for fmt in Config.SUPPORTED_IMAGE_FORMATS]
+
+# 文件头魔数 -> 图片格式
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+]
+
+# 识别格式所需的最少字节数
+SNIFF_BYTES = 12
+
+
+# 图片细节级别：最长边、JPEG质量和OpenAI image_url的detail参数
+IMAGE_DETAIL_LEVELS = {
+    "low": {"max_size": 512, "quality": 70, "detail": "low"},
+    "standard": {"max_size": 1024, "quality": 80, "detail": "auto"},
+    "high": {"max_size": 1536, "quality": 90, "detail": "high"},
+}
+
+# 需要看清细节的问题：瑕疵、破损、文字、标签等
+HIGH_DETAIL_KEYWORDS = [
+    "瑕疵", "破损", "划痕", "裂", "污渍", "色差", "起球", "脱线", "质量问题", "坏了",
+    "文字", "标签", "说明书", "型号", "条码", "批号", "生产日期", "保质期", "看清", "小字", "写的什么", "细节",
+    "defect", "scratch", "crack", "damage", "broken", "stain", "flaw",
+    "text", "read", "label", "serial", "barcode", "expiry", "detail",
+    "दोष", "खरोंच", "टूटा", "लेबल", "लिखा",
+]
+
+# 只需识别商品大类的问题：缩略图即可
+LOW_DETAIL_KEYWORDS = [
+    "这是什么", "什么东西", "什么产品", "什么商品", "哪一类", "同款", "类似", "推荐",
+    "what is this", "what is it", "what product", "similar", "recommend",
+    "यह क्या है",
+]
+
+
+def _keyword_pattern(keywords) -> "re.Pattern":
+    """英文关键词按整词匹配（允许复数、过去式等词尾，避免 read 命中 already），其他语言按子串匹配"""
+    parts = [rf"\b{re.escape(keyword)}(?:s|es|d|ed|ing)?\b" if keyword.isascii() else re.escape(keyword)
+             for keyword in keywords]
+    return re.compile("|".join(parts))
+
+
+HIGH_DETAIL_PATTERN = _keyword_pattern(HIGH_DETAIL_KEYWORDS)
+LOW_DETAIL_PATTERN = _keyword_pattern(LOW_DETAIL_KEYWORDS)
+
+
+def choose_detail_level(question: str, width: int, height: int) -> str:
+    """根据问题类型和图片尺寸选择细节级别"""
+    q = (question or "").lower()
+    if HIGH_DETAIL_PATTERN.search(q):
+        return "high"
+
+    # 长截图、单据等极端长宽比的图片通常包含文字
+    if max(width, height) / max(1, min(width, height)) >= 2.5:
+        return "high"
+
+    if LOW_DETAIL_PATTERN.search(q):
+        return "low"
+
+    # 本身就很小的图片没有必要按标准尺寸处理
+    if max(width, height) <= IMAGE_DETAIL_LEVELS["low"]["max_size"]:
+        return "low"
+
+    return "standard"
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """根据文件头识别图片格式，不依赖客户端声明的content_type"""
+    for signature, fmt in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def probe_image_size(image_data: bytes) -> Tuple[int, int]:
+    """只解析文件头获取图片尺寸（PIL惰性打开，不解码像素）"""
+    from PIL import Image
+    with Image.open(io.BytesIO(image_data)) as image:
+        return image.size
+
+
+def _target_size(width: int, height: int, max_size: int):
+    """按比例计算缩放后的尺寸"""
+    if width >= height:
+        return max_size, max(1, int(height * max_size / width))
+    return max(1, int(width * max_size / height)), max_size
+
+
+def dhash(image: "Image.Image", hash_size: int = 8) -> int:
+    """差值感知哈希（dHash），用于识别近似重复的图片"""
+    from PIL import Image
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def preprocess_image(image_data: bytes, max_size: int = 1024, quality: int = 75,
+                     phash: bool = False) -> Dict[str, Any]:
+    """解码、缩放、JPEG重新编码并生成base64 data URL
+
+    在工作进程中执行，返回结果和各阶段耗时（毫秒）；phash=True 时附带感知哈希。
+    """
+    from PIL import Image
+
+    timings = {}
+    start = time.perf_counter()
+
+    image = Image.open(io.BytesIO(image_data))
+    original_format = (image.format or "").lower()
+    if original_format not in SUPPORTED_FORMATS:
+        raise ValueError(f"不支持的图片格式: {image.format}")
+    original_size = image.size
+
+    # JPEG在DCT域直接按1/2、1/4、1/8缩小解码，避免解出全分辨率像素
+    if image.format == "JPEG":
+        image.draft("RGB", (max_size, max_size))
+    image.load()
+    now = time.perf_counter()
+    timings["decode"] = (now - start) * 1000
+    start = now
+
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    width, height = image.size
+    if width > max_size or height > max_size:
+        scale = max(width, height) / max_size
+        # 先用整数倍box降采样（reduce），再对剩余比例做精细缩放
+        factor = int(scale)
+        if factor >= 2:
+            image = image.reduce(factor)
+        # 缩小比例越大，细节越多已被reduce平均掉，可以用更便宜的滤波器
+        if scale >= 2:
+            resample = Image.Resampling.BILINEAR
+        elif scale >= 1.5:
+            resample = Image.Resampling.BICUBIC
+        else:
+            resample = Image.Resampling.LANCZOS
+        new_size = _target_size(width, height, max_size)
+        if image.size != new_size:
+            image = image.resize(new_size, resample)
+    now = time.perf_counter()
+    timings["resize"] = (now - start) * 1000
+    start = now
+
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=quality)
+    now = time.perf_counter()
+    timings["encode"] = (now - start) * 1000
+    start = now
+
+    data_url = "data:image/jpeg;base64," + base64.b64encode(buffered.getbuffer()).decode("ascii")
+    timings["base64"] = (time.perf_counter() - start) * 1000
+
+    result = {
+        "data_url": data_url,
+        "original_format": original_format,
+        "original_size": original_size,
+        "size": image.size,
+        "input_bytes": len(image_data),
+        "output_bytes": buffered.tell(),
+        "timings_ms": {k: round(v, 2) for k, v in timings.items()}
+    }
+    if phash:
+        result["phash"] = dhash(image)
+    return result
+
+
+class ImagePipeline:
+    """图片预处理流水线，在进程池中执行CPU密集的解码和编码，避免阻塞事件循环"""
+
+    def __init__(self, max_workers: Optional[int] = None, max_size: Optional[int] = None,
+                 quality: Optional[int] = None):
+        self.max_workers = Config.IMAGE_WORKERS if max_workers is None else max_workers
+        self.max_size = max_size or Config.IMAGE_MAX_SIZE
+        self.quality = quality or Config.IMAGE_JPEG_QUALITY
+        self._executor = None
+
+        # 累计统计
+        self.processed = 0
+        self.total_timings_ms: Dict[str, float] = {}
+        self.level_stats: Dict[str, Dict[str, float]] = {}
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.max_workers <= 0:
+            return None
+        if self._executor is None:
+            # 使用spawn，避免fork已加载模型和线程的父进程
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def select_options(self, image_data: bytes, question: str) -> Dict[str, Any]:
+        """选择预处理参数
+
+        IMAGE_DETAIL_MODE=adaptive 时根据问题和文件头中的尺寸选择细节级别，
+        否则使用固定的 IMAGE_MAX_SIZE / IMAGE_JPEG_QUALITY。
+        """
+        if Config.IMAGE_DETAIL_MODE != "adaptive":
+            return {"level": "fixed", "max_size": self.max_size, "quality": self.quality, "detail": "auto"}
+
+        try:
+            width, height = probe_image_size(image_data)
+        except Exception:
+            width, height = self.max_size, self.max_size
+        level = choose_detail_level(question, width, height)
+        return {"level": level, **IMAGE_DETAIL_LEVELS[level]}
+
+    def _level_entry(self, level: str) -> Dict[str, float]:
+        return self.level_stats.setdefault(level, {
+            "count": 0, "input_bytes": 0, "output_bytes": 0, "vision_calls": 0, "vision_seconds": 0.0
+        })
+
+    def _record(self, result: Dict[str, Any], level: Optional[str] = None):
+        self.processed += 1
+        for stage, value in result["timings_ms"].items():
+            self.total_timings_ms[stage] = self.total_timings_ms.get(stage, 0.0) + value
+        if level:
+            entry = self._level_entry(level)
+            entry["count"] += 1
+            entry["input_bytes"] += result["input_bytes"]
+            entry["output_bytes"] += len(result["data_url"])
+
+    def record_vision_latency(self, level: str, seconds: float):
+        """记录某个细节级别下视觉模型的调用耗时"""
+        entry = self._level_entry(level)
+        entry["vision_calls"] += 1
+        entry["vision_seconds"] += seconds
+
+    def process_sync(self, image_data: bytes, **kwargs) -> Dict[str, Any]:
+        """在当前线程同步处理图片"""
+        result = preprocess_image(image_data, **self._options(kwargs))
+        self._record(result, kwargs.get("level"))
+        return result
+
+    async def process(self, image_data: bytes, **kwargs) -> Dict[str, Any]:
+        """在进程池中处理图片（IMAGE_WORKERS=0 时退化为默认线程池）"""
+        loop = asyncio.get_running_loop()
+        func = partial(preprocess_image, image_data, **self._options(kwargs))
+        result = await loop.run_in_executor(self._get_executor(), func)
+        self._record(result, kwargs.get("level"))
+        return result
+
+    def _options(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "max_size": kwargs.get("max_size") or self.max_size,
+            "quality": kwargs.get("quality") or self.quality,
+            "phash": kwargs.get("phash", False)
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """各阶段平均耗时"""
+        count = self.processed or 1
+        levels = {}
+        for level, entry in self.level_stats.items():
+            n = entry["count"] or 1
+            calls = entry["vision_calls"] or 1
+            levels[level] = {
+                "count": entry["count"],
+                "avg_input_bytes": round(entry["input_bytes"] / n),
+                "avg_payload_bytes": round(entry["output_bytes"] / n),
+                "vision_calls": entry["vision_calls"],
+                "avg_vision_latency_ms": round(entry["vision_seconds"] / calls * 1000, 2)
+            }
+        return {
+            "processed": self.processed,
+            "workers": self.max_workers,
+            "detail_mode": Config.IMAGE_DETAIL_MODE,
+            "avg_timings_ms": {k: round(v / count, 2) for k, v in self.total_timings_ms.items()},
+            "levels": levels
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
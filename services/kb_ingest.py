@@ -0,0 +1,340 @@
+import asyncio
+import codecs
+import json
+import os
+import re
+import shutil
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from config import Config
+
+if TYPE_CHECKING:
+    import httpx
+
+# 快照格式版本：documents.jsonl（每行一个文档）+ embeddings.f32（按行存放的float32向量）+ manifest.json
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_DOCUMENTS = "documents.jsonl"
+SNAPSHOT_EMBEDDINGS = "embeddings.f32"
+SNAPSHOT_MANIFEST = "manifest.json"
+
+# JSON对象中包含条目数组的字段
+_ARRAY_KEY = re.compile(r'"(faqs|categories|documents|items)"\s*:\s*\[')
+_CONTAINER_KEYS = ("faqs", "categories", "documents", "items")
+_WHITESPACE = re.compile(r"[\s,]*")
+# 自动判断格式时首行最多缓冲这么多字符；超过仍没有换行、且以数组开头或含条目数组字段的，
+# 视为压缩成一行的大JSON文件，按数组流式解析
+_DETECT_MAX_LINE = 1 << 20
+
+
+class JSONItemStream:
+    """增量解析JSON/JSONL文本流，逐个产出条目
+
+    - JSONL：每行一个JSON值（条目、条目数组或 {"faqs": [...]}）
+    - JSON：顶层数组，或对象中 faqs/categories/documents/items 字段的数组
+    缓冲区只保留尚未解析完的部分，内存占用与单个条目大小相关，与文件大小无关。
+    """
+
+    def __init__(self, jsonl: Optional[bool] = None):
+        self.jsonl = jsonl
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.in_array = False
+        self.done = False
+
+    def feed(self, chunk: bytes, final: bool = False) -> Iterator[Any]:
+        self.buffer += self.utf8.decode(chunk, final)
+        if self.jsonl is None:
+            self.buffer = self.buffer.lstrip("\ufeff \t\r\n")
+            if not self.buffer:
+                return
+            self.jsonl = self._detect_jsonl(final)
+            if self.jsonl is None:
+                return
+        yield from (self._feed_lines(final) if self.jsonl else self._feed_array(final))
+
+    def _detect_jsonl(self, final: bool) -> Optional[bool]:
+        """首行是完整的JSON值且后面还有内容时按JSONL处理，数据不足以判断时返回None
+
+        只有一行的输入也按行处理（该行可以是条目、条目数组或 {"faqs": [...]}）；
+        首行不是完整的JSON值时为多行排版的JSON文件。
+        """
+        newline = self.buffer.find("\n")
+        if newline < 0:
+            if final:
+                return True
+            if len(self.buffer) > _DETECT_MAX_LINE and \
+                    (self.buffer[0] == "[" or _ARRAY_KEY.search(self.buffer) is not None):
+                return False
+            return None
+        try:
+            self.decoder.decode(self.buffer[:newline])
+        except ValueError:
+            return False
+        if final or self.buffer[newline:].strip():
+            return True
+        return None
+
+    def _feed_lines(self, final: bool) -> Iterator[Any]:
+        lines = self.buffer.split("\n")
+        self.buffer = "" if final else lines.pop()
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            # 每行也可以是 [...] 或 {"faqs": [...]} 形式的一组条目
+            if isinstance(item, list):
+                yield from item
+            elif isinstance(item, dict) and any(isinstance(item.get(key), list) for key in _CONTAINER_KEYS):
+                for key in _CONTAINER_KEYS:
+                    yield from item.get(key) or []
+            else:
+                yield item
+
+    def _feed_array(self, final: bool) -> Iterator[Any]:
+        if self.done:
+            return
+        if not self.in_array:
+            if self.buffer.startswith("["):
+                self.buffer = self.buffer[1:]
+            else:
+                match = _ARRAY_KEY.search(self.buffer)
+                if match is None:
+                    if final:
+                        raise ValueError("未找到条目数组（需要顶层数组或 faqs/categories 字段）")
+                    return
+                self.buffer = self.buffer[match.end():]
+            self.in_array = True
+
+        position = 0
+        while True:
+            position = _WHITESPACE.match(self.buffer, position).end()
+            if position >= len(self.buffer):
+                break
+            if self.buffer[position] == "]":
+                self.done = True
+                break
+            try:
+                item, end = self.decoder.raw_decode(self.buffer, position)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break  # 条目不完整，等待更多数据
+            yield item
+            position = end
+        self.buffer = self.buffer[position:]
+
+
+class SnapshotWriter:
+    """按批追加写入知识库快照，完成后整体替换目标目录"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.documents_file = open(os.path.join(self.tmp_path, SNAPSHOT_DOCUMENTS), "w", encoding="utf-8")
+        self.embeddings_file = open(os.path.join(self.tmp_path, SNAPSHOT_EMBEDDINGS), "wb")
+        self.count = 0
+        self.dim = 0
+
+    def write(self, documents: Sequence[Dict[str, Any]], embeddings: Optional[np.ndarray]):
+        self.documents_file.write("".join(json.dumps(doc, ensure_ascii=False) + "\n" for doc in documents))
+        if embeddings is not None:
+            self.dim = embeddings.shape[1]
+            self.embeddings_file.write(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+        self.count += len(documents)
+
+    def close(self, manifest: Dict[str, Any]):
+        self.documents_file.close()
+        self.embeddings_file.close()
+        with open(os.path.join(self.tmp_path, SNAPSHOT_MANIFEST), "w", encoding="utf-8") as f:
+            json.dump({"format": SNAPSHOT_FORMAT, "documents": self.count, "dim": self.dim, **manifest},
+                      f, ensure_ascii=False, indent=2)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.documents_file.close()
+        self.embeddings_file.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+def read_snapshot(path: str) -> Dict[str, Any]:
+    """读取快照：文档列表和内存映射的向量矩阵（没有向量时为None）"""
+    with open(os.path.join(path, SNAPSHOT_MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    documents = []
+    with open(os.path.join(path, SNAPSHOT_DOCUMENTS), "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                documents.append(json.loads(line))
+
+    embeddings = None
+    if manifest.get("dim") and documents:
+        embeddings = np.memmap(os.path.join(path, SNAPSHOT_EMBEDDINGS), dtype=np.float32, mode="r",
+                               shape=(len(documents), manifest["dim"]))
+    return {"manifest": manifest, "documents": documents, "embeddings": embeddings}
+
+
+class KnowledgeIngestor:
+    """流式批量导入外部知识库
+
+    多个来源（本地文件或URL，JSON或JSONL）并发读取并增量解析，条目按块规范化为文档
+    放入有界队列，单个消费者按 batch_size 批量向量化后直接追加写入快照。
+    队列和批次都有上限，内存占用与导入规模无关。
+    """
+
+    def __init__(self, knowledge_base, batch_size: Optional[int] = None, concurrency: Optional[int] = None,
+                 chunk_size: Optional[int] = None, lang: Optional[str] = None,
+                 progress_interval: float = 5.0):
+        self.knowledge_base = knowledge_base
+        self.batch_size = batch_size or Config.INGEST_BATCH_SIZE
+        self.concurrency = concurrency or Config.INGEST_CONCURRENCY
+        self.chunk_size = chunk_size or Config.INGEST_CHUNK_SIZE
+        self.lang = lang or Config.KNOWLEDGE_SOURCE_LANG
+        self.progress_interval = progress_interval
+        # 已产生的文档ID及次数，跨批次和来源去重
+        self.seen_ids: Dict[str, int] = {}
+        self.stats = {"items": 0, "documents": 0, "bytes": 0, "batches": 0,
+                      "embed_seconds": 0.0, "failed_sources": []}
+
+    async def _read_chunks(self, source: str, client: "httpx.AsyncClient") -> AsyncIterator[bytes]:
+        if source.startswith(("http://", "https://")):
+            async with client.stream("GET", source) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(self.chunk_size):
+                    yield chunk
+            return
+        with open(source, "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def _normalize(self, items: List[Any], source: str) -> List[Dict[str, Any]]:
+        """把一块原始条目规范化为知识库文档（与知识库文件的处理方式一致）"""
+        from services.knowledge_base import assign_unique_ids  # knowledge_base 依赖本模块
+
+        kb = self.knowledge_base
+        faqs = [item for item in items if isinstance(item, dict) and "question" in item and "answer" in item]
+        categories = [item for item in items if isinstance(item, dict) and "subcategories" in item]
+        documents = []
+        if faqs:
+            for faq in faqs:
+                faq.setdefault("category", "")
+            kb._process_faq_data({"faqs": faqs}, self.lang, source, documents)
+        if categories:
+            kb._process_category_data({"categories": categories}, self.lang, source, documents)
+        return assign_unique_ids(documents, self.seen_ids)
+
+    async def _produce(self, source: str, client: "httpx.AsyncClient", queue: asyncio.Queue,
+                       semaphore: asyncio.Semaphore):
+        async with semaphore:
+            parser = JSONItemStream(jsonl=True if source.endswith(".jsonl") else None)
+            items = []
+            try:
+                async for chunk in self._read_chunks(source, client):
+                    self.stats["bytes"] += len(chunk)
+                    for item in parser.feed(chunk):
+                        items.append(item)
+                        if len(items) >= self.batch_size:
+                            await self._put(items, source, queue)
+                            items = []
+                for item in parser.feed(b"", final=True):
+                    items.append(item)
+                if items:
+                    await self._put(items, source, queue)
+            except Exception as e:
+                print(f"⚠️ 导入失败 {source}: {e}")
+                self.stats["failed_sources"].append({"source": source, "error": str(e)})
+
+    async def _put(self, items: List[Any], source: str, queue: asyncio.Queue):
+        self.stats["items"] += len(items)
+        documents = self._normalize(items, source)
+        if documents:
+            await queue.put(documents)
+
+    async def _consume(self, queue: asyncio.Queue, writer: SnapshotWriter):
+        pending: List[Dict[str, Any]] = []
+        while True:
+            documents = await queue.get()
+            if documents is None:
+                break
+            pending.extend(documents)
+            while len(pending) >= self.batch_size:
+                await self._write_batch(pending[:self.batch_size], writer)
+                pending = pending[self.batch_size:]
+        if pending:
+            await self._write_batch(pending, writer)
+
+    async def _write_batch(self, documents: List[Dict[str, Any]], writer: SnapshotWriter):
+        embeddings = None
+        if self.knowledge_base.embedding_model is not None:
+            start = time.perf_counter()
+            embeddings = await asyncio.to_thread(
+                self.knowledge_base.encode_texts, [doc["content"] for doc in documents]
+            )
+            self.stats["embed_seconds"] += time.perf_counter() - start
+        await asyncio.to_thread(writer.write, documents, embeddings)
+        self.stats["documents"] += len(documents)
+        self.stats["batches"] += 1
+
+    async def _report_progress(self, start: float):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            elapsed = time.perf_counter() - start
+            print(f"⏳ 已读取 {self.stats['bytes'] / 1024 / 1024:.1f}MB，条目 {self.stats['items']}，"
+                  f"已写入文档 {self.stats['documents']}（{self.stats['documents'] / elapsed:.0f} 条/秒）")
+
+    async def ingest(self, sources: Sequence[str], output_path: Optional[str] = None) -> Dict[str, Any]:
+        """导入全部来源并写入快照目录，返回导入统计"""
+        output_path = output_path or Config.KNOWLEDGE_SNAPSHOT_PATH
+        start = time.perf_counter()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=Config.INGEST_QUEUE_SIZE)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        writer = SnapshotWriter(output_path)
+        progress = asyncio.create_task(self._report_progress(start))
+
+        # httpx 只在导入外部知识时使用，读取快照不需要
+        import httpx
+
+        try:
+            async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=300.0), follow_redirects=True) as client:
+                consumer = asyncio.create_task(self._consume(queue, writer))
+                producers = asyncio.ensure_future(asyncio.gather(
+                    *(self._produce(source, client, queue, semaphore) for source in sources)
+                ))
+                done, _ = await asyncio.wait({consumer, producers}, return_when=asyncio.FIRST_COMPLETED)
+                if consumer in done:
+                    # 消费者只会因向量化或写入失败提前结束，此时生产者可能阻塞在满队列上
+                    producers.cancel()
+                    consumer.result()
+                await producers
+                await queue.put(None)
+                await consumer
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            progress.cancel()
+
+        seconds = time.perf_counter() - start
+        model = getattr(self.knowledge_base.embedding_model, "model_name", None)
+        writer.close({"sources": list(sources), "model": model, "created_at": time.time()})
+        return {
+            "success": not self.stats["failed_sources"],
+            "path": output_path,
+            "sources": len(sources),
+            **self.stats,
+            "embed_seconds": round(self.stats["embed_seconds"], 3),
+            "dim": writer.dim,
+            "seconds": round(seconds, 3),
+            "docs_per_second": round(self.stats["documents"] / seconds, 1) if seconds > 0 else 0.0,
+            "mb_per_second": round(self.stats["bytes"] / 1024 / 1024 / seconds, 2) if seconds > 0 else 0.0
+        }
@@ -0,0 +1,175 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+from config import Config
+
+# 目标语言名称（用于翻译提示词）
+LANGUAGE_NAMES = {
+    "zh": "Simplified Chinese",
+    "en": "English",
+    "hi": "Hindi",
+}
+
+TRANSLATION_PROMPT = """Translate every string in the following JSON array from {source} into {target}.
+This is e-commerce customer service content (Taobao FAQ and product categories): keep numbers, \
+menu names in quotes and list numbering, and keep the translation concise.
+Return only a JSON array of {count} strings in the same order.
+
+{items}"""
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class KnowledgeTranslator:
+    """知识库批量翻译任务（离线执行）
+
+    把源语言的FAQ和商品分类文件翻译为其他语言的同结构文件，翻译结果按
+    (目标语言, 原文哈希) 缓存到磁盘，重复运行时只翻译新增或修改过的文本。
+    """
+
+    def __init__(self, router, cache_path: Optional[str] = None, batch_size: int = 20,
+                 concurrency: int = 4, source_lang: Optional[str] = None):
+        self.router = router
+        self.cache_path = cache_path or os.path.join(Config.KNOWLEDGE_TRANSLATIONS_PATH, "translation_cache.json")
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.source_lang = source_lang or Config.KNOWLEDGE_SOURCE_LANG
+        self.cache: Dict[str, Dict[str, str]] = {}
+        self.stats = {"cached": 0, "translated": 0, "requests": 0, "failed": 0}
+
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                self.cache = json.load(f)
+
+    def save_cache(self):
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        with open(self.cache_path, "w", encoding="utf-8") as f:
+            json.dump(self.cache, f, ensure_ascii=False, indent=2)
+
+    async def _translate_batch(self, texts: List[str], lang: str) -> List[str]:
+        prompt = TRANSLATION_PROMPT.format(
+            source=LANGUAGE_NAMES.get(self.source_lang, self.source_lang),
+            target=LANGUAGE_NAMES.get(lang, lang),
+            count=len(texts),
+            items=json.dumps(texts, ensure_ascii=False)
+        )
+        async with self.semaphore:
+            self.stats["requests"] += 1
+            response = await self.router.achat_completion(
+                "text",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+                max_tokens=Config.MAX_TOKENS * 2
+            )
+        content = (response.choices[0].message.content or "").strip()
+        # 去掉模型可能附带的代码块标记
+        content = content[content.find("["):content.rfind("]") + 1]
+        translated = json.loads(content)
+        if not isinstance(translated, list) or len(translated) != len(texts):
+            raise ValueError(f"翻译结果条数不匹配: {len(texts)} -> {len(translated) if isinstance(translated, list) else '?'}")
+        return [str(item) for item in translated]
+
+    async def translate_texts(self, texts: Sequence[str], lang: str) -> Dict[str, str]:
+        """翻译一组文本，返回 原文 -> 译文（命中缓存的不再请求）"""
+        lang_cache = self.cache.setdefault(lang, {})
+        unique = list(dict.fromkeys(text for text in texts if text))
+        missing = [text for text in unique if text_key(text) not in lang_cache]
+        self.stats["cached"] += len(unique) - len(missing)
+
+        async def run(batch: List[str]):
+            try:
+                translated = await self._translate_batch(batch, lang)
+            except Exception as e:
+                if len(batch) == 1:
+                    print(f"⚠️ 翻译失败，保留原文: {batch[0][:30]}... ({e})")
+                    self.stats["failed"] += 1
+                    return
+                # 整批解析失败时逐条重试
+                await asyncio.gather(*(run([text]) for text in batch))
+                return
+            for source, target in zip(batch, translated):
+                lang_cache[text_key(source)] = target
+            self.stats["translated"] += len(batch)
+
+        batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+        await asyncio.gather(*(run(batch) for batch in batches))
+        return {text: lang_cache.get(text_key(text), text) for text in unique}
+
+    @staticmethod
+    def _faq_texts(faq_data: Dict[str, Any]) -> List[str]:
+        texts = []
+        for faq in faq_data.get("faqs", []):
+            texts.extend([faq["question"], faq["answer"], faq.get("category", "")])
+            texts.extend(faq.get("keywords", []))
+        return texts
+
+    @staticmethod
+    def _category_texts(category_data: Dict[str, Any]) -> List[str]:
+        texts = []
+        for category in category_data.get("categories", []):
+            texts.append(category["name"])
+            for subcategory in category.get("subcategories", []):
+                texts.append(subcategory["name"])
+                texts.extend(subcategory.get("keywords", []))
+                texts.extend(subcategory.get("common_questions", []))
+        return texts
+
+    async def translate_faq_data(self, faq_data: Dict[str, Any], lang: str) -> Dict[str, Any]:
+        """翻译FAQ文件，结构与源文件相同"""
+        mapping = await self.translate_texts(self._faq_texts(faq_data), lang)
+        result = copy.deepcopy(faq_data)
+        for faq in result.get("faqs", []):
+            for field in ("question", "answer", "category"):
+                if faq.get(field):
+                    faq[field] = mapping.get(faq[field], faq[field])
+            faq["keywords"] = [mapping.get(word, word) for word in faq.get("keywords", [])]
+        return result
+
+    async def translate_category_data(self, category_data: Dict[str, Any], lang: str) -> Dict[str, Any]:
+        """翻译商品分类文件，结构与源文件相同"""
+        mapping = await self.translate_texts(self._category_texts(category_data), lang)
+        result = copy.deepcopy(category_data)
+        for category in result.get("categories", []):
+            category["name"] = mapping.get(category["name"], category["name"])
+            for subcategory in category.get("subcategories", []):
+                subcategory["name"] = mapping.get(subcategory["name"], subcategory["name"])
+                for field in ("keywords", "common_questions"):
+                    subcategory[field] = [mapping.get(item, item) for item in subcategory.get(field, [])]
+        return result
+
+    async def translate_knowledge_base(self, languages: Sequence[str], source_path: Optional[str] = None,
+                                       output_path: Optional[str] = None) -> Dict[str, Any]:
+        """翻译知识库源文件，写入 {output_path}/{lang}/ 下的同名文件"""
+        source_path = source_path or Config.KNOWLEDGE_BASE_PATH
+        output_path = output_path or Config.KNOWLEDGE_TRANSLATIONS_PATH
+        handlers = {
+            "product_faq.json": self.translate_faq_data,
+            "product_categories.json": self.translate_category_data,
+        }
+
+        written = []
+        for lang in languages:
+            if lang == self.source_lang:
+                continue
+            os.makedirs(os.path.join(output_path, lang), exist_ok=True)
+            for filename, handler in handlers.items():
+                path = os.path.join(source_path, filename)
+                if not os.path.exists(path):
+                    continue
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                translated = await handler(data, lang)
+                target = os.path.join(output_path, lang, filename)
+                with open(target, "w", encoding="utf-8") as f:
+                    json.dump(translated, f, ensure_ascii=False, indent=2)
+                written.append(target)
+            # 每种语言完成后保存缓存，中断后重跑不会重复翻译
+            self.save_cache()
+
+        return {"files": written, **self.stats}
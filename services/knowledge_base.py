@@ -1,31 +1,99 @@
+import asyncio
+import hashlib
+import importlib.util
 import json
 import os
-import requests
-from typing import List, Dict, Any
-import faiss
+import sys
+import threading
+import time
+from typing import List, Dict, Any, Optional, Sequence
 import numpy as np
 from config import Config
+from services.doc_store import labels_for, render_content
+from services.kb_ingest import KnowledgeIngestor, read_snapshot
+from services.onnx_embedder import OnnxEmbedder
+from services.retrieval import CrossEncoderReranker, EmbeddingReranker, SegmentedIndex
 
-# 尝试导入sentence_transformers，如果失败则使用备用方案
-try:
-    from sentence_transformers import SentenceTransformer
-    SENTENCE_TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    SENTENCE_TRANSFORMERS_AVAILABLE = False
+# sentence_transformers（以及torch）在加载模型时才导入，这里只检查是否已安装
+SENTENCE_TRANSFORMERS_AVAILABLE = importlib.util.find_spec("sentence_transformers") is not None
+if not SENTENCE_TRANSFORMERS_AVAILABLE:
     print("警告: sentence_transformers 不可用，将使用简单的关键词匹配")
 
+# 知识库源文件
+KNOWLEDGE_FILES = ("product_faq.json", "product_categories.json")
+
+
+def make_doc_id(lang: str, kind: str, key: str) -> str:
+    """由语言、文档类型和业务主键生成稳定的文档ID"""
+    return f"{lang}:{kind}:{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}"
+
+
+def assign_unique_ids(documents: List[Dict[str, Any]], seen: Dict[str, int]) -> List[Dict[str, Any]]:
+    """
+    保证同一次加载中文档ID不重复：主键相同的文档（例如问题相同、答案不同的FAQ）
+    第一个保留原ID，之后的按来源路径和重复序号生成新ID，重新加载时ID保持稳定
+
+    seen 记录已出现的ID及次数，可跨多次调用共享（流式导入按批调用）
+    """
+    for document in documents:
+        doc_id = document['id']
+        count = seen.get(doc_id, 0)
+        seen[doc_id] = count + 1
+        if count:
+            lang, kind, _ = doc_id.split(':', 2)
+            document['id'] = make_doc_id(lang, kind, f"{doc_id}|{document.get('source') or ''}#{count}")
+    return documents
+
+
 class KnowledgeBase:
-    """知识库管理类"""
+    """知识库管理类
+
+    文档按语言分区，每种语言一个独立的检索索引；源语言之外的分区来自离线翻译生成的
+    knowledge_base/translations/{lang}/ 文件（见 translate_knowledge_base.py）。
+
+    单条文档的新增、修改和删除只写入分区的增量段和墓碑位图（耗时与知识库规模无关），
+    墓碑占比超过阈值后在后台线程中合并重建该分区的索引。
+    """
     
-    def __init__(self):
+    def __init__(self, load_model: bool = True, knowledge_path: Optional[str] = None):
+        """knowledge_path 为知识库文件目录（默认 KNOWLEDGE_BASE_PATH），翻译和快照在其下的
+        translations/ 和 snapshot/ 中（多租户知识库，见 services/tenants.py）"""
         self.config = Config()
+        self.knowledge_path = knowledge_path or self.config.KNOWLEDGE_BASE_PATH
+        self.translations_path = os.path.join(knowledge_path, "translations") if knowledge_path \
+            else self.config.KNOWLEDGE_TRANSLATIONS_PATH
+        self.snapshot_path = os.path.join(knowledge_path, "snapshot") if knowledge_path \
+            else self.config.KNOWLEDGE_SNAPSHOT_PATH
         self.embedding_model = None
-        self.index = None
-        self.documents = []
-        self.document_embeddings = []
-        
+        self.index = None  # 源语言分区的检索索引
+        self.partitions = {}  # 语言 -> 检索索引
+        self.reranker = None
+        self.version = 0  # 每次替换检索索引后递增
+        self._reload_lock = threading.Lock()  # 重新加载、单条写入和合并替换互斥
+        self._compaction_logs = {}  # 正在后台合并的分区 -> 合并期间的写操作
+        self._snapshot_vectors = None  # 模型就绪前合并的快照向量：(ID → 行号, 内容哈希, 向量矩阵)
+        # 通过接口写入过的文档ID -> 'upsert' / 'delete'：重新加载知识库文件时以接口写入的版本为准
+        self._api_writes: Dict[str, str] = {}
+        self.compaction_stats = {"compactions": 0, "last_compaction_ms": 0.0}
+        self._watcher = None
+        self._watcher_stop = threading.Event()
+        self.last_reload = None
+        # 各检索阶段累计耗时
+        self.retrieval_stats = {"searches": 0, "total_ms": {}}
+
+        if load_model:
+            self.load_embedding_model()
+
+    def load_embedding_model(self):
+        """加载文本向量化模型，返回模型；加载失败或依赖不可用时为None（只使用BM25检索）"""
+        # 使用ONNX Runtime int8量化模型（不可用时回退到PyTorch）
+        if self.config.EMBEDDING_BACKEND == "onnx":
+            self.embedding_model = self._load_onnx_model()
+
         # 初始化embedding模型（使用本地缓存）
-        if SENTENCE_TRANSFORMERS_AVAILABLE:
+        if self.embedding_model is not None:
+            pass
+        elif SENTENCE_TRANSFORMERS_AVAILABLE:
             try:
                 print("🔄 正在加载文本向量化模型...")
                 print("📦 模型名称: paraphrase-multilingual-MiniLM-L12-v2")
@@ -34,6 +102,7 @@ class KnowledgeBase:
                 # 添加进度提示
                 import time
                 start_time = time.time()
+                from sentence_transformers import SentenceTransformer
                 
                 # 设置环境变量强制使用本地缓存
                 import os
@@ -75,232 +144,806 @@ class KnowledgeBase:
         else:
             print("⚠️ sentence_transformers 不可用，将使用简单的关键词匹配")
             self.embedding_model = None
-        
+        return self.embedding_model
+
+    def _load_onnx_model(self):
+        """加载 export_onnx_model.py 导出的ONNX模型，失败时返回None"""
+        try:
+            print(f"🔄 正在加载ONNX文本向量化模型: {self.config.ONNX_MODEL_PATH}")
+            start_time = time.time()
+            model = OnnxEmbedder(self.config.ONNX_MODEL_PATH, self.config.ONNX_THREADS)
+            print(f"✅ ONNX文本向量化模型加载成功！耗时: {time.time() - start_time:.2f}秒")
+            return model
+        except Exception as e:
+            print(f"⚠️ ONNX模型加载失败，使用PyTorch模型: {e}")
+            print("💡 请先运行 python export_onnx_model.py 导出模型")
+            return None
+
     def load_knowledge_base(self):
         """加载知识库数据"""
         print("📚 开始加载知识库...")
-        knowledge_path = self.config.KNOWLEDGE_BASE_PATH
-        
+        documents = self._read_source_documents()
+
+        # 构建向量索引
+        print("🔍 构建知识库索引...")
+        self._build_vector_index(documents)
+
+        # 合并批量导入生成的快照（见 ingest_knowledge.py）
+        if os.path.exists(os.path.join(self.snapshot_path, "manifest.json")):
+            result = self.load_snapshot()
+            print(f"📦 已合并知识库快照: {result['snapshot_documents']} 个文档")
+        print("✅ 知识库加载完成！")
+
+    @property
+    def documents(self) -> List[Dict[str, Any]]:
+        """全部存活文档（按分区顺序）"""
+        return [doc for index in self.partitions.values() for doc in index.live_documents()]
+
+    @property
+    def document_embeddings(self):
+        """与 documents 顺序一致的向量矩阵，没有向量时为空列表"""
+        matrices = [index.live_embeddings() for index in self.partitions.values()]
+        if not matrices or any(matrix is None for matrix in matrices):
+            return []
+        return np.vstack(matrices)
+
+    def _source_dirs(self) -> List[tuple]:
+        """(目录, 语言)：源语言目录和离线翻译生成的其他语言目录"""
+        source_lang = self.config.KNOWLEDGE_SOURCE_LANG
+        dirs = [(self.knowledge_path, source_lang)]
+        for lang in self.config.KNOWLEDGE_LANGUAGES:
+            lang_path = os.path.join(self.translations_path, lang)
+            if lang != source_lang and os.path.isdir(lang_path):
+                dirs.append((lang_path, lang))
+        return dirs
+
+    def _read_source_documents(self, verbose: bool = True) -> List[Dict[str, Any]]:
+        """读取全部语言的知识库文件，返回新的文档列表（不修改当前索引）"""
+        documents = []
+        for knowledge_path, lang in self._source_dirs():
+            if lang != self.config.KNOWLEDGE_SOURCE_LANG and verbose:
+                print(f"🌐 加载 {lang} 语言知识库...")
+            self._load_language_files(knowledge_path, lang, documents, verbose)
+        return assign_unique_ids(documents, {})
+
+    def _load_language_files(self, knowledge_path: str, lang: str,
+                             documents: Optional[List[Dict[str, Any]]] = None, verbose: bool = True):
+        """加载某一语言的FAQ和商品分类文件"""
         # 加载FAQ知识库
         faq_path = os.path.join(knowledge_path, "product_faq.json")
         if os.path.exists(faq_path):
-            print("📖 加载FAQ知识库...")
+            if verbose:
+                print("📖 加载FAQ知识库...")
             with open(faq_path, 'r', encoding='utf-8') as f:
                 faq_data = json.load(f)
-                self._process_faq_data(faq_data)
-            print(f"✅ FAQ知识库加载完成，共 {len(faq_data.get('faqs', []))} 个问题")
-        else:
+                self._process_faq_data(faq_data, lang, faq_path, documents)
+            if verbose:
+                print(f"✅ FAQ知识库加载完成，共 {len(faq_data.get('faqs', []))} 个问题")
+        elif verbose:
             print("⚠️ FAQ知识库文件不存在")
-        
+
         # 加载商品分类知识库
         category_path = os.path.join(knowledge_path, "product_categories.json")
         if os.path.exists(category_path):
-            print("🏷️ 加载商品分类知识库...")
+            if verbose:
+                print("🏷️ 加载商品分类知识库...")
             with open(category_path, 'r', encoding='utf-8') as f:
                 category_data = json.load(f)
-                self._process_category_data(category_data)
-            print(f"✅ 商品分类知识库加载完成，共 {len(category_data.get('categories', []))} 个分类")
-        else:
+                self._process_category_data(category_data, lang, category_path, documents)
+            if verbose:
+                print(f"✅ 商品分类知识库加载完成，共 {len(category_data.get('categories', []))} 个分类")
+        elif verbose:
             print("⚠️ 商品分类知识库文件不存在")
-        
-        # 构建向量索引
-        print("🔍 构建知识库索引...")
-        self._build_vector_index()
-        print("✅ 知识库加载完成！")
-    
-    def _process_faq_data(self, faq_data: Dict[str, Any]):
-        """处理FAQ数据"""
+
+    @staticmethod
+    def _labels(lang: str) -> Dict[str, str]:
+        return labels_for(lang)
+
+    def _process_faq_data(self, faq_data: Dict[str, Any], lang: Optional[str] = None,
+                          source: Optional[str] = None, documents: Optional[List[Dict[str, Any]]] = None
+                          ) -> List[Dict[str, Any]]:
+        """处理FAQ数据（FAQ条目可带 id 字段，否则以问题文本作为主键），返回文档列表"""
+        lang = lang or self.config.KNOWLEDGE_SOURCE_LANG
+        documents = [] if documents is None else documents
         for faq in faq_data.get('faqs', []):
-            # 创建文档内容
-            content = f"问题：{faq['question']}\n答案：{faq['answer']}\n分类：{faq['category']}"
-            
-            # 添加关键词
-            if 'keywords' in faq:
-                content += f"\n关键词：{', '.join(faq['keywords'])}"
-            
-            self.documents.append({
-                'content': content,
+            document = {
+                'id': make_doc_id(lang, 'faq', str(faq.get('id') or faq['question'])),
+                'source': source,
+                'content': None,
                 'type': 'faq',
+                'lang': lang,
                 'category': faq.get('category', ''),
                 'question': faq['question'],
                 'answer': faq['answer']
-            })
-    
-    def _process_category_data(self, category_data: Dict[str, Any]):
-        """处理商品分类数据"""
+            }
+            # 保留关键词，文档存储可以由字段重新生成 content 而不必单独保存
+            if 'keywords' in faq:
+                document['keywords'] = faq['keywords']
+            document['content'] = render_content(document)
+            documents.append(document)
+        return documents
+
+    def _process_category_data(self, category_data: Dict[str, Any], lang: Optional[str] = None,
+                               source: Optional[str] = None, documents: Optional[List[Dict[str, Any]]] = None
+                               ) -> List[Dict[str, Any]]:
+        """处理商品分类数据，返回文档列表"""
+        lang = lang or self.config.KNOWLEDGE_SOURCE_LANG
+        documents = [] if documents is None else documents
         for category in category_data.get('categories', []):
             category_name = category['name']
-            
+
             for subcategory in category.get('subcategories', []):
                 subcategory_name = subcategory['name']
-                keywords = subcategory.get('keywords', [])
-                common_questions = subcategory.get('common_questions', [])
-                
-                # 创建分类文档
-                content = f"商品分类：{category_name} - {subcategory_name}\n"
-                content += f"相关商品：{', '.join(keywords)}\n"
-                content += f"常见问题：{', '.join(common_questions)}"
-                
-                self.documents.append({
-                    'content': content,
+                document = {
+                    'id': make_doc_id(lang, 'category', f"{category_name}/{subcategory_name}"),
+                    'source': source,
+                    'content': None,
                     'type': 'category',
+                    'lang': lang,
                     'category': category_name,
                     'subcategory': subcategory_name,
-                    'keywords': keywords,
-                    'common_questions': common_questions
-                })
-    
-    def _build_vector_index(self):
-        """构建向量索引"""
-        if not self.documents:
+                    'keywords': subcategory.get('keywords', []),
+                    'common_questions': subcategory.get('common_questions', [])
+                }
+                # 创建分类文档内容
+                document['content'] = render_content(document)
+                documents.append(document)
+        return documents
+
+    def _build_vector_index(self, documents: List[Dict[str, Any]]):
+        """按语言分区构建检索索引（BM25倒排索引 + 向量索引）"""
+        if not documents:
             return
-        
-        # 如果没有embedding模型，使用简单的关键词匹配
+
+        embeddings = None
         if self.embedding_model is None:
-            print("使用简单关键词匹配模式")
+            print("使用BM25关键词检索模式")
+        else:
+            try:
+                # 提取文档内容
+                texts = [doc['content'] for doc in documents]
+                print(f"📝 处理 {len(texts)} 个文档...")
+
+                # 生成嵌入向量
+                print("🧠 生成文本向量...")
+                embeddings = self.encode_texts(texts)
+                print(f"✅ 向量化完成！生成 {embeddings.shape[0]} 个向量，维度: {embeddings.shape[1]}")
+            except Exception as e:
+                print(f"⚠️ 向量化失败: {e}")
+                print("将使用BM25关键词检索模式")
+                embeddings = None
+
+        with self._reload_lock:
+            self._swap(self._build_partitions(documents, embeddings))
+        print("🔍 使用 BM25 + 向量混合检索模式" if self.index.vectors is not None else "🔍 使用BM25检索模式")
+
+    def attach_vectors(self) -> bool:
+        """向量化模型在索引之后加载完成时，为当前全部文档生成向量并替换索引
+
+        向量化在锁外进行：先为当前文档的快照生成向量，再为向量化期间写入的文档补充生成，
+        最后在锁内只补齐剩余的少量文档并替换索引。期间检索继续使用BM25索引，写操作不被阻塞。
+        返回是否已启用向量检索。
+        """
+        if self.embedding_model is None:
+            return False
+        encoded: Dict[tuple, np.ndarray] = {}  # (文档ID, 内容) → 向量
+        snapshot_vectors, self._snapshot_vectors = self._snapshot_vectors, None
+        if snapshot_vectors is not None:
+            # 加载时模型尚未就绪而暂存的快照向量：内容未变的文档直接使用，不重新向量化
+            rows, hashes, matrix = snapshot_vectors
+            if matrix.shape[1] == self.encode_texts([""]).shape[1]:
+                with self._reload_lock:
+                    documents = self.documents
+                for doc in documents:
+                    row = rows.get(doc['id'])
+                    if row is not None and hashes[row] == hash(doc['content']):
+                        encoded[(doc['id'], doc['content'])] = matrix[row]
+                print(f"📦 使用快照中的 {len(encoded)} 个文档向量")
+        announced = False
+        for _ in range(3):
+            with self._reload_lock:
+                pending = [doc for doc in self.documents if (doc['id'], doc['content']) not in encoded]
+            if not pending:
+                break
+            if not announced:
+                announced = True
+                print(f"🧠 为 {len(pending)} 个文档生成文本向量...")
+            vectors = self.encode_texts([doc['content'] for doc in pending])
+            encoded.update(zip(((doc['id'], doc['content']) for doc in pending), vectors))
+
+        with self._reload_lock:
+            documents = self.documents
+            if documents:
+                missing = [doc for doc in documents if (doc['id'], doc['content']) not in encoded]
+                if missing:
+                    vectors = self.encode_texts([doc['content'] for doc in missing])
+                    encoded.update(zip(((doc['id'], doc['content']) for doc in missing), vectors))
+                embeddings = np.stack([encoded[(doc['id'], doc['content'])] for doc in documents])
+                self._swap(self._build_partitions(documents, embeddings, verbose=False))
+        print("🔍 使用 BM25 + 向量混合检索模式")
+        return True
+
+    def _build_partitions(self, documents: List[Dict[str, Any]], embeddings: Optional[np.ndarray],
+                          verbose: bool = True) -> Dict[str, SegmentedIndex]:
+        """按语言构建新的检索索引（不影响当前正在使用的索引）"""
+        source_lang = self.config.KNOWLEDGE_SOURCE_LANG
+        positions = {}
+        for i, doc in enumerate(documents):
+            positions.setdefault(doc.get('lang') or source_lang, []).append(i)
+
+        partitions = {}
+        for lang, ids in positions.items():
+            vectors = None
+            if embeddings is not None:
+                # 同一分区的文档通常是连续的：切片不复制，内存映射的向量保持映射
+                contiguous = ids[-1] - ids[0] + 1 == len(ids)
+                vectors = embeddings[ids[0]:ids[-1] + 1] if contiguous else embeddings[ids]
+            partitions[lang] = SegmentedIndex([documents[i] for i in ids], vectors)
+            if verbose:
+                print(f"🌐 {lang} 分区: {len(ids)} 个文档")
+        return partitions
+
+    def load_documents(self, documents: List[Dict[str, Any]], embeddings: Optional[np.ndarray] = None):
+        """用已有的文档和向量（例如内存映射的快照）构建索引，不读取知识库文件、不重新向量化"""
+        if embeddings is not None and len(embeddings) != len(documents):
+            embeddings = None
+        with self._reload_lock:
+            self._swap(self._build_partitions(documents, embeddings, verbose=False))
+
+    def _swap(self, partitions: Dict[str, SegmentedIndex]):
+        """整体替换检索索引；检索只读取一次 self.partitions，不会看到构建到一半的索引
+
+        调用方需持有 _reload_lock；正在进行的后台合并基于旧索引，结果会被丢弃。
+        """
+        self._compaction_logs = {}
+        self.partitions = partitions
+        self.index = partitions.get(self.config.KNOWLEDGE_SOURCE_LANG) or next(iter(partitions.values()), None)
+        self.version += 1
+
+    def _partition_for(self, lang: Optional[str]):
+        """选择语言分区，没有该语言的分区时使用源语言分区"""
+        partitions = self.partitions
+        return partitions.get(lang) or partitions.get(self.config.KNOWLEDGE_SOURCE_LANG)
+
+    def reload_knowledge_base(self) -> Dict[str, Any]:
+        """重新读取知识库文件，只对新增和修改的文档重新向量化
+
+        向量化在锁外进行（与 attach_vectors 相同）：先为合并后的文档生成向量，再为期间的写操作补充生成，
+        最后在锁内重新合并、只补齐剩余的少量文档并一次性替换索引（写时复制），期间的检索和单条写入不被阻塞。
+        不来自知识库文件的自定义知识和导入的快照会保留；通过接口修改或删除过的文档保持接口写入的结果，
+        不被文件中的版本恢复（只在进程内记录）。
+        """
+        start = time.perf_counter()
+        source_documents = self._read_source_documents(verbose=False)
+
+        encoded: Optional[Dict[tuple, np.ndarray]] = {}  # (文档ID, 内容) → 新生成的向量
+        if self.embedding_model is not None:
+            try:
+                for _ in range(3):
+                    with self._reload_lock:
+                        documents, added, updated, deleted, reusable = self._merge_source_documents(source_documents)
+                    if not added and not updated and not deleted:
+                        break
+                    pending = [doc for doc in documents
+                               if (doc['id'], doc['content']) not in reusable and (doc['id'], doc['content']) not in encoded]
+                    if not pending:
+                        break
+                    vectors = self.encode_texts([doc['content'] for doc in pending])
+                    encoded.update(zip(((doc['id'], doc['content']) for doc in pending), vectors))
+            except Exception as e:
+                print(f"⚠️ 向量化失败，新版本仅使用BM25检索: {e}")
+                encoded = None
+
+        with self._reload_lock:
+            documents, added, updated, deleted, reusable = self._merge_source_documents(source_documents)
+            if not added and not updated and not deleted:
+                self.last_reload = {"changed": False, "version": self.version,
+                                    "seconds": round(time.perf_counter() - start, 3)}
+                return self.last_reload
+
+            embeddings = None
+            if self.embedding_model is not None and encoded is not None and documents:
+                try:
+                    vectors = {**reusable, **encoded}
+                    missing = [doc for doc in documents if (doc['id'], doc['content']) not in vectors]
+                    if missing:
+                        vectors.update(zip(((doc['id'], doc['content']) for doc in missing),
+                                           self.encode_texts([doc['content'] for doc in missing])))
+                    embeddings = np.stack([vectors[(doc['id'], doc['content'])] for doc in documents]).astype(np.float32)
+                except Exception as e:
+                    print(f"⚠️ 向量化失败，新版本仅使用BM25检索: {e}")
+                    embeddings = None
+
+            self._swap(self._build_partitions(documents, embeddings, verbose=False))
+            self.last_reload = {
+                "changed": True,
+                "version": self.version,
+                "added": added,
+                "updated": updated,
+                "deleted": deleted,
+                "encoded": sum(1 for doc in documents if (doc['id'], doc['content']) not in reusable)
+                if embeddings is not None else 0,
+                "documents": len(documents),
+                "seconds": round(time.perf_counter() - start, 3)
+            }
+        print(f"🔄 知识库已重新加载: 新增 {added}，修改 {updated}，删除 {deleted}，"
+              f"耗时 {self.last_reload['seconds']}秒")
+        return self.last_reload
+
+    def _merge_source_documents(self, source_documents: List[Dict[str, Any]]) -> tuple:
+        """把重新读取的文件文档与当前文档合并（需持有 _reload_lock）
+
+        返回 (新文档列表, 新增数, 修改数, 删除数, 内容未变可直接复用的向量 {(文档ID, 内容): 向量})。
+        """
+        partitions = self.partitions
+        current_documents = self.documents
+        api_writes = self._api_writes
+        documents = [doc for doc in source_documents if doc['id'] not in api_writes]
+        # 保留不来自知识库文件的文档（自定义知识、批量导入的快照）和通过接口写入的文档
+        file_paths = {os.path.join(path, filename) for path, _ in self._source_dirs() for filename in KNOWLEDGE_FILES}
+        documents += [doc for doc in current_documents
+                      if doc.get('source') not in file_paths or doc['id'] in api_writes]
+
+        source_lang = self.config.KNOWLEDGE_SOURCE_LANG
+        current = {doc.get('id'): doc for doc in current_documents if doc.get('id')}
+        new_ids = {doc.get('id') for doc in documents}
+
+        added, updated = 0, 0
+        reusable = {}
+        for doc in documents:
+            old = current.get(doc.get('id'))
+            if old is None:
+                added += 1
+            elif old['content'] != doc['content']:
+                updated += 1
+            else:
+                index = partitions.get(old.get('lang') or source_lang)
+                vector = index.embedding(old['id']) if index is not None else None
+                if vector is not None:
+                    reusable[(doc['id'], doc['content'])] = vector
+        deleted = sum(1 for doc_id in current if doc_id not in new_ids)
+        return documents, added, updated, deleted, reusable
+
+    def _source_signature(self) -> tuple:
+        """知识库文件的修改时间和大小，用于检测文件变化"""
+        signature = []
+        for knowledge_path, lang in self._source_dirs():
+            for filename in KNOWLEDGE_FILES:
+                path = os.path.join(knowledge_path, filename)
+                if os.path.exists(path):
+                    stat = os.stat(path)
+                    signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def after_fork(self, threads: int = 1):
+        """在 fork 出的子进程中调用，重建不能跨进程使用的状态
+
+        文档存储、检索索引和模型权重保持与父进程共享（写时复制）。fork 时父进程的线程不会被复制：
+        锁可能停留在被持有的状态，后台合并不会完成；torch 的 OpenMP 线程池和 ONNX Runtime
+        会话的线程池在子进程中也不可用，因此限制 torch 线程数、重新创建 ONNX 会话。
+        """
+        self._reload_lock = threading.Lock()
+        self._compaction_logs = {}
+        self._watcher = None
+        self._watcher_stop = threading.Event()
+        if isinstance(self.embedding_model, OnnxEmbedder):
+            self.embedding_model = OnnxEmbedder(self.embedding_model.model_path, threads)
+        elif "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(max(threads, 1))
+
+    def start_watcher(self, interval: Optional[float] = None):
+        """启动后台线程轮询知识库文件，文件变化时自动重新加载"""
+        interval = self.config.KNOWLEDGE_RELOAD_INTERVAL if interval is None else interval
+        if interval <= 0 or self._watcher is not None:
             return
-        
-        try:
-            # 提取文档内容
-            texts = [doc['content'] for doc in self.documents]
-            print(f"📝 处理 {len(texts)} 个文档...")
-            
-            # 生成嵌入向量
-            print("🧠 生成文本向量...")
-            embeddings = self.embedding_model.encode(texts, convert_to_tensor=False)
-            self.document_embeddings = embeddings
-            print(f"✅ 向量化完成！生成 {embeddings.shape[0]} 个向量，维度: {embeddings.shape[1]}")
-            
-            # 暂时跳过FAISS索引，直接使用向量相似度计算
-            print("🔍 使用余弦相似度计算模式")
-        except Exception as e:
-            print(f"⚠️ 向量化失败: {e}")
-            print("将使用简单关键词匹配模式")
-    
-    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+
+        def watch():
+            signature = self._source_signature()
+            while not self._watcher_stop.wait(interval):
+                try:
+                    current = self._source_signature()
+                    if current != signature:
+                        signature = current
+                        self.reload_knowledge_base()
+                except Exception as e:
+                    print(f"⚠️ 知识库自动重新加载失败: {e}")
+
+        self._watcher_stop.clear()
+        self._watcher = threading.Thread(target=watch, name="knowledge-watcher", daemon=True)
+        self._watcher.start()
+        print(f"👀 已启动知识库文件监控，间隔 {interval} 秒")
+
+    def stop_watcher(self):
+        if self._watcher is not None:
+            self._watcher_stop.set()
+            self._watcher = None
+
+    def encode_texts(self, texts: List[str]) -> Optional[np.ndarray]:
+        """批量生成L2归一化的float32向量，没有向量化模型时返回None"""
+        if self.embedding_model is None or not texts:
+            return None
+        embeddings = self.embedding_model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def _get_reranker(self):
+        """按配置创建重排器（交叉编码器首次使用时加载）"""
+        if self.reranker is None:
+            mode = self.config.RETRIEVAL_RERANKER
+            if mode == "cross_encoder" and SENTENCE_TRANSFORMERS_AVAILABLE:
+                try:
+                    self.reranker = CrossEncoderReranker(self.config.RERANKER_MODEL)
+                except Exception as e:
+                    print(f"⚠️ 重排模型加载失败，使用向量重排: {e}")
+                    self.reranker = EmbeddingReranker()
+            elif mode != "none":
+                self.reranker = EmbeddingReranker()
+        return self.reranker
+
+    def hybrid_search(self, query: str, top_k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                      lang: Optional[str] = None, query_embedding: Optional[np.ndarray] = None):
+        """混合检索，返回 (结果列表, 各阶段耗时毫秒)
+
+        结果是文档存储上的只读视图（SearchHit），字段按需解码，similarity_score 为分数；
+        需要修改或序列化时用 dict(result) 转为普通字典。
+
+        filters 按文档元数据过滤，例如 {"type": "faq", "category": ["物流配送", "退款售后"]}；
+        lang 选择语言分区，没有该语言的分区时检索源语言分区。
+        query_embedding 为调用方已经批量生成的查询向量，传入时不再单独向量化。
+        """
+        index = self._partition_for(lang)
+        if index is None or len(index) == 0:
+            return [], {}
+
+        start = time.perf_counter()
+        timings = {}
+        if index.vectors is not None and query_embedding is None:
+            try:
+                query_embedding = self.encode_texts([query])[0]
+            except Exception as e:
+                print(f"查询向量化失败，仅使用BM25检索: {e}")
+            timings["encode"] = round((time.perf_counter() - start) * 1000, 3)
+
+        results, stage_timings = index.search(query, query_embedding, top_k, self._get_reranker(), filters)
+        timings.update(stage_timings)
+        timings["total"] = round((time.perf_counter() - start) * 1000, 3)
+        self._record_timings(timings)
+        return results, timings
+
+    def search_batch(self, queries: List[str], top_k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                     lang: Optional[str] = None):
+        """多个查询一起检索，返回 (每个查询的结果列表, 整批各阶段耗时毫秒)
+
+        全部查询一次向量化，向量候选由一次矩阵乘法（或FAISS批量检索）得到，
+        结果与逐个调用 hybrid_search 相同。filters 和 lang 对所有查询生效。
+        """
+        index = self._partition_for(lang)
+        if index is None or len(index) == 0 or not queries:
+            return [[] for _ in queries], {}
+
+        start = time.perf_counter()
+        timings = {}
+        query_embeddings = None
+        if index.vectors is not None:
+            try:
+                query_embeddings = self.encode_texts(queries)
+            except Exception as e:
+                print(f"查询向量化失败，仅使用BM25检索: {e}")
+            timings["encode"] = round((time.perf_counter() - start) * 1000, 3)
+
+        results, stage_timings = index.search_batch(queries, query_embeddings, top_k, self._get_reranker(), filters)
+        timings.update(stage_timings)
+        timings["total"] = round((time.perf_counter() - start) * 1000, 3)
+        self._record_timings(timings, len(queries))
+        return results, timings
+
+    def _record_timings(self, timings: Dict[str, float], searches: int = 1):
+        self.retrieval_stats["searches"] += searches
+        totals = self.retrieval_stats["total_ms"]
+        for stage, value in timings.items():
+            totals[stage] = totals.get(stage, 0.0) + value
+
+    def get_retrieval_stats(self) -> Dict[str, Any]:
+        """各检索阶段的平均耗时"""
+        count = self.retrieval_stats["searches"] or 1
+        return {
+            "searches": self.retrieval_stats["searches"],
+            "reranker": self.reranker.name if self.reranker is not None else self.config.RETRIEVAL_RERANKER,
+            "min_score": self.reranker.min_score if self.reranker is not None else None,
+            "avg_ms": {stage: round(total / count, 3) for stage, total in self.retrieval_stats["total_ms"].items()}
+        }
+
+    def search(self, query: str, top_k: int = 5, filters: Optional[Dict[str, Any]] = None,
+               lang: Optional[str] = None) -> List[Dict[str, Any]]:
         """搜索相关知识"""
-        if not self.documents:
-            return []
-        
-        # 如果没有向量索引，使用关键词匹配
-        if self.index is None or self.embedding_model is None:
-            return self._keyword_search(query, top_k)
-        
-        try:
-            # 生成查询向量
-            query_embedding = self.embedding_model.encode([query], convert_to_tensor=False)
-            
-            # 计算余弦相似度
-            results = []
-            for i, doc in enumerate(self.documents):
-                if self.document_embeddings is not None and i < len(self.document_embeddings):
-                    doc_embedding = self.document_embeddings[i]
-                    # 计算余弦相似度
-                    similarity = np.dot(query_embedding[0], doc_embedding) / (
-                        np.linalg.norm(query_embedding[0]) * np.linalg.norm(doc_embedding)
-                    )
-                    result = doc.copy()
-                    result['similarity_score'] = float(similarity)
-                    results.append(result)
-            
-            # 按相似度排序并返回top_k
-            results.sort(key=lambda x: x['similarity_score'], reverse=True)
-            return results[:top_k]
-        except Exception as e:
-            print(f"向量搜索失败，使用关键词匹配: {e}")
-            return self._keyword_search(query, top_k)
-    
-    def _keyword_search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """简单的关键词搜索"""
-        query_lower = query.lower()
-        results = []
-        
-        for doc in self.documents:
-            content_lower = doc['content'].lower()
-            score = 0
-            
-            # 计算关键词匹配度
-            for word in query_lower.split():
-                if word in content_lower:
-                    score += 1
-            
-            if score > 0:
-                result = doc.copy()
-                result['similarity_score'] = score / len(query.split())
-                results.append(result)
-        
-        # 按分数排序并返回top_k
-        results.sort(key=lambda x: x['similarity_score'], reverse=True)
-        return results[:top_k]
-    
+        results, _ = self.hybrid_search(query, top_k, filters, lang)
+        return results
+
+    def get_metadata_values(self, lang: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """可用于过滤的元数据字段取值及文档数"""
+        index = self._partition_for(lang)
+        if index is None:
+            return {}
+        return {field: index.metadata_values(field) for field in index.base.metadata.postings}
+
+    def get_partition_stats(self) -> Dict[str, int]:
+        """各语言分区的文档数"""
+        return {lang: len(index) for lang, index in self.partitions.items()}
+
+    def get_segment_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各语言分区的基础段、增量段和墓碑统计"""
+        return {
+            lang: {
+                "base": len(index.base.documents),
+                "delta": len(index.delta_documents),
+                "tombstones": index.base.deleted,
+                "tombstone_ratio": round(index.tombstone_ratio(), 4),
+                "vector_storage": index.base.vectors.storage if index.base.vectors is not None else None,
+                "vector_bytes": index.base.vectors.memory_bytes if index.base.vectors is not None else 0,
+                "document_bytes": index.base.documents.memory_bytes,
+                "compacting": lang in self._compaction_logs
+            }
+            for lang, index in self.partitions.items()
+        }
+
+    def memory_bytes(self) -> int:
+        """全部分区的文档存储、倒排表和常驻向量占用的字节数（内存映射的向量不计入）"""
+        return sum(index.memory_bytes for index in self.partitions.values())
+
+    def get_status(self) -> Dict[str, Any]:
+        """索引版本、各分区文档数和最近一次重新加载的结果"""
+        partitions = self.get_partition_stats()
+        return {
+            "version": self.version,
+            "documents": sum(partitions.values()),
+            "partitions": partitions,
+            "segments": self.get_segment_stats(),
+            "compaction": dict(self.compaction_stats),
+            "watching": self._watcher is not None,
+            "last_reload": self.last_reload
+        }
+
+    def get_context_entries(self, query: str, top_k: int = 3, lang: Optional[str] = None) -> List[str]:
+        """获取查询相关的上下文条目（按相关度排序，优先使用同语言分区）"""
+        return self.format_context_entries(self.search(query, top_k=top_k, lang=lang))
+
+    def get_context_entries_batch(self, queries: List[str], top_k: int = 3,
+                                  lang: Optional[str] = None) -> List[List[str]]:
+        """批量获取上下文条目（search_batch 一起检索）"""
+        results, _ = self.search_batch(queries, top_k=top_k, lang=lang)
+        return [self.format_context_entries(hits) for hits in results]
+
+    def format_context_entries(self, results) -> List[str]:
+        """把检索结果转为提示词中的上下文条目"""
+        entries = []
+        for result in results:
+            if result['type'] == 'faq':
+                entries.append(f"FAQ - {result['question']}: {result['answer']}")
+            else:
+                labels = self._labels(result.get('lang', self.config.KNOWLEDGE_SOURCE_LANG))
+                entries.append(f"{labels['category_context']}: {result['content']}")
+        return entries
+
     def get_context_for_query(self, query: str, max_context_length: int = 1000) -> str:
         """获取查询相关的上下文信息"""
-        search_results = self.search(query, top_k=3)
-        
         context_parts = []
         current_length = 0
-        
-        for result in search_results:
-            if result['type'] == 'faq':
-                context_part = f"FAQ - {result['question']}: {result['answer']}"
-            else:
-                context_part = f"商品分类信息: {result['content']}"
-            
+
+        for context_part in self.get_context_entries(query, top_k=3):
             if current_length + len(context_part) <= max_context_length:
                 context_parts.append(context_part)
                 current_length += len(context_part)
             else:
                 break
-        
+
         return "\n\n".join(context_parts)
-    
-    def add_custom_knowledge(self, content: str, knowledge_type: str = "custom", **kwargs):
-        """添加自定义知识"""
-        document = {
+
+    def make_custom_document(self, content: str, knowledge_type: str = "custom", **kwargs) -> Dict[str, Any]:
+        """构建自定义知识文档（不写入索引）"""
+        return {
+            'id': make_doc_id(self.config.KNOWLEDGE_SOURCE_LANG, knowledge_type, str(kwargs.get('question') or content)),
             'content': content,
             'type': knowledge_type,
+            'lang': self.config.KNOWLEDGE_SOURCE_LANG,
             **kwargs
         }
-        
-        self.documents.append(document)
-        
-        # 重新构建索引
-        self._build_vector_index()
-    
-    def download_external_knowledge(self):
-        """下载外部知识库"""
-        for url in self.config.TAOBAO_KNOWLEDGE_URLS:
+
+    def add_custom_knowledge(self, content: str, knowledge_type: str = "custom", **kwargs) -> str:
+        """添加自定义知识，返回文档ID（已存在相同ID时覆盖）"""
+        document = self.make_custom_document(content, knowledge_type, **kwargs)
+        self.upsert_documents([document])
+        return document['id']
+
+    def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """按ID获取文档"""
+        for index in self.partitions.values():
+            document = index.get(doc_id)
+            if document is not None:
+                return document
+        return None
+
+    def merge_document(self, doc_id: str, content: Optional[str] = None, **fields) -> Optional[Dict[str, Any]]:
+        """构建修改后的文档（不写入索引），文档不存在时返回None"""
+        document = self.get_document(doc_id)
+        if document is None:
+            return None
+        document = {**document, **fields, 'id': doc_id}
+        if content is not None:
+            document['content'] = content
+        return document
+
+    def update_document(self, doc_id: str, content: Optional[str] = None, **fields) -> Optional[Dict[str, Any]]:
+        """修改文档内容或元数据，文档不存在时返回None"""
+        document = self.merge_document(doc_id, content, **fields)
+        if document is not None:
+            self.upsert_documents([document])
+        return document
+
+    def upsert_documents(self, documents: List[Dict[str, Any]]):
+        """新增或替换文档：只向量化这些文档并写入所在分区的增量段"""
+        if not documents:
+            return
+        embeddings = None
+        if self.embedding_model is not None:
             try:
-                response = requests.get(url, timeout=10)
-                if response.status_code == 200:
-                    data = response.json()
-                    # 根据数据结构处理
-                    if 'faqs' in data:
-                        self._process_faq_data(data)
-                    elif 'categories' in data:
-                        self._process_category_data(data)
+                embeddings = self.encode_texts([doc['content'] for doc in documents])
             except Exception as e:
-                print(f"下载知识库失败 {url}: {e}")
-    
+                print(f"⚠️ 向量化失败，新文档仅参与BM25检索: {e}")
+
+        source_lang = self.config.KNOWLEDGE_SOURCE_LANG
+        with self._reload_lock:
+            partitions = self.partitions
+            for i, document in enumerate(documents):
+                lang = document.get('lang') or source_lang
+                # 文档语言变化时从原分区删除
+                for other, index in partitions.items():
+                    if other != lang and index.get(document['id']) is not None:
+                        self._apply_write(other, index, ('delete', document['id']))
+                index = partitions.get(lang)
+                if index is None:
+                    # 新语言：写时复制新增分区
+                    index = SegmentedIndex([])
+                    partitions = {**partitions, lang: index}
+                    self.partitions = partitions
+                    if lang == source_lang:
+                        self.index = index
+                vector = embeddings[i] if embeddings is not None else None
+                self._apply_write(lang, index, ('upsert', document, vector))
+                self._api_writes[document['id']] = 'upsert'
+            self.version += 1
+
+    def delete_document(self, doc_id: str) -> bool:
+        """删除文档（设置墓碑，检索立即生效），返回文档是否存在"""
+        with self._reload_lock:
+            for lang, index in self.partitions.items():
+                if index.get(doc_id) is not None:
+                    self._apply_write(lang, index, ('delete', doc_id))
+                    self._api_writes[doc_id] = 'delete'
+                    self.version += 1
+                    return True
+        return False
+
+    def _apply_write(self, lang: str, index: SegmentedIndex, operation: tuple):
+        """执行单条写操作（需持有 _reload_lock），必要时启动后台合并"""
+        if operation[0] == 'upsert':
+            index.upsert(operation[1], operation[2])
+        else:
+            index.delete(operation[1])
+
+        log = self._compaction_logs.get(lang)
+        if log is not None:
+            log.append(operation)
+        elif index.needs_compaction():
+            self._compaction_logs[lang] = []
+            threading.Thread(target=self._compact, args=(lang, index, index.snapshot()),
+                             name=f"knowledge-compaction-{lang}", daemon=True).start()
+
+    def _compact(self, lang: str, index: SegmentedIndex, snapshot: tuple):
+        """后台合并：在锁外用快照重建基础段，再在锁内重放合并期间的写操作并替换分区"""
+        start = time.perf_counter()
+        try:
+            compacted = SegmentedIndex.from_snapshot(snapshot)
+        except Exception as e:
+            print(f"⚠️ 知识库索引合并失败: {e}")
+            with self._reload_lock:
+                if self.partitions.get(lang) is index:
+                    self._compaction_logs.pop(lang, None)
+            return
+
+        with self._reload_lock:
+            log = self._compaction_logs.pop(lang, None)
+            if log is None or self.partitions.get(lang) is not index:
+                # 合并期间知识库被整体重新加载，丢弃结果
+                return
+            for operation in log:
+                if operation[0] == 'upsert':
+                    compacted.upsert(operation[1], operation[2])
+                else:
+                    compacted.delete(operation[1])
+            self.partitions = {**self.partitions, lang: compacted}
+            if lang == self.config.KNOWLEDGE_SOURCE_LANG:
+                self.index = compacted
+            self.version += 1
+            self.compaction_stats["compactions"] += 1
+            self.compaction_stats["last_compaction_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        print(f"🧹 {lang} 分区索引已合并: {len(compacted)} 个文档，"
+              f"耗时 {self.compaction_stats['last_compaction_ms']}毫秒")
+
+    def download_external_knowledge(self, sources: Optional[Sequence[str]] = None,
+                                    output_path: Optional[str] = None) -> Dict[str, Any]:
+        """下载外部知识库：并发流式导入为快照，再合并进当前索引（同步调用，不能在事件循环中使用）"""
+        ingestor = KnowledgeIngestor(self)
+        result = asyncio.run(ingestor.ingest(sources or self.config.TAOBAO_KNOWLEDGE_URLS, output_path))
+        if result["documents"]:
+            result.update(self.load_snapshot(result["path"]))
+        return result
+
+    def load_snapshot(self, path: Optional[str] = None) -> Dict[str, Any]:
+        """把快照中的文档和向量合并进知识库（同ID覆盖，不重新向量化），整体重建分区索引"""
+        snapshot = read_snapshot(path or self.snapshot_path)
+        snapshot_documents, snapshot_embeddings = snapshot["documents"], snapshot["embeddings"]
+        # 多个来源中重复的文档保留最后一次出现的版本
+        positions = {doc['id']: i for i, doc in enumerate(snapshot_documents)}
+        if len(positions) < len(snapshot_documents):
+            unique = sorted(positions.values())
+            snapshot_documents = [snapshot_documents[i] for i in unique]
+            if snapshot_embeddings is not None:
+                snapshot_embeddings = snapshot_embeddings[unique]
+
+        with self._reload_lock:
+            current = self.documents
+            current_embeddings = self.document_embeddings
+            snapshot_ids = {doc['id'] for doc in snapshot_documents}
+            keep = [i for i, doc in enumerate(current) if doc['id'] not in snapshot_ids]
+            documents = [current[i] for i in keep] + snapshot_documents
+
+            embeddings = None
+            if snapshot_embeddings is not None and self.embedding_model is not None:
+                if not current:
+                    embeddings = np.asarray(snapshot_embeddings, dtype=np.float32)
+                elif len(current_embeddings) == len(current) and \
+                        current_embeddings.shape[1] == snapshot_embeddings.shape[1]:
+                    embeddings = np.vstack([current_embeddings[keep], snapshot_embeddings]).astype(np.float32)
+            if embeddings is None and self.embedding_model is not None:
+                print("⚠️ 快照向量与当前索引不一致，合并后仅使用BM25检索")
+            elif snapshot_embeddings is not None and self.embedding_model is None:
+                # 后台加载时模型晚于索引就绪：暂存（内存映射的）快照向量，attach_vectors 时直接使用
+                self._snapshot_vectors = (
+                    {doc['id']: i for i, doc in enumerate(snapshot_documents)},
+                    np.fromiter((hash(doc['content']) for doc in snapshot_documents), dtype=np.int64,
+                                count=len(snapshot_documents)),
+                    snapshot_embeddings
+                )
+
+            self._swap(self._build_partitions(documents, embeddings, verbose=False))
+        return {"snapshot_documents": len(snapshot_documents), "documents": len(documents),
+                "version": self.version}
+
     def save_knowledge_base(self, filepath: str):
-        """保存知识库到文件"""
+        """保存知识库到文件（向量保存为float32数值列表）"""
+        with self._reload_lock:
+            documents = self.documents
+            embeddings = self.document_embeddings
         data = {
-            'documents': self.documents,
-            'embeddings': self.document_embeddings if self.document_embeddings is not None else None
+            'documents': [dict(doc) for doc in documents],
+            'embeddings': np.asarray(embeddings, dtype=np.float32).tolist() if len(embeddings) else None
         }
         
         with open(filepath, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
     
     def load_knowledge_base_from_file(self, filepath: str):
-        """从文件加载知识库"""
+        """从文件加载知识库（向量与文档数一致时直接使用，否则重新向量化）"""
         if os.path.exists(filepath):
             with open(filepath, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 
-            self.documents = data.get('documents', [])
+            documents = data.get('documents', [])
             embeddings_data = data.get('embeddings')
             
-            if embeddings_data:
-                self.document_embeddings = np.array(embeddings_data)
-                self._build_vector_index() 
\ No newline at end of file
+            if embeddings_data and len(embeddings_data) == len(documents) and self.embedding_model is not None:
+                embeddings = np.asarray(embeddings_data, dtype=np.float32)
+                del data, embeddings_data
+                with self._reload_lock:
+                    self._swap(self._build_partitions(documents, embeddings))
+            else:
+                self._build_vector_index(documents)
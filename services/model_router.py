@@ -0,0 +1,271 @@
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import openai
+
+from config import Config
+
+
+# 路由支持的请求类型，每种类型对应一个独立的端点池
+REQUEST_TYPES = ("text", "vision", "classification")
+
+
+class ModelEndpoint:
+    """单个OpenAI兼容后端端点，记录延迟与错误率统计"""
+
+    def __init__(self, name: str, base_url: str, api_key: str, models: Dict[str, str],
+                 weight: float = 1.0, alpha: float = 0.3):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.models = {k: v for k, v in models.items() if v}
+        self.weight = max(float(weight), 0.01)
+        self.alpha = alpha
+
+        # 统计信息
+        self.ewma_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.inflight = 0
+        self.total_requests = 0
+        self.total_errors = 0
+        self.last_error: Optional[str] = None
+        self.unhealthy_until = 0.0
+
+        self._lock = threading.Lock()
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self) -> openai.OpenAI:
+        """同步客户端（首次使用时创建并复用）"""
+        if self._client is None:
+            self._client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        return self._client
+
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        """异步客户端（首次使用时创建并复用连接池）"""
+        if self._async_client is None:
+            self._async_client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        return self._async_client
+
+    def is_healthy(self, now: Optional[float] = None) -> bool:
+        """端点是否处于健康状态（冷却期内视为不健康）"""
+        return (now or time.time()) >= self.unhealthy_until
+
+    def cost(self, default_latency: float) -> float:
+        """选择代价：EWMA延迟 × (在途请求数+1) × 错误惩罚 / 权重"""
+        latency = self.ewma_latency if self.ewma_latency is not None else default_latency
+        return latency * (self.inflight + 1) * (1.0 + 4.0 * self.error_rate) / self.weight
+
+    def begin(self):
+        with self._lock:
+            self.inflight += 1
+            self.total_requests += 1
+
+    def record_success(self, latency: float):
+        """记录一次成功请求"""
+        with self._lock:
+            self.inflight -= 1
+            if self.ewma_latency is None:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency = self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+            self.error_rate = (1 - self.alpha) * self.error_rate
+
+    def record_failure(self, latency: float, error: Exception, error_threshold: float, cooldown: float):
+        """记录一次失败请求，错误率超过阈值时进入冷却期"""
+        with self._lock:
+            self.inflight -= 1
+            self.total_errors += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+            self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+            if self.ewma_latency is not None:
+                self.ewma_latency = self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+            if self.error_rate >= error_threshold:
+                self.unhealthy_until = time.time() + cooldown
+
+    def release(self):
+        """请求未计入成功或失败时释放在途计数"""
+        with self._lock:
+            self.inflight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "models": dict(self.models),
+            "weight": self.weight,
+            "healthy": self.is_healthy(),
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 2) if self.ewma_latency is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "inflight": self.inflight,
+            "total_requests": self.total_requests,
+            "total_errors": self.total_errors,
+            "last_error": self.last_error,
+        }
+
+
+class ModelRouter:
+    """多端点模型路由器
+
+    按请求类型（text / vision / classification）划分端点池，
+    使用 power-of-two-choices 在池内选择EWMA延迟和错误率更低的端点。
+    """
+
+    def __init__(self, endpoints: List[ModelEndpoint], error_threshold: float = 0.5,
+                 cooldown: float = 30.0, default_latency: float = 1.0, max_attempts: int = 2):
+        if not endpoints:
+            raise ValueError("至少需要配置一个模型端点")
+        self.endpoints = endpoints
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.default_latency = default_latency
+        self.max_attempts = max(1, max_attempts)
+        self.pools: Dict[str, List[ModelEndpoint]] = {
+            request_type: [ep for ep in endpoints if request_type in ep.models]
+            for request_type in REQUEST_TYPES
+        }
+
+    @classmethod
+    def from_config(cls, config: Config) -> "ModelRouter":
+        """根据配置创建路由器，未配置 MODEL_ENDPOINTS 时退化为单端点"""
+        alpha = config.ROUTER_EWMA_ALPHA
+        endpoints = []
+
+        if config.MODEL_ENDPOINTS:
+            for i, item in enumerate(json.loads(config.MODEL_ENDPOINTS)):
+                endpoints.append(ModelEndpoint(
+                    name=item.get("name", f"endpoint-{i}"),
+                    base_url=item["base_url"],
+                    api_key=item.get("api_key", config.AIQIANJI_API_KEY),
+                    models=item.get("models", {}),
+                    weight=item.get("weight", 1.0),
+                    alpha=alpha
+                ))
+        else:
+            endpoints.append(ModelEndpoint(
+                name="default",
+                base_url=config.AIQIANJI_BASE_URL,
+                api_key=config.AIQIANJI_API_KEY,
+                models={
+                    "text": config.TEXT_MODEL,
+                    "vision": config.VISION_MODEL,
+                    "classification": config.CLASSIFICATION_MODEL or config.TEXT_MODEL,
+                },
+                alpha=alpha
+            ))
+
+        return cls(
+            endpoints,
+            error_threshold=config.ROUTER_ERROR_THRESHOLD,
+            cooldown=config.ROUTER_COOLDOWN,
+            max_attempts=config.ROUTER_MAX_ATTEMPTS
+        )
+
+    def pick(self, request_type: str, exclude: Optional[List[ModelEndpoint]] = None) -> ModelEndpoint:
+        """power-of-two-choices：随机取两个候选，选代价较低者
+
+        只有分类请求在没有专用端点时使用文本端点；图片请求不能发给纯文本模型，没有视觉端点时直接报错。
+        """
+        pool = self.pools.get(request_type)
+        if not pool and request_type == "classification":
+            pool = self.pools["text"]
+        if not pool:
+            raise ValueError(f"没有可用于 {request_type} 请求的模型端点（MODEL_ENDPOINTS 中未配置 {request_type} 模型）")
+
+        now = time.time()
+        remaining = [ep for ep in pool if not exclude or ep not in exclude] or pool
+        candidates = [ep for ep in remaining if ep.is_healthy(now)] or remaining
+        if len(candidates) == 1:
+            return candidates[0]
+
+        first, second = random.choices(candidates, weights=[ep.weight for ep in candidates], k=2)
+        if first.cost(self.default_latency) <= second.cost(self.default_latency):
+            return first
+        return second
+
+    def model_for(self, endpoint: ModelEndpoint, request_type: str) -> str:
+        return endpoint.models.get(request_type) or endpoint.models.get("text", "")
+
+    @staticmethod
+    def _is_endpoint_failure(error: Exception) -> bool:
+        """只有连接、超时、限流和服务端错误才计入端点错误率"""
+        if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code >= 500
+        return False
+
+    def _finish(self, endpoint: ModelEndpoint, start: float, error: Optional[Exception]) -> bool:
+        """记录请求结果，返回该错误是否应切换到其他端点重试"""
+        latency = time.perf_counter() - start
+        if error is None:
+            endpoint.record_success(latency)
+            return False
+        if self._is_endpoint_failure(error):
+            endpoint.record_failure(latency, error, self.error_threshold, self.cooldown)
+            return True
+        endpoint.release()
+        return False
+
+    def chat_completion(self, request_type: str, **kwargs):
+        """同步调用 chat.completions.create，模型名由所选端点决定，端点故障时切换到其他端点"""
+        tried: List[ModelEndpoint] = []
+        while True:
+            endpoint = self.pick(request_type, exclude=tried)
+            tried.append(endpoint)
+            endpoint.begin()
+            start = time.perf_counter()
+            try:
+                response = endpoint.client.chat.completions.create(
+                    model=self.model_for(endpoint, request_type), **kwargs
+                )
+            except Exception as e:
+                if not self._finish(endpoint, start, e) or len(tried) >= self.max_attempts:
+                    raise
+                continue
+            self._finish(endpoint, start, None)
+            return response
+
+    async def achat_completion(self, request_type: str, **kwargs):
+        """异步调用 chat.completions.create，模型名由所选端点决定，端点故障时切换到其他端点"""
+        tried: List[ModelEndpoint] = []
+        while True:
+            endpoint = self.pick(request_type, exclude=tried)
+            tried.append(endpoint)
+            endpoint.begin()
+            start = time.perf_counter()
+            try:
+                response = await endpoint.async_client.chat.completions.create(
+                    model=self.model_for(endpoint, request_type), **kwargs
+                )
+            except Exception as e:
+                if not self._finish(endpoint, start, e) or len(tried) >= self.max_attempts:
+                    raise
+                continue
+            self._finish(endpoint, start, None)
+            return response
+
+    def status(self) -> Dict[str, Any]:
+        """各端点健康状态和各池内的有效权重（按代价倒数归一化）"""
+        pools = {}
+        for request_type, pool in self.pools.items():
+            now = time.time()
+            inverse_costs = {
+                ep.name: (1.0 / ep.cost(self.default_latency)) if ep.is_healthy(now) else 0.0
+                for ep in pool
+            }
+            total = sum(inverse_costs.values()) or 1.0
+            pools[request_type] = [
+                {"name": name, "effective_weight": round(value / total, 4)}
+                for name, value in inverse_costs.items()
+            ]
+
+        return {
+            "endpoints": [ep.stats() for ep in self.endpoints],
+            "pools": pools
+        }
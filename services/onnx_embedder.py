@@ -0,0 +1,81 @@
+import importlib.util
+import os
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+
+from config import Config
+
+# onnxruntime和tokenizers在创建模型时才导入；未安装时只能使用PyTorch后端
+ONNX_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ("onnxruntime", "tokenizers"))
+
+ONNX_MODEL_FILE = "model.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+
+
+class OnnxEmbedder:
+    """ONNX Runtime 推理的句向量模型，encode 接口与 SentenceTransformer 兼容
+
+    模型目录由 export_onnx_model.py 生成：int8 动态量化的 model.onnx + tokenizer.json。
+    模型输出 token 向量，按 attention mask 做平均池化，与 paraphrase-multilingual-MiniLM-L12-v2
+    的池化方式一致。不依赖 PyTorch。
+    """
+
+    def __init__(self, model_path: Optional[str] = None, threads: Optional[int] = None, max_length: int = 128):
+        if not ONNX_AVAILABLE:
+            raise ImportError("onnxruntime 或 tokenizers 未安装")
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_path = model_path or Config.ONNX_MODEL_PATH
+        threads = Config.ONNX_THREADS if threads is None else threads
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            os.path.join(self.model_path, ONNX_MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {item.name for item in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.model_path, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length)
+        if self.tokenizer.padding is None:
+            pad_token = "<pad>" if self.tokenizer.token_to_id("<pad>") is not None else "[PAD]"
+            self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token) or 0, pad_token=pad_token)
+        self.model_name = os.path.basename(os.path.normpath(self.model_path))
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        token_embeddings = self.session.run(None, feeds)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        return (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences: Union[str, Sequence[str]], batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        # 按长度排序后分批，减少padding
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            ids = order[start:start + batch_size]
+            batch = self._encode_batch([texts[i] for i in ids])
+            if embeddings.shape[1] == 0:
+                embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            embeddings[ids] = batch
+
+        if normalize_embeddings:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings[0] if single else embeddings
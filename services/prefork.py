@@ -0,0 +1,230 @@
+import gc
+import os
+import signal
+import socket
+import time
+from typing import Callable, Dict, Optional
+
+from config import Config
+
+# smaps_rollup 中统计的字段（kB）
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+# 启动后这么多秒内退出的工作进程视为启动失败，不再重启
+WORKER_MIN_UPTIME = 5.0
+
+
+def read_smaps_rollup(pid: int) -> Optional[Dict[str, int]]:
+    """读取进程的内存统计（kB），不支持 /proc/<pid>/smaps_rollup 的系统返回None"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    stats = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) >= 2 and parts[0].rstrip(":") in SMAPS_FIELDS:
+            stats[parts[0].rstrip(":")] = int(parts[1])
+    return stats
+
+
+def memory_report(pids: Dict[str, int]) -> Optional[Dict[str, object]]:
+    """各进程的 RSS / PSS / 共享 / 私有内存（MB）
+
+    RSS 把共享页重复计入每个进程；PSS 把共享页按共享进程数平摊，各进程 PSS 之和才是实际占用。
+    """
+    processes = {}
+    for name, pid in pids.items():
+        stats = read_smaps_rollup(pid)
+        if stats is None:
+            continue
+        processes[name] = {
+            "pid": pid,
+            "rss_mb": round(stats.get("Rss", 0) / 1024, 1),
+            "pss_mb": round(stats.get("Pss", 0) / 1024, 1),
+            "shared_mb": round((stats.get("Shared_Clean", 0) + stats.get("Shared_Dirty", 0)) / 1024, 1),
+            "private_mb": round((stats.get("Private_Clean", 0) + stats.get("Private_Dirty", 0)) / 1024, 1),
+        }
+    if not processes:
+        return None
+    total_rss = sum(item["rss_mb"] for item in processes.values())
+    total_pss = sum(item["pss_mb"] for item in processes.values())
+    return {
+        "processes": processes,
+        "total_rss_mb": round(total_rss, 1),
+        "total_pss_mb": round(total_pss, 1),
+        "saved_mb": round(total_rss - total_pss, 1),
+    }
+
+
+def print_memory_report(report: Optional[Dict[str, object]]):
+    if report is None:
+        print("⚠️ 无法读取 /proc/<pid>/smaps_rollup，跳过内存共享统计")
+        return
+    print(f"📊 内存统计（MB）: {'进程':<10}{'RSS':>10}{'PSS':>10}{'共享':>10}{'私有':>10}")
+    for name, item in report["processes"].items():
+        print(f"   {name:<12}{item['rss_mb']:>10}{item['pss_mb']:>10}{item['shared_mb']:>10}{item['private_mb']:>10}")
+    print(f"   RSS合计 {report['total_rss_mb']}MB，实际占用（PSS合计）{report['total_pss_mb']}MB，"
+          f"共享节省 {report['saved_mb']}MB")
+
+
+class PreforkServer:
+    """预先 fork 的多进程 uvicorn 服务
+
+    主进程先加载模型和索引，gc.freeze() 后绑定监听端口，再 fork 出 N 个工作进程共用同一个socket。
+    模型权重、向量矩阵和文档存储在 fork 后以写时复制的方式共享，只有各进程实际写过的页才会复制。
+    主进程不处理请求，只负责重启异常退出的工作进程、转发退出信号和输出内存共享统计。
+
+    知识库更新也由主进程统一处理：每隔 reload_interval 秒调用 reload(False)（检查知识库文件），
+    收到 SIGHUP 时调用 reload(True)；reload 返回 True（索引已更新）时逐个重新 fork 工作进程，
+    新进程继承主进程的新索引，旧进程处理完正在进行的请求后退出。
+    """
+
+    def __init__(self, app, host: str, port: int, workers: int, after_fork: Optional[Callable[[], None]] = None,
+                 log_level: str = "info", report_interval: Optional[float] = None,
+                 reload: Optional[Callable[[bool], bool]] = None, reload_interval: Optional[float] = None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.after_fork = after_fork
+        self.log_level = log_level
+        self.report_interval = Config.WORKER_MEMORY_REPORT_INTERVAL if report_interval is None else report_interval
+        self.reload = reload
+        self.reload_interval = Config.KNOWLEDGE_RELOAD_INTERVAL if reload_interval is None else reload_interval
+        self.sock: Optional[socket.socket] = None
+        self.children: Dict[int, tuple] = {}  # pid -> (工作进程编号, 启动时间)
+        self.retiring: set = set()  # 已被新进程替换、正在退出的工作进程
+        self.reload_requested = False
+        self.stopping = False
+
+    def _bind(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def _spawn(self, slot: int):
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(slot)
+        self.children[pid] = (slot, time.time())
+
+    def _run_worker(self, slot: int):
+        """工作进程：重建进程内状态后在共享socket上运行uvicorn，结束后直接退出"""
+        import uvicorn
+
+        code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            if self.after_fork is not None:
+                self.after_fork()
+            config = uvicorn.Config(self.app, log_level=self.log_level)
+            uvicorn.Server(config).run(sockets=[self.sock])
+        except BaseException as e:
+            print(f"❌ 工作进程 {slot} 异常退出: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _request_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _reload(self, force: bool):
+        """在主进程中更新知识库，索引变化时滚动重启工作进程"""
+        try:
+            changed = self.reload(force)
+        except Exception as e:
+            print(f"⚠️ 主进程重新加载知识库失败: {e}")
+            return
+        if changed and not self.stopping:
+            self._restart_workers()
+
+    def _restart_workers(self):
+        """逐个 fork 新的工作进程并让旧进程优雅退出（SIGTERM 后 uvicorn 处理完正在进行的请求）"""
+        gc.collect()
+        gc.freeze()
+        for pid, (slot, _) in list(self.children.items()):
+            self._spawn(slot)
+            del self.children[pid]
+            self.retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        print(f"🔄 知识库已更新，已重新启动 {self.workers} 个工作进程")
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children) + list(self.retiring):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def memory_report(self) -> Optional[Dict[str, object]]:
+        pids = {"master": os.getpid()}
+        for pid, (slot, _) in sorted(self.children.items(), key=lambda item: item[1][0]):
+            pids[f"worker-{slot}"] = pid
+        return memory_report(pids)
+
+    def run(self, on_started: Optional[Callable[[], None]] = None):
+        """启动工作进程并守护，直到收到 SIGINT/SIGTERM；on_started 在全部工作进程 fork 之后于主进程中调用"""
+        # 把加载阶段产生的对象移到永久代：子进程的垃圾回收不再遍历（写入）这些对象所在的页
+        gc.collect()
+        gc.freeze()
+
+        self.sock = self._bind()
+        print(f"🌐 主进程 {os.getpid()} 监听 {self.host}:{self.port}，启动 {self.workers} 个工作进程")
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGHUP, self._request_reload)
+        # 线程在 fork 之后才启动，不会被复制到工作进程中
+        if on_started is not None:
+            on_started()
+
+        next_report = time.time() + 10
+        next_reload = time.time() + self.reload_interval if self.reload_interval > 0 else float("inf")
+        while self.children or self.retiring:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                if self.reload is not None and not self.stopping and \
+                        (self.reload_requested or time.time() >= next_reload):
+                    force, self.reload_requested = self.reload_requested, False
+                    self._reload(force)
+                    next_reload = time.time() + self.reload_interval if self.reload_interval > 0 else float("inf")
+                if time.time() >= next_report and not self.stopping:
+                    print_memory_report(self.memory_report())
+                    next_report = time.time() + self.report_interval if self.report_interval > 0 else float("inf")
+                time.sleep(0.5)
+                continue
+
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            child = self.children.pop(pid, None)
+            if child is None:
+                # 不是工作进程（例如重新加载时 multiprocessing 创建的子进程），waitpid(-1) 也会回收它
+                continue
+            slot, started = child
+            if self.stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if time.time() - started < WORKER_MIN_UPTIME:
+                print(f"❌ 工作进程 {slot} 启动后立即退出（{code}），停止全部工作进程")
+                self._stop(None, None)
+                continue
+            print(f"⚠️ 工作进程 {slot} 已退出（{code}），重新启动")
+            self._spawn(slot)
+
+        self.sock.close()
+        print("👋 全部工作进程已退出")
@@ -0,0 +1,795 @@
+import importlib.util
+import itertools
+import math
+import re
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from config import Config
+from services.doc_store import DocumentStore, SearchHit
+from services.vector_store import VECTOR_CODECS, disk_backed, is_memory_mapped
+
+# faiss 只在文档数达到 ANN_MIN_DOCS 时导入；未安装时只使用精确的矩阵计算
+FAISS_AVAILABLE = importlib.util.find_spec("faiss") is not None
+
+# 批量检索时分数矩阵（查询数 × 文档数）每块的最多元素数，控制临时内存（float32约64MB）
+BATCH_SCORE_ELEMENTS = 16 * 1024 * 1024
+
+
+# 中文/天城文连续片段和拉丁字母数字单词
+_TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff\u3400-\u4dbf]+|[\u0900-\u097f]+|[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """BM25分词：中文按单字+相邻二字切分，其他语言按单词切分"""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer((text or "").lower()):
+        piece = match.group()
+        if "\u3400" <= piece[0] <= "\u9fff":
+            tokens.extend(piece)
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        else:
+            tokens.append(piece)
+    return tokens
+
+
+def top_k_indices(scores: np.ndarray, k: int, positive_only: bool = False) -> List[Tuple[int, float]]:
+    """取分数最高的k个下标（argpartition，不做全排序）"""
+    if k <= 0 or len(scores) == 0:
+        return []
+    k = min(k, len(scores))
+    ids = np.argpartition(-scores, k - 1)[:k]
+    ids = ids[np.argsort(-scores[ids], kind="stable")]
+    return [(int(i), float(scores[i])) for i in ids if not positive_only or scores[i] > 0]
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+    """分数矩阵每一行取分数最高的k个下标（整个矩阵一次 argpartition）"""
+    if k <= 0 or scores.shape[1] == 0:
+        return [[] for _ in range(len(scores))]
+    k = min(k, scores.shape[1])
+    ids = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(scores, ids, axis=1)
+    order = np.argsort(-top, axis=1, kind="stable")
+    ids = np.take_along_axis(ids, order, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return [[(int(i), float(score)) for i, score in zip(row_ids, row_scores)] for row_ids, row_scores in zip(ids, top)]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Tuple[int, float]]], k: int = 60) -> List[Tuple[int, float]]:
+    """倒数排名融合：score = Σ 1 / (k + rank)"""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """倒排索引上的BM25打分"""
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_count = len(texts)
+
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths = np.zeros(self.doc_count, dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[doc_id] = len(tokens)
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+
+        self.lengths = lengths
+        self.avg_length = float(lengths.mean()) if self.doc_count and lengths.mean() > 0 else 1.0
+        # 文档长度归一化项只与文档有关，预先算好
+        self._length_norm = k1 * (1 - b + b * lengths / self.avg_length)
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+            token: (np.fromiter(counts.keys(), dtype=np.int32, count=len(counts)),
+                    np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+            for token, counts in postings.items()
+        }
+        self.idf = {
+            token: math.log(1 + (self.doc_count - len(ids) + 0.5) / (len(ids) + 0.5))
+            for token, (ids, _) in self.postings.items()
+        }
+
+    @property
+    def memory_bytes(self) -> int:
+        """倒排表、文档长度和长度归一化数组的字节数（不含词典本身）"""
+        return self.lengths.nbytes + self._length_norm.nbytes + \
+            sum(ids.nbytes + tfs.nbytes for ids, tfs in self.postings.values())
+
+    def idf_of(self, token: str) -> float:
+        """词的idf，本索引中没有出现的词按文档频率0计算"""
+        idf = self.idf.get(token)
+        if idf is None:
+            idf = math.log(1 + (self.doc_count + 0.5) / 0.5)
+        return idf
+
+    def scores_with(self, stats: "BM25Index", query: str) -> np.ndarray:
+        """用另一个索引的统计量（idf、平均文档长度）给本索引的文档打分
+
+        增量段按基础段的统计量打分，两段的BM25分数才能直接比较。
+        """
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        length_norm = self.k1 * (1 - self.b + self.b * self.lengths / stats.avg_length)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            ids, tfs = posting
+            scores[ids] += stats.idf_of(token) * tfs * (self.k1 + 1) / (tfs + length_norm[ids])
+        return scores
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            ids, tfs = posting
+            scores[ids] += self.idf[token] * tfs * (self.k1 + 1) / (tfs + self._length_norm[ids])
+        return scores
+
+    def subset_scores(self, query: str, subset: np.ndarray) -> np.ndarray:
+        """只对有序文档子集打分，返回与 subset 对齐的分数"""
+        scores = np.zeros(len(subset), dtype=np.float32)
+        if len(subset) == 0:
+            return scores
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            ids, tfs = posting
+            positions = np.searchsorted(subset, ids)
+            hit = positions < len(subset)
+            hit[hit] = subset[positions[hit]] == ids[hit]
+            ids, tfs = ids[hit], tfs[hit]
+            scores[positions[hit]] += self.idf[token] * tfs * (self.k1 + 1) / (tfs + self._length_norm[ids])
+        return scores
+
+    def search(self, query: str, top_k: int, subset: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        if subset is None:
+            return top_k_indices(self.scores(query), top_k, positive_only=True)
+        ranked = top_k_indices(self.subset_scores(query, subset), top_k, positive_only=True)
+        return [(int(subset[i]), score) for i, score in ranked]
+
+    def search_batch(self, queries: Sequence[str], top_k: int, subset: Optional[np.ndarray] = None,
+                     stats: Optional["BM25Index"] = None) -> List[List[Tuple[int, float]]]:
+        """多个查询的BM25候选：共有的词只计算一次词频项，所有查询复用同一个分数数组
+
+        subset 为有序的文档子集；stats 同 scores_with，默认使用本索引的统计量。
+        """
+        stats = stats or self
+        length_norm = self._length_norm if stats is self else \
+            self.k1 * (1 - self.b + self.b * self.lengths / stats.avg_length)
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        weights: Dict[str, np.ndarray] = {}
+        results = []
+        for query in queries:
+            scores.fill(0)
+            for token in set(tokenize(query)):
+                posting = self.postings.get(token)
+                if posting is None:
+                    continue
+                ids, tfs = posting
+                if token not in weights:
+                    weights[token] = stats.idf_of(token) * tfs * (self.k1 + 1) / (tfs + length_norm[ids])
+                scores[ids] += weights[token]
+            if subset is None:
+                results.append(top_k_indices(scores, top_k, positive_only=True))
+            else:
+                ranked = top_k_indices(scores[subset], top_k, positive_only=True)
+                results.append([(int(subset[i]), score) for i, score in ranked])
+        return results
+
+
+class VectorIndex:
+    """归一化向量上的内积检索
+
+    storage 为 float32 时向量常驻内存，文档数较多时使用FAISS HNSW近似检索；
+    为 float16 / pq 时内存中只保存压缩编码，float32 向量放在磁盘上（内存映射）：
+    先用压缩编码扫描出 top_k × VECTOR_RESCORE_FACTOR 个候选，再读取这些候选的
+    float32 向量精确重新打分。
+    """
+
+    def __init__(self, embeddings: np.ndarray, storage: Optional[str] = None):
+        self.storage = storage or Config.VECTOR_STORAGE
+        self.codes = None
+        self._ann = None
+        if self.storage in VECTOR_CODECS:
+            self.codes = VECTOR_CODECS[self.storage](embeddings)
+            self.embeddings = disk_backed(embeddings)
+            return
+
+        self.storage = "float32"
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if FAISS_AVAILABLE and len(self.embeddings) >= Config.ANN_MIN_DOCS:
+            import faiss
+            index = faiss.IndexHNSWFlat(self.embeddings.shape[1], Config.ANN_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = Config.ANN_EF_SEARCH
+            index.add(self.embeddings)
+            self._ann = index
+
+    def __len__(self) -> int:
+        return len(self.embeddings)
+
+    @property
+    def memory_bytes(self) -> int:
+        """常驻内存的向量数据大小（不含内存映射的float32向量），包括HNSW索引"""
+        if self.codes is not None:
+            return self.codes.nbytes
+        resident = 0 if is_memory_mapped(self.embeddings) else self.embeddings.nbytes
+        return resident + self._ann_memory_bytes()
+
+    def _ann_memory_bytes(self) -> int:
+        """HNSW索引的字节数：FAISS 内部保存的一份float32向量，加上各层邻接表"""
+        if self._ann is None:
+            return 0
+        count, dim = self.embeddings.shape
+        hnsw = self._ann.hnsw
+        try:
+            graph = hnsw.neighbors.size() * 4 + hnsw.levels.size() * 4 + hnsw.offsets.size() * 8
+        except AttributeError:
+            # 无法读取邻接表大小时按第0层 2*M 个邻居估算
+            graph = count * Config.ANN_HNSW_M * 2 * 4
+        return count * dim * 4 + graph
+
+    def similarities(self, query_embedding: np.ndarray, ids: Sequence[int]) -> np.ndarray:
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.codes is not None:
+            # 内存映射按有序下标读取，减少随机IO
+            order = np.argsort(ids, kind="stable")
+            scores = np.empty(len(ids), dtype=np.float32)
+            scores[order] = self.embeddings[ids[order]] @ query_embedding
+            return scores
+        return self.embeddings[ids] @ query_embedding
+
+    def _rescored(self, query_embedding: np.ndarray, top_k: int,
+                  subset: Optional[np.ndarray]) -> List[Tuple[int, float]]:
+        approx = self.codes.scores(query_embedding, subset)
+        candidates = [i for i, _ in top_k_indices(approx, top_k * Config.VECTOR_RESCORE_FACTOR)]
+        ids = np.asarray(candidates, dtype=np.int64)
+        if subset is not None:
+            ids = subset[ids].astype(np.int64)
+        exact = self.similarities(query_embedding, ids)
+        return [(int(ids[i]), score) for i, score in top_k_indices(exact, top_k)]
+
+    def search(self, query_embedding: np.ndarray, top_k: int,
+               subset: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        if self.codes is not None:
+            return self._rescored(query_embedding, top_k, subset)
+        if subset is not None:
+            # 过滤后的子集直接精确计算，开销与过滤条件的选择性成正比
+            ranked = top_k_indices(self.embeddings[subset] @ query_embedding, top_k)
+            return [(int(subset[i]), score) for i, score in ranked]
+        if self._ann is not None:
+            scores, ids = self._ann.search(query_embedding.reshape(1, -1), top_k)
+            return [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i >= 0]
+        return top_k_indices(self.embeddings @ query_embedding, top_k)
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int,
+                     subset: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        """多个查询向量（每行一个）一起检索，每个查询返回 top_k 个结果
+
+        float32 存储时用一次矩阵乘法（文档数较多时按查询分块）或一次FAISS批量检索；
+        压缩存储时批量扫描压缩编码，再按各自的候选精确重新打分。
+        """
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        if len(query_embeddings) == 0:
+            return []
+        if self.codes is not None:
+            approx = self.codes.batch_scores(query_embeddings, subset)
+            results = []
+            for query_embedding, row in zip(query_embeddings, approx):
+                ids = np.asarray([i for i, _ in top_k_indices(row, top_k * Config.VECTOR_RESCORE_FACTOR)],
+                                 dtype=np.int64)
+                if subset is not None:
+                    ids = subset[ids].astype(np.int64)
+                exact = self.similarities(query_embedding, ids)
+                results.append([(int(ids[i]), score) for i, score in top_k_indices(exact, top_k)])
+            return results
+        if subset is None and self._ann is not None:
+            scores, ids = self._ann.search(query_embeddings, top_k)
+            return [[(int(i), float(s)) for i, s in zip(row_ids, row_scores) if i >= 0]
+                    for row_ids, row_scores in zip(ids, scores)]
+
+        matrix = self.embeddings if subset is None else self.embeddings[subset]
+        rows = max(1, BATCH_SCORE_ELEMENTS // max(1, len(matrix)))
+        results = []
+        for start in range(0, len(query_embeddings), rows):
+            results.extend(top_k_rows(query_embeddings[start:start + rows] @ matrix.T, top_k))
+        if subset is not None:
+            results = [[(int(subset[i]), score) for i, score in ranked] for ranked in results]
+        return results
+
+
+class MetadataIndex:
+    """文档元数据的倒排表：字段 → 取值 → 有序文档下标数组"""
+
+    FIELDS = ("type", "category", "subcategory", "lang")
+
+    def __init__(self, documents: Sequence[Dict[str, Any]], fields: Sequence[str] = FIELDS):
+        if isinstance(documents, DocumentStore):
+            # 列式存储直接按驻留编码分组，不逐个读取文档
+            self.postings = {field: documents.value_rows(field) for field in fields}
+            return
+        postings: Dict[str, Dict[str, List[int]]] = {field: {} for field in fields}
+        for doc_id, doc in enumerate(documents):
+            for field in fields:
+                value = doc.get(field)
+                if value:
+                    postings[field].setdefault(str(value), []).append(doc_id)
+        self.postings: Dict[str, Dict[str, np.ndarray]] = {
+            field: {value: np.asarray(ids, dtype=np.int32) for value, ids in values.items()}
+            for field, values in postings.items()
+        }
+
+    def values(self, field: str) -> Dict[str, int]:
+        """某个字段的取值及文档数"""
+        return {value: len(ids) for value, ids in self.postings.get(field, {}).items()}
+
+    def select(self, filters: Optional[Dict[str, Union[str, Sequence[str]]]]) -> Optional[np.ndarray]:
+        """同一字段内多个取值取并集，不同字段之间取交集；没有过滤条件时返回None"""
+        subset = None
+        for field, wanted in (filters or {}).items():
+            if not wanted:
+                continue
+            if field not in self.postings:
+                raise ValueError(f"不支持的过滤字段: {field}")
+            wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+            lists = [self.postings[field][value] for value in wanted if value in self.postings[field]]
+            ids = np.unique(np.concatenate(lists)) if lists else np.empty(0, dtype=np.int32)
+            subset = ids if subset is None else np.intersect1d(subset, ids, assume_unique=True)
+        return subset
+
+
+class EmbeddingReranker:
+    """用已有的文档向量对候选重新打分（余弦相似度），几乎没有额外开销"""
+
+    name = "embedding"
+
+    @property
+    def min_score(self) -> float:
+        """余弦相似度阈值"""
+        return Config.RETRIEVAL_MIN_SCORE
+
+    def score(self, query: str, query_embedding: Optional[np.ndarray], index: "SearchIndex",
+              ids: Sequence[int]) -> Optional[np.ndarray]:
+        if query_embedding is None or index.vectors is None:
+            return None
+        return index.vectors.similarities(query_embedding, ids)
+
+    def score_batch(self, queries: Sequence[str], query_embeddings: Optional[np.ndarray], index: "SearchIndex",
+                    ids: Sequence[Sequence[int]]) -> Optional[List[np.ndarray]]:
+        """每个查询各自候选的分数"""
+        if query_embeddings is None or index.vectors is None:
+            return None
+        return [index.vectors.similarities(query_embeddings[i], row) for i, row in enumerate(ids)]
+
+
+class CrossEncoderReranker:
+    """CPU上的轻量交叉编码器，只对融合后的前 RERANK_TOP_K 个候选打分"""
+
+    name = "cross_encoder"
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    @property
+    def min_score(self) -> float:
+        """模型输出尺度上的阈值（不是余弦相似度，不能共用 RETRIEVAL_MIN_SCORE）"""
+        return Config.CROSS_ENCODER_MIN_SCORE
+
+    def score(self, query: str, query_embedding: Optional[np.ndarray], index: "SearchIndex",
+              ids: Sequence[int]) -> Optional[np.ndarray]:
+        return self.score_batch([query], None, index, [ids])[0]
+
+    def score_batch(self, queries: Sequence[str], query_embeddings: Optional[np.ndarray], index: "SearchIndex",
+                    ids: Sequence[Sequence[int]]) -> Optional[List[np.ndarray]]:
+        """所有查询的 (查询, 候选) 对一次交给模型打分，再按查询拆开"""
+        pairs = [(query, index.documents[i]["content"]) for query, row in zip(queries, ids) for i in row]
+        scores = np.asarray(self.model.predict(pairs), dtype=np.float32) if pairs else np.zeros(0, dtype=np.float32)
+        return np.split(scores, np.cumsum([len(row) for row in ids])[:-1])
+
+
+class SearchIndex:
+    """一组文档的只读检索索引（删除只设置墓碑位）
+
+    检索流程：BM25候选 + 向量候选 → 倒数排名融合 → 前K个候选重排 → 分数阈值过滤，
+    每个阶段分别计时。
+    """
+
+    def __init__(self, documents: Iterable[Mapping[str, Any]], embeddings: Optional[np.ndarray] = None,
+                 storage: Optional[str] = None):
+        # 文档转为列式存储，content 在构建BM25索引时逐个生成
+        self.documents = documents if isinstance(documents, DocumentStore) else DocumentStore(documents)
+        self.bm25 = BM25Index(self.documents.contents)
+        self.metadata = MetadataIndex(self.documents)
+        self.vectors = None
+        if embeddings is not None and len(embeddings) == len(self.documents) and len(self.documents) > 0:
+            self.vectors = VectorIndex(embeddings, storage)
+        self.tombstones = np.zeros(len(self.documents), dtype=bool)
+        self.deleted = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        """文档存储、BM25倒排表和常驻向量的字节数"""
+        vector_bytes = self.vectors.memory_bytes if self.vectors is not None else 0
+        return self.documents.memory_bytes + self.bm25.memory_bytes + vector_bytes + self.tombstones.nbytes
+
+    def delete(self, position: int) -> bool:
+        """设置墓碑位，检索立即跳过该文档"""
+        if self.tombstones[position]:
+            return False
+        self.tombstones[position] = True
+        self.deleted += 1
+        return True
+
+    def _drop_deleted(self, ranking: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
+        return [(doc_id, score) for doc_id, score in ranking if not self.tombstones[doc_id]]
+
+    def candidate_count(self, top_k: int) -> int:
+        candidates = max(top_k, Config.RETRIEVAL_CANDIDATES)
+        # 有墓碑时多取一些候选，抵消被跳过的文档
+        return candidates + min(self.deleted, candidates)
+
+    def _select(self, filters: Optional[Dict[str, Union[str, Sequence[str]]]],
+                timings: Dict[str, float]) -> Optional[np.ndarray]:
+        """按元数据过滤出的存活文档下标；没有过滤条件时返回None"""
+        if not filters:
+            return None
+        start = time.perf_counter()
+        subset = self.metadata.select(filters)
+        if subset is not None and self.deleted:
+            subset = subset[~self.tombstones[subset]]
+        timings["filter"] = timings.get("filter", 0.0) + (time.perf_counter() - start) * 1000
+        return subset
+
+    def _keyword_ranking(self, query: str, candidates: int, subset: Optional[np.ndarray],
+                         stats: Optional[BM25Index]) -> List[Tuple[int, float]]:
+        if stats is None:
+            return self.bm25.search(query, candidates, subset)
+        scores = self.bm25.scores_with(stats, query)
+        if subset is None:
+            return top_k_indices(scores, candidates, positive_only=True)
+        ranked = top_k_indices(scores[subset], candidates, positive_only=True)
+        return [(int(subset[i]), score) for i, score in ranked]
+
+    def rankings(self, query: str, query_embedding: Optional[np.ndarray], candidates: int,
+                 filters: Optional[Dict[str, Union[str, Sequence[str]]]], timings: Dict[str, float],
+                 stats: Optional[BM25Index] = None) -> Dict[str, List[Tuple[int, float]]]:
+        """各路候选 {"bm25": [...], "vector": [...]}（已跳过删除的文档），各阶段耗时累加到 timings
+
+        stats 为打分使用的BM25统计量（增量段使用基础段的统计量），默认使用本索引的统计量。
+        """
+        return self.rankings_batch([query], None if query_embedding is None else query_embedding[None, :],
+                                   candidates, filters, timings, stats)[0]
+
+    def rankings_batch(self, queries: Sequence[str], query_embeddings: Optional[np.ndarray], candidates: int,
+                       filters: Optional[Dict[str, Union[str, Sequence[str]]]], timings: Dict[str, float],
+                       stats: Optional[BM25Index] = None) -> List[Dict[str, List[Tuple[int, float]]]]:
+        """多个查询共用同一过滤条件的各路候选：过滤只计算一次，向量候选由一次批量检索得到"""
+        subset = self._select(filters, timings)
+        if subset is not None and len(subset) == 0:
+            return [{} for _ in queries]
+
+        start = time.perf_counter()
+        if len(queries) == 1:
+            results = [{"bm25": self._keyword_ranking(queries[0], candidates, subset, stats)}]
+        else:
+            results = [{"bm25": ranking} for ranking in self.bm25.search_batch(queries, candidates, subset, stats)]
+        timings["bm25"] = timings.get("bm25", 0.0) + (time.perf_counter() - start) * 1000
+
+        if self.vectors is not None and query_embeddings is not None:
+            start = time.perf_counter()
+            if len(queries) == 1:
+                vector_rankings = [self.vectors.search(query_embeddings[0], candidates, subset)]
+            else:
+                vector_rankings = self.vectors.search_batch(query_embeddings, candidates, subset)
+            for result, ranking in zip(results, vector_rankings):
+                result["vector"] = ranking
+            timings["ann"] = timings.get("ann", 0.0) + (time.perf_counter() - start) * 1000
+
+        if self.deleted and subset is None:
+            results = [{name: self._drop_deleted(ranking) for name, ranking in result.items()} for result in results]
+        return results
+
+    def _rerank_scores(self, reranker, queries: Sequence[str], query_embeddings: Optional[np.ndarray],
+                       ids: Sequence[Sequence[int]]) -> Optional[List[np.ndarray]]:
+        return reranker.score_batch(queries, query_embeddings, self, ids)
+
+    def search(self, query: str, query_embedding: Optional[np.ndarray], top_k: int, reranker=None,
+               filters: Optional[Dict[str, Union[str, Sequence[str]]]] = None
+               ) -> Tuple[List[Tuple[int, float]], Dict[str, float]]:
+        """返回 ([(文档下标, 分数)], 各阶段耗时毫秒)；filters 按元数据预先过滤，只对匹配的子集打分"""
+        timings: Dict[str, float] = {}
+        rankings = self.rankings(query, query_embedding, self.candidate_count(top_k), filters, timings)
+        results = fuse_and_rerank([query], None if query_embedding is None else query_embedding[None, :],
+                                  [rankings], top_k, reranker, self._rerank_scores, timings)[0]
+        return results, {stage: round(value, 3) for stage, value in timings.items()}
+
+    def search_batch(self, queries: Sequence[str], query_embeddings: Optional[np.ndarray], top_k: int,
+                     reranker=None, filters: Optional[Dict[str, Union[str, Sequence[str]]]] = None
+                     ) -> Tuple[List[List[Tuple[int, float]]], Dict[str, float]]:
+        """多个查询共用同一过滤条件一起检索，返回 (每个查询的 [(文档下标, 分数)], 各阶段总耗时毫秒)
+
+        过滤只计算一次，BM25共用各查询词的词频项，向量候选由一次批量检索得到，
+        所有查询的重排候选一起交给重排器（交叉编码器一次 predict）。
+        """
+        timings: Dict[str, float] = {}
+        all_rankings = self.rankings_batch(queries, query_embeddings, self.candidate_count(top_k), filters, timings)
+        results = fuse_and_rerank(queries, query_embeddings, all_rankings, top_k, reranker,
+                                  self._rerank_scores, timings)
+        return results, {stage: round(value, 3) for stage, value in timings.items()}
+
+
+def fuse_and_rerank(queries: Sequence[str], query_embeddings: Optional[np.ndarray],
+                    rankings: Sequence[Dict[str, List[Tuple[int, float]]]], top_k: int, reranker, rerank_scores,
+                    timings: Dict[str, float]) -> List[List[Tuple[int, float]]]:
+    """融合每个查询的各路候选，所有查询的前 RERANK_TOP_K 个候选一起重排；各阶段耗时累加到 timings
+
+    rerank_scores(reranker, queries, query_embeddings, ids) 返回每个查询候选的重排分数（不支持时为None）。
+    """
+    start = time.perf_counter()
+    # 只有一路候选时保留原始分数
+    fused = [
+        reciprocal_rank_fusion(list(channels.values()), Config.RETRIEVAL_RRF_K) if len(channels) > 1
+        else next(iter(channels.values()), [])
+        for channels in rankings
+    ]
+    timings["fusion"] = timings.get("fusion", 0.0) + (time.perf_counter() - start) * 1000
+
+    if reranker is None or not any(fused):
+        return [ranked[:top_k] for ranked in fused]
+    start = time.perf_counter()
+    heads = [[doc_id for doc_id, _ in ranked[:max(top_k, Config.RERANK_TOP_K)]] for ranked in fused]
+    scores = rerank_scores(reranker, queries, query_embeddings, heads)
+    if scores is None:
+        return [ranked[:top_k] for ranked in fused]
+    results = []
+    for head, head_scores in zip(heads, scores):
+        # 重排分数低于该重排器阈值的弱匹配直接丢弃
+        ranked = [(doc_id, float(score)) for doc_id, score in zip(head, head_scores) if score >= reranker.min_score]
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        results.append(ranked[:top_k])
+    timings["rerank"] = timings.get("rerank", 0.0) + (time.perf_counter() - start) * 1000
+    return results
+
+
+def _live_matrix(documents: Sequence[Mapping[str, Any]], tombstones: np.ndarray, embeddings: Optional[np.ndarray],
+                 delta_embeddings: List[Optional[np.ndarray]]) -> Optional[np.ndarray]:
+    if (embeddings is None and documents) or any(vector is None for vector in delta_embeddings):
+        return None
+    parts = [embeddings[~tombstones]] if embeddings is not None else []
+    if delta_embeddings:
+        parts.append(np.vstack(delta_embeddings))
+    return np.vstack(parts).astype(np.float32) if parts else None
+
+
+class SegmentedIndex:
+    """可修改的检索索引：只读基础段 + 增量段 + 墓碑位图
+
+    - 新增/修改：旧版本在基础段中设置墓碑，新版本写入增量段，只重建增量段的小索引，
+      写入耗时只与增量段大小有关，与语料规模无关
+    - 删除：设置墓碑位（或从增量段移除），检索立即生效
+    - 墓碑和增量段占比超过阈值后，由调用方在后台用 compacted() 生成新的基础段并替换
+    """
+
+    def __init__(self, documents: Iterable[Mapping[str, Any]], embeddings: Optional[np.ndarray] = None):
+        self.base = SearchIndex(documents, embeddings)
+        # 压缩存储时为磁盘上的float32向量，不再持有传入的内存副本
+        self.base_embeddings = self.base.vectors.embeddings if self.base.vectors is not None else None
+        self.delta_documents: List[Dict[str, Any]] = []
+        self.delta_embeddings: List[Optional[np.ndarray]] = []
+        self.delta_positions: Dict[str, int] = {}
+        self.delta: Optional[SearchIndex] = None
+
+    @property
+    def vectors(self):
+        if self.base.vectors is not None or self.delta is None:
+            return self.base.vectors
+        return self.delta.vectors
+
+    def __len__(self) -> int:
+        return len(self.base.documents) - self.base.deleted + len(self.delta_documents)
+
+    @property
+    def memory_bytes(self) -> int:
+        delta = self.delta
+        return self.base.memory_bytes + (delta.memory_bytes if delta is not None else 0)
+
+    def _rebuild_delta(self, documents: List[Dict[str, Any]], embeddings: List[Optional[np.ndarray]]):
+        delta = None
+        if documents:
+            matrix = None
+            if all(vector is not None for vector in embeddings):
+                matrix = np.vstack(embeddings).astype(np.float32)
+            # 增量段很小且每次写入都重建，始终使用float32（压缩编码的训练开销与写入无关才能保持常数）
+            delta = SearchIndex(documents, matrix, storage="float32")
+        # 先构建再替换，检索看到的总是完整的增量段
+        self.delta_positions = {doc["id"]: i for i, doc in enumerate(documents)}
+        self.delta_documents, self.delta_embeddings, self.delta = documents, embeddings, delta
+
+    def get(self, doc_id: str) -> Optional[Mapping[str, Any]]:
+        position = self.delta_positions.get(doc_id)
+        if position is not None:
+            return self.delta_documents[position]
+        position = self.base.documents.row_of(doc_id)
+        if position is not None and not self.base.tombstones[position]:
+            return self.base.documents[position]
+        return None
+
+    def embedding(self, doc_id: str) -> Optional[np.ndarray]:
+        position = self.delta_positions.get(doc_id)
+        if position is not None:
+            return self.delta_embeddings[position]
+        position = self.base.documents.row_of(doc_id)
+        if position is not None and self.base_embeddings is not None and not self.base.tombstones[position]:
+            return self.base_embeddings[position]
+        return None
+
+    def upsert(self, document: Dict[str, Any], embedding: Optional[np.ndarray] = None):
+        """新增或替换文档"""
+        doc_id = document["id"]
+        position = self.base.documents.row_of(doc_id)
+        if position is not None:
+            self.base.delete(position)
+        documents, embeddings = list(self.delta_documents), list(self.delta_embeddings)
+        position = self.delta_positions.get(doc_id)
+        if position is None:
+            documents.append(document)
+            embeddings.append(embedding)
+        else:
+            documents[position], embeddings[position] = document, embedding
+        self._rebuild_delta(documents, embeddings)
+
+    def delete(self, doc_id: str) -> bool:
+        """删除文档，返回文档是否存在"""
+        position = self.delta_positions.get(doc_id)
+        if position is not None:
+            self._rebuild_delta(
+                self.delta_documents[:position] + self.delta_documents[position + 1:],
+                self.delta_embeddings[:position] + self.delta_embeddings[position + 1:]
+            )
+            return True
+        position = self.base.documents.row_of(doc_id)
+        return position is not None and self.base.delete(position)
+
+    def tombstone_ratio(self) -> float:
+        """墓碑和增量段文档占基础段的比例"""
+        return (self.base.deleted + len(self.delta_documents)) / max(len(self.base.documents), 1)
+
+    def needs_compaction(self) -> bool:
+        return self.tombstone_ratio() >= Config.KNOWLEDGE_COMPACTION_RATIO or \
+            len(self.delta_documents) >= Config.KNOWLEDGE_DELTA_MAX_DOCS
+
+    def _live_base(self) -> Iterator[Mapping[str, Any]]:
+        documents = self.base.documents
+        return (documents[i] for i in np.flatnonzero(~self.base.tombstones))
+
+    def snapshot(self) -> tuple:
+        """合并所需状态的快照（复制墓碑位图和增量段列表，基础段文档和向量只读共享）"""
+        return (self.base.documents, self.base.tombstones.copy(), self.base_embeddings,
+                list(self.delta_documents), list(self.delta_embeddings))
+
+    @classmethod
+    def from_snapshot(cls, snapshot: tuple) -> "SegmentedIndex":
+        """用快照中的存活文档和已有向量重建基础段（不重新向量化）"""
+        documents, tombstones, embeddings, delta_documents, delta_embeddings = snapshot
+        live = itertools.chain((documents[i] for i in np.flatnonzero(~tombstones)), delta_documents)
+        return cls(live, _live_matrix(documents, tombstones, embeddings, delta_embeddings))
+
+    def live_documents(self) -> List[Mapping[str, Any]]:
+        """存活文档（基础段为 DocumentView，增量段为写入时的字典）"""
+        return list(self._live_base()) + list(self.delta_documents)
+
+    def live_embeddings(self) -> Optional[np.ndarray]:
+        """与 live_documents() 顺序一致的向量矩阵，部分文档没有向量时返回None"""
+        return _live_matrix(self.base.documents, self.base.tombstones, self.base_embeddings,
+                            list(self.delta_embeddings))
+
+    def compacted(self) -> "SegmentedIndex":
+        return SegmentedIndex.from_snapshot(self.snapshot())
+
+    def metadata_values(self, field: str) -> Dict[str, int]:
+        counts = {}
+        for value, ids in self.base.metadata.postings.get(field, {}).items():
+            alive = int(len(ids) - self.base.tombstones[ids].sum())
+            if alive:
+                counts[value] = alive
+        if self.delta is not None:
+            for value, count in self.delta.metadata.values(field).items():
+                counts[value] = counts.get(value, 0) + count
+        return counts
+
+    def _merged_rankings(self, base_rankings: Dict[str, List[Tuple[int, float]]],
+                         delta_rankings: Dict[str, List[Tuple[int, float]]],
+                         candidates: int) -> Dict[str, List[Tuple[int, float]]]:
+        """按路合并基础段和增量段的候选；增量段下标加上基础段文档数
+
+        向量分数都是余弦相似度，增量段的BM25分数按基础段的统计量计算，同一路内分数可以直接比较。
+        """
+        offset = len(self.base.documents)
+        merged = {}
+        for name in list(base_rankings) + [name for name in delta_rankings if name not in base_rankings]:
+            ranking = list(base_rankings.get(name, []))
+            ranking.extend((offset + i, score) for i, score in delta_rankings.get(name, []))
+            ranking.sort(key=lambda item: item[1], reverse=True)
+            merged[name] = ranking[:candidates]
+        return merged
+
+    def _segment_rerank_scores(self, delta: SearchIndex):
+        """重排打分：按下标拆到两段分别打分（同一重排器，分数可比）"""
+        offset = len(self.base.documents)
+
+        def rerank_scores(reranker, queries: Sequence[str], query_embeddings: Optional[np.ndarray],
+                          ids: Sequence[Sequence[int]]) -> Optional[List[np.ndarray]]:
+            ids = [np.asarray(row, dtype=np.int64) for row in ids]
+            scores = [np.empty(len(row), dtype=np.float32) for row in ids]
+            # 每段一次批量打分（所有查询落在该段的候选一起）
+            for index, in_segment, shift in ((self.base, lambda row: row < offset, 0),
+                                             (delta, lambda row: row >= offset, offset)):
+                masks = [in_segment(row) for row in ids]
+                if not any(mask.any() for mask in masks):
+                    continue
+                parts = reranker.score_batch(queries, query_embeddings, index,
+                                             [(row[mask] - shift).tolist() for row, mask in zip(ids, masks)])
+                if parts is None:
+                    return None
+                for row_scores, mask, part in zip(scores, masks, parts):
+                    row_scores[mask] = part
+            return scores
+        return rerank_scores
+
+    def _hit(self, delta: Optional[SearchIndex], position: int, score: float) -> SearchHit:
+        offset = len(self.base.documents)
+        if position < offset:
+            return SearchHit(self.base.documents, position, score)
+        return SearchHit(delta.documents, position - offset, score)
+
+    def search(self, query: str, query_embedding: Optional[np.ndarray], top_k: int, reranker=None,
+               filters: Optional[Dict[str, Union[str, Sequence[str]]]] = None
+               ) -> Tuple[List[SearchHit], Dict[str, float]]:
+        """检索基础段和增量段，返回 ([检索结果视图], 各阶段耗时毫秒)
+
+        两段的候选按路合并后一起融合和重排，增量段的文档与基础段按同一标准排序。
+        """
+        delta = self.delta
+        if delta is None:
+            ranked, timings = self.base.search(query, query_embedding, top_k, reranker, filters)
+            return [SearchHit(self.base.documents, i, score) for i, score in ranked], timings
+        results, timings = self.search_batch([query], None if query_embedding is None else query_embedding[None, :],
+                                             top_k, reranker, filters)
+        return results[0], timings
+
+    def search_batch(self, queries: Sequence[str], query_embeddings: Optional[np.ndarray], top_k: int,
+                     reranker=None, filters: Optional[Dict[str, Union[str, Sequence[str]]]] = None
+                     ) -> Tuple[List[List[SearchHit]], Dict[str, float]]:
+        """多个查询一起检索基础段和增量段，返回 (每个查询的 [检索结果视图], 各阶段总耗时毫秒)"""
+        delta = self.delta
+        if delta is None:
+            ranked, timings = self.base.search_batch(queries, query_embeddings, top_k, reranker, filters)
+            return [[SearchHit(self.base.documents, i, score) for i, score in hits] for hits in ranked], timings
+
+        timings: Dict[str, float] = {}
+        candidates = self.base.candidate_count(top_k)
+        base_rankings = self.base.rankings_batch(queries, query_embeddings, candidates, filters, timings)
+        start = time.perf_counter()
+        # 增量段按基础段的BM25统计量打分（基础段为空时使用自己的统计量）
+        stats = self.base.bm25 if self.base.bm25.doc_count else None
+        delta_rankings = delta.rankings_batch(queries, query_embeddings, candidates, filters, {}, stats)
+        timings["delta"] = (time.perf_counter() - start) * 1000
+
+        rankings = [self._merged_rankings(base, delta_ranking, candidates)
+                    for base, delta_ranking in zip(base_rankings, delta_rankings)]
+        ranked = fuse_and_rerank(queries, query_embeddings, rankings, top_k, reranker,
+                                 self._segment_rerank_scores(delta), timings)
+        results = [[self._hit(delta, position, score) for position, score in hits] for hits in ranked]
+        return results, {stage: round(value, 3) for stage, value in timings.items()}
@@ -0,0 +1,361 @@
+import asyncio
+import base64
+import importlib.util
+import json
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from config import Config
+
+# msgpack 可选：没有安装时使用JSON编码（向量按base64传输），帧头中记录编码方式，两端不必一致
+MSGPACK_AVAILABLE = importlib.util.find_spec("msgpack") is not None
+
+# 帧格式：4字节大端长度 + 1字节编码方式 + 消息体
+FRAME_HEADER = struct.Struct(">IB")
+CODEC_JSON = 0
+CODEC_MSGPACK = 1
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+class RetrievalUnavailable(Exception):
+    """检索进程无法连接或响应超时（调用方应回退到进程内检索）"""
+
+
+class RetrievalError(Exception):
+    """检索进程处理请求时出错"""
+
+
+def _pack_default(obj):
+    if isinstance(obj, np.ndarray):
+        return {"__ndarray__": [obj.dtype.str, list(obj.shape)], "data": np.ascontiguousarray(obj).tobytes()}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+
+def _json_default(obj):
+    value = _pack_default(obj)
+    if isinstance(value, dict):
+        value["data"] = base64.b64encode(value["data"]).decode("ascii")
+    return value
+
+
+def _unpack_hook(obj: Dict[str, Any]):
+    if "__ndarray__" in obj:
+        dtype, shape = obj["__ndarray__"]
+        data = obj["data"]
+        if isinstance(data, str):
+            data = base64.b64decode(data)
+        return np.frombuffer(data, dtype=np.dtype(dtype)).reshape(shape)
+    return obj
+
+
+def encode_frame(message: Dict[str, Any], codec: Optional[int] = None) -> bytes:
+    """消息 → 帧；numpy 数组按原始字节传输"""
+    if codec is None:
+        codec = CODEC_MSGPACK if MSGPACK_AVAILABLE else CODEC_JSON
+    if codec == CODEC_MSGPACK:
+        import msgpack
+        body = msgpack.packb(message, default=_pack_default, use_bin_type=True)
+    else:
+        body = json.dumps(message, ensure_ascii=False, default=_json_default).encode("utf-8")
+    return FRAME_HEADER.pack(len(body), codec) + body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[tuple]:
+    """读取一帧，返回 (消息, 编码方式)；连接关闭时返回None"""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    length, codec = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f"帧过大: {length} 字节")
+    body = await reader.readexactly(length)
+    if codec == CODEC_MSGPACK:
+        import msgpack
+        return msgpack.unpackb(body, object_hook=_unpack_hook, raw=False), codec
+    return json.loads(body.decode("utf-8"), object_hook=_unpack_hook), codec
+
+
+class EncodeBatcher:
+    """把并发请求的查询合并成一批向量化
+
+    第一条文本到达后最多等待 wait_ms，或攒够 max_batch 条立即向量化；模型推理在单独的线程中串行执行。
+    """
+
+    def __init__(self, encode, max_batch: int, wait_ms: float):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.wait = wait_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval-encode")
+        self.pending: List[tuple] = []  # (文本列表, future)
+        self.pending_texts = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.stats = {"batches": 0, "texts": 0}
+
+    async def encode_texts(self, texts: List[str]) -> Optional[np.ndarray]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((texts, future))
+        self.pending_texts += len(texts)
+        if self.pending_texts >= self.max_batch:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        batch, self.pending, self.pending_texts = self.pending, [], 0
+        asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch: List[tuple]):
+        texts = [text for item, _ in batch for text in item]
+        try:
+            embeddings = await asyncio.get_running_loop().run_in_executor(self.executor, self.encode, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.stats["batches"] += 1
+        self.stats["texts"] += len(texts)
+        offset = 0
+        for item, future in batch:
+            if not future.done():
+                future.set_result(None if embeddings is None else embeddings[offset:offset + len(item)])
+            offset += len(item)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class RetrievalServer:
+    """独立的检索进程：持有向量化模型和知识库索引，通过 Unix domain socket 提供向量化和检索
+
+    请求: {"id": n, "op": "ping" | "encode" | "search" | "search_batch" | "context" | "upsert" | "delete" | "stats",
+          "args": {...}}
+    响应: {"id": n, "ok": true, "result": ...} 或 {"id": n, "ok": false, "error": "..."}
+    同一连接上的请求可以连续发送，响应按完成顺序返回，用 id 对应。
+    upsert / delete 是主服务转发的知识库写操作，写入检索进程自己的索引后才返回。
+    """
+
+    def __init__(self, knowledge_base, path: str, max_batch: Optional[int] = None,
+                 batch_wait_ms: Optional[float] = None, threads: Optional[int] = None):
+        self.knowledge_base = knowledge_base
+        self.path = path
+        self.batcher = EncodeBatcher(
+            knowledge_base.encode_texts,
+            max_batch or Config.RETRIEVAL_SIDECAR_MAX_BATCH,
+            Config.RETRIEVAL_SIDECAR_BATCH_WAIT_MS if batch_wait_ms is None else batch_wait_ms
+        )
+        # 检索（BM25、向量打分、重排）在线程池中执行，不阻塞接收请求
+        self.executor = ThreadPoolExecutor(max_workers=threads or Config.RETRIEVAL_SIDECAR_THREADS,
+                                           thread_name_prefix="retrieval-search")
+        self.started_at = time.time()
+        self.stats = {"connections": 0, "requests": 0, "errors": 0, "ops": {}}
+
+    async def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # 上次异常退出残留的socket文件
+        server = await asyncio.start_unix_server(self._handle_connection, path=self.path)
+        print(f"🔌 检索服务已监听 {self.path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.batcher.shutdown()
+            self.executor.shutdown(wait=False)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats["connections"] += 1
+        tasks = set()
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                task = asyncio.create_task(self._respond(writer, *frame))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError) as e:
+            print(f"⚠️ 检索连接异常断开: {e}")
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, request: Dict[str, Any], codec: int):
+        op = request.get("op")
+        self.stats["requests"] += 1
+        self.stats["ops"][op] = self.stats["ops"].get(op, 0) + 1
+        try:
+            result = await self.handle(op, request.get("args") or {})
+            response = {"id": request.get("id"), "ok": True, "result": result}
+        except Exception as e:
+            self.stats["errors"] += 1
+            response = {"id": request.get("id"), "ok": False, "error": f"{type(e).__name__}: {e}"}
+        if not writer.is_closing():
+            writer.write(encode_frame(response, codec))
+            await writer.drain()
+
+    async def _query_embedding(self, query: str, timings: Dict[str, float]) -> Optional[np.ndarray]:
+        if self.knowledge_base.embedding_model is None:
+            return None
+        start = time.perf_counter()
+        embeddings = await self.batcher.encode_texts([query])
+        timings["encode"] = round((time.perf_counter() - start) * 1000, 3)
+        return None if embeddings is None else embeddings[0]
+
+    async def _search(self, args: Dict[str, Any]):
+        timings: Dict[str, float] = {}
+        embedding = await self._query_embedding(args["query"], timings)
+        results, search_timings = await asyncio.get_running_loop().run_in_executor(
+            self.executor, lambda: self.knowledge_base.hybrid_search(
+                args["query"], args.get("top_k", 5), args.get("filters"), args.get("lang"), embedding)
+        )
+        return results, {**timings, **search_timings}
+
+    async def handle(self, op: str, args: Dict[str, Any]):
+        if op == "ping":
+            return {"version": self.knowledge_base.version,
+                    "documents": sum(self.knowledge_base.get_partition_stats().values()),
+                    "vectors": self.knowledge_base.embedding_model is not None}
+        if op == "encode":
+            return await self.batcher.encode_texts(list(args["texts"]))
+        if op == "search":
+            results, timings = await self._search(args)
+            return {"results": [dict(result) for result in results], "timings_ms": timings}
+        if op == "search_batch":
+            # 多个查询本身已是一批，不经过合并队列，直接在检索线程中一起向量化和检索
+            results, timings = await asyncio.get_running_loop().run_in_executor(
+                self.executor, lambda: self.knowledge_base.search_batch(
+                    list(args["queries"]), args.get("top_k", 5), args.get("filters"), args.get("lang"))
+            )
+            return {"results": [[dict(result) for result in hits] for hits in results], "timings_ms": timings}
+        if op == "context":
+            results, _ = await self._search(args)
+            return self.knowledge_base.format_context_entries(results)
+        if op == "upsert":
+            # 向量化和写入索引在检索线程中执行
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.knowledge_base.upsert_documents, list(args["documents"]))
+            return {"version": self.knowledge_base.version}
+        if op == "delete":
+            deleted = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.knowledge_base.delete_document, args["doc_id"])
+            return {"deleted": deleted, "version": self.knowledge_base.version}
+        if op == "stats":
+            return self.get_stats()
+        raise ValueError(f"未知操作: {op}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        batches = self.batcher.stats["batches"]
+        return {
+            **self.stats,
+            "uptime_seconds": round(time.time() - self.started_at, 2),
+            "encode_batches": batches,
+            "avg_encode_batch": round(self.batcher.stats["texts"] / batches, 2) if batches else 0,
+            "retrieval": self.knowledge_base.get_retrieval_stats()
+        }
+
+
+class RetrievalClient:
+    """检索进程的异步客户端（连接池）
+
+    每个请求占用一个连接；连接失败或超时后在 retry_interval 秒内直接抛出 RetrievalUnavailable，
+    调用方回退到进程内检索，不必每次都等待超时。
+    """
+
+    def __init__(self, path: str, pool_size: Optional[int] = None, timeout: Optional[float] = None,
+                 retry_interval: float = 5.0):
+        self.path = path
+        self.pool_size = pool_size or Config.RETRIEVAL_SIDECAR_POOL_SIZE
+        self.timeout = Config.RETRIEVAL_SIDECAR_TIMEOUT if timeout is None else timeout
+        self.retry_interval = retry_interval
+        self.idle: List[tuple] = []  # 空闲连接 (reader, writer)
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.down_until = 0.0
+        self.next_id = 0
+        self.stats = {"requests": 0, "failures": 0, "connects": 0}
+
+    async def call(self, op: str, **args):
+        if time.time() < self.down_until:
+            raise RetrievalUnavailable("检索进程暂不可用")
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.pool_size)
+        self.next_id += 1
+        request = {"id": self.next_id, "op": op, "args": args}
+        self.stats["requests"] += 1
+
+        async with self.semaphore:
+            connection = None
+            try:
+                connection = self.idle.pop() if self.idle else await self._connect()
+                reader, writer = connection
+                writer.write(encode_frame(request))
+                await writer.drain()
+                frame = await asyncio.wait_for(read_frame(reader), self.timeout)
+                if frame is None:
+                    raise ConnectionError("检索进程关闭了连接")
+            except (OSError, ConnectionError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                if connection is not None:
+                    connection[1].close()
+                self.stats["failures"] += 1
+                self.down_until = time.time() + self.retry_interval
+                raise RetrievalUnavailable(f"{type(e).__name__}: {e}") from e
+            self.idle.append(connection)
+
+        response, _ = frame
+        if not response.get("ok"):
+            raise RetrievalError(response.get("error"))
+        return response["result"]
+
+    async def _connect(self) -> tuple:
+        self.stats["connects"] += 1
+        return await asyncio.wait_for(asyncio.open_unix_connection(self.path), self.timeout)
+
+    async def encode(self, texts: List[str]) -> Optional[np.ndarray]:
+        return await self.call("encode", texts=texts)
+
+    async def search(self, query: str, top_k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                     lang: Optional[str] = None) -> Dict[str, Any]:
+        return await self.call("search", query=query, top_k=top_k, filters=filters, lang=lang)
+
+    async def search_batch(self, queries: List[str], top_k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                           lang: Optional[str] = None) -> Dict[str, Any]:
+        return await self.call("search_batch", queries=queries, top_k=top_k, filters=filters, lang=lang)
+
+    async def context_entries(self, query: str, top_k: int = 3, lang: Optional[str] = None) -> List[str]:
+        return await self.call("context", query=query, top_k=top_k, lang=lang)
+
+    async def upsert(self, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return await self.call("upsert", documents=documents)
+
+    async def delete(self, doc_id: str) -> Dict[str, Any]:
+        return await self.call("delete", doc_id=doc_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            **self.stats,
+            "pooled_connections": len(self.idle),
+            "available": time.time() >= self.down_until
+        }
+
+    async def close(self):
+        while self.idle:
+            _, writer = self.idle.pop()
+            writer.close()
@@ -0,0 +1,266 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from config import Config
+from services.kb_ingest import SnapshotWriter, read_snapshot
+from services.knowledge_base import KnowledgeBase
+
+DEFAULT_TENANT = "default"
+# 租户ID同时是目录名，只允许字母、数字、下划线和连字符
+TENANT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class UnknownTenant(KeyError):
+    """租户不存在（TENANTS_PATH 下没有对应目录）"""
+
+
+class TenantRegistry:
+    """多租户知识库
+
+    默认租户使用主知识库（KNOWLEDGE_BASE_PATH）；其他租户各有独立的 KnowledgeBase（文档存储和检索索引），
+    共用主知识库的向量化模型，首次请求时才加载：
+    - 缓存有效时从 TENANT_CACHE_PATH/<租户ID>/ 读取文档，向量内存映射，不重新向量化
+    - 否则读取租户的知识库文件并向量化，再写入缓存
+    已加载租户的索引（文档存储、倒排表、常驻向量和HNSW索引）总量超过 TENANT_MEMORY_BUDGET_MB 时，
+    按最近使用顺序淘汰；被淘汰的租户下次请求时从缓存重新加载。
+    在向量化模型就绪前（或未在本进程加载模型时）加载的租户只有BM25索引，也不写入缓存；
+    模型就绪后的下一次请求为该租户补充向量并写入缓存。
+    """
+
+    def __init__(self, default_kb: KnowledgeBase, root: Optional[str] = None, cache_root: Optional[str] = None,
+                 budget_mb: Optional[float] = None):
+        self.default = default_kb
+        self.root = root or Config.TENANTS_PATH
+        self.cache_root = cache_root or Config.TENANT_CACHE_PATH
+        budget_mb = Config.TENANT_MEMORY_BUDGET_MB if budget_mb is None else budget_mb
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.loaded: "OrderedDict[str, KnowledgeBase]" = OrderedDict()  # 最近使用的在末尾
+        self.memory: Dict[str, int] = {}  # 已加载租户的索引字节数（加载时计算）
+        self.signatures: Dict[str, tuple] = {}  # 已加载租户的知识库文件签名和上次检查时间
+        self.stats: Dict[str, Dict[str, Any]] = {}
+        self.latencies: Dict[str, deque] = {}
+        self._lock = threading.Lock()  # 保护以上字典
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def is_default(tenant: Optional[str]) -> bool:
+        return not tenant or tenant == DEFAULT_TENANT
+
+    def exists(self, tenant: Optional[str]) -> bool:
+        if self.is_default(tenant):
+            return True
+        return bool(TENANT_ID_PATTERN.match(tenant)) and os.path.isdir(os.path.join(self.root, tenant))
+
+    def tenant_ids(self) -> List[str]:
+        """默认租户和 TENANTS_PATH 下的全部租户"""
+        tenants = [DEFAULT_TENANT]
+        if os.path.isdir(self.root):
+            tenants += sorted(name for name in os.listdir(self.root)
+                              if TENANT_ID_PATTERN.match(name) and os.path.isdir(os.path.join(self.root, name)))
+        return tenants
+
+    def _tenant_stats(self, tenant: str) -> Dict[str, Any]:
+        stats = self.stats.get(tenant)
+        if stats is None:
+            stats = self.stats[tenant] = {"loads": 0, "evictions": 0, "last_load_ms": None, "load_source": None,
+                                          "searches": 0, "last_used": None}
+            self.latencies[tenant] = deque(maxlen=Config.TENANT_LATENCY_WINDOW)
+        return stats
+
+    def get(self, tenant: Optional[str]) -> KnowledgeBase:
+        """租户的知识库，未加载时加载（可能较慢，异步代码中应在线程池中调用）"""
+        if self.is_default(tenant):
+            return self.default
+        if not self.exists(tenant):
+            raise UnknownTenant(tenant)
+
+        with self._lock:
+            knowledge_base = self.loaded.get(tenant)
+            if knowledge_base is not None:
+                if not self._source_changed(tenant, knowledge_base):
+                    self.loaded.move_to_end(tenant)
+                    if not self._needs_vectors(knowledge_base):
+                        return knowledge_base
+                else:
+                    # 知识库文件已修改：丢弃旧索引，下面重新加载（缓存签名不一致，会重新向量化）
+                    print(f"🔄 租户 {tenant} 的知识库文件已修改，重新加载")
+                    self._drop(tenant)
+            load_lock = self._load_locks.setdefault(tenant, threading.Lock())
+
+        # 同一租户只加载一次，其他租户的请求不受影响
+        with load_lock:
+            with self._lock:
+                knowledge_base = self.loaded.get(tenant)
+            if knowledge_base is None:
+                knowledge_base = self._load(tenant)
+                with self._lock:
+                    self.loaded[tenant] = knowledge_base
+                    self.memory[tenant] = knowledge_base.memory_bytes()
+                    self._evict(keep=tenant)
+            elif self._needs_vectors(knowledge_base):
+                self._attach_vectors(tenant, knowledge_base)
+        return knowledge_base
+
+    def _needs_vectors(self, knowledge_base: KnowledgeBase) -> bool:
+        """租户加载时向量化模型尚未就绪，现在已可用"""
+        return knowledge_base.embedding_model is None and self.default.embedding_model is not None
+
+    def _attach_vectors(self, tenant: str, knowledge_base: KnowledgeBase):
+        """为只有BM25索引的已加载租户补充向量（期间检索继续使用BM25），并写入缓存"""
+        start = time.perf_counter()
+        knowledge_base.embedding_model = self.default.embedding_model
+        if not knowledge_base.attach_vectors():
+            return
+        signature = self._signature(knowledge_base)
+        self._write_cache(knowledge_base, os.path.join(self.cache_root, tenant), signature)
+        with self._lock:
+            self.signatures[tenant] = (signature, time.time())
+            if tenant in self.loaded:
+                self.memory[tenant] = knowledge_base.memory_bytes()
+                self._evict(keep=tenant)
+        print(f"🏪 租户 {tenant} 已补充向量索引，耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    def _source_changed(self, tenant: str, knowledge_base: KnowledgeBase) -> bool:
+        """每隔 KNOWLEDGE_RELOAD_INTERVAL 秒检查一次租户的知识库文件（需持有 _lock）"""
+        interval = Config.KNOWLEDGE_RELOAD_INTERVAL
+        signature, checked = self.signatures.get(tenant, (None, 0.0))
+        if interval <= 0 or time.time() - checked < interval:
+            return False
+        current = self._signature(knowledge_base)
+        self.signatures[tenant] = (current, time.time())
+        return signature is not None and current != signature
+
+    def _signature(self, knowledge_base: KnowledgeBase) -> tuple:
+        """知识库文件、快照和向量化后端；任何一项变化时缓存失效
+
+        向量化后端取租户知识库实际使用的模型，与缓存中是否有向量一致。
+        """
+        files = [list(item) for item in knowledge_base._source_signature()]
+        manifest = os.path.join(knowledge_base.snapshot_path, "manifest.json")
+        if os.path.exists(manifest):
+            stat = os.stat(manifest)
+            files.append([manifest, stat.st_mtime_ns, stat.st_size])
+        backend = Config.EMBEDDING_BACKEND if knowledge_base.embedding_model is not None else None
+        return tuple(tuple(item) for item in files) + (("embedding", backend),)
+
+    def _load(self, tenant: str) -> KnowledgeBase:
+        start = time.perf_counter()
+        knowledge_base = KnowledgeBase(load_model=False, knowledge_path=os.path.join(self.root, tenant))
+        knowledge_base.embedding_model = self.default.embedding_model
+        signature = self._signature(knowledge_base)
+        cache_path = os.path.join(self.cache_root, tenant)
+
+        cached = self._read_cache(cache_path, signature)
+        if cached is not None:
+            knowledge_base.load_documents(cached["documents"], cached["embeddings"])
+            source = "cache"
+        else:
+            knowledge_base.load_knowledge_base()
+            if knowledge_base.embedding_model is not None:
+                # 只有BM25索引时不写缓存：读取知识库文件同样不需要向量化，且模型就绪后需要补充向量
+                self._write_cache(knowledge_base, cache_path, signature)
+            source = "files"
+
+        elapsed = round((time.perf_counter() - start) * 1000, 3)
+        with self._lock:
+            self.signatures[tenant] = (signature, time.time())
+            stats = self._tenant_stats(tenant)
+            stats["loads"] += 1
+            stats["last_load_ms"] = elapsed
+            stats["load_source"] = source
+        print(f"🏪 租户 {tenant} 知识库已加载（{'缓存' if source == 'cache' else '知识库文件'}），"
+              f"{sum(knowledge_base.get_partition_stats().values())} 个文档，耗时 {elapsed:.1f}ms")
+        return knowledge_base
+
+    @staticmethod
+    def _read_cache(path: str, signature: tuple) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(os.path.join(path, "manifest.json")):
+            return None
+        try:
+            snapshot = read_snapshot(path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 租户缓存读取失败，重新加载知识库文件: {e}")
+            return None
+        cached_signature = snapshot["manifest"].get("signature")
+        if cached_signature is None or tuple(tuple(item) for item in cached_signature) != signature:
+            return None
+        return snapshot
+
+    @staticmethod
+    def _write_cache(knowledge_base: KnowledgeBase, path: str, signature: tuple):
+        documents = knowledge_base.documents
+        embeddings = knowledge_base.document_embeddings
+        writer = SnapshotWriter(path)
+        try:
+            writer.write([dict(doc) for doc in documents],
+                         np.asarray(embeddings, dtype=np.float32) if len(embeddings) else None)
+            writer.close({"signature": [list(item) for item in signature]})
+        except Exception as e:
+            writer.abort()
+            print(f"⚠️ 租户缓存写入失败: {e}")
+
+    def _drop(self, tenant: str):
+        """卸载租户（需持有 _lock）"""
+        knowledge_base = self.loaded.pop(tenant)
+        self.memory.pop(tenant, None)
+        knowledge_base.stop_watcher()
+
+    def _evict(self, keep: str):
+        """已加载租户的索引超过内存预算时，淘汰最久未使用的租户（需持有 _lock）"""
+        while sum(self.memory.values()) > self.budget_bytes and len(self.loaded) > 1:
+            tenant = next(iter(self.loaded))
+            if tenant == keep:
+                break
+            self._drop(tenant)
+            self._tenant_stats(tenant)["evictions"] += 1
+            print(f"♻️ 租户 {tenant} 的知识库索引已淘汰（内存预算 {self.budget_bytes / 1024 / 1024:.0f}MB）")
+
+    def evict(self, tenant: str) -> bool:
+        """手动卸载租户，返回租户是否已加载"""
+        with self._lock:
+            if tenant not in self.loaded:
+                return False
+            self._drop(tenant)
+            return True
+
+    def record_search(self, tenant: Optional[str], elapsed_ms: float):
+        tenant = DEFAULT_TENANT if self.is_default(tenant) else tenant
+        with self._lock:
+            stats = self._tenant_stats(tenant)
+            stats["searches"] += 1
+            stats["last_used"] = time.time()
+            self.latencies[tenant].append(elapsed_ms)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """各租户的加载状态、文档数、索引内存和检索耗时（最近 TENANT_LATENCY_WINDOW 次）"""
+        tenants = {}
+        with self._lock:
+            for tenant in self.tenant_ids():
+                stats = dict(self.stats.get(tenant) or {"loads": 0, "evictions": 0, "searches": 0})
+                latencies = np.asarray(self.latencies.get(tenant) or [], dtype=np.float64)
+                if latencies.size:
+                    stats["avg_ms"] = round(float(latencies.mean()), 3)
+                    stats["p95_ms"] = round(float(np.percentile(latencies, 95)), 3)
+                if self.is_default(tenant):
+                    knowledge_base = self.default
+                    stats["memory_bytes"] = knowledge_base.memory_bytes()
+                else:
+                    knowledge_base = self.loaded.get(tenant)
+                    stats["memory_bytes"] = self.memory.get(tenant, 0)
+                stats["loaded"] = knowledge_base is not None
+                stats["documents"] = sum(knowledge_base.get_partition_stats().values()) if knowledge_base else None
+                tenants[tenant] = stats
+            loaded_bytes = sum(self.memory.values())
+            loaded = list(self.loaded)
+        return {
+            "budget_bytes": self.budget_bytes,
+            "loaded_bytes": loaded_bytes,
+            "loaded": loaded,
+            "tenants": tenants
+        }
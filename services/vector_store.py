@@ -0,0 +1,152 @@
+import mmap
+import os
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from config import Config
+
+# 分块计算相似度时每块的行数，控制临时内存
+SCAN_CHUNK_ROWS = 4096
+
+
+def disk_backed(embeddings: np.ndarray, directory: Optional[str] = None) -> np.ndarray:
+    """返回磁盘上的只读float32向量（内存映射），只有被访问的页才占用内存
+
+    已经是内存映射（例如快照中的 embeddings.f32）时直接使用，否则写入 VECTOR_DB_PATH 下的匿名临时文件。
+    """
+    if isinstance(embeddings, np.memmap) and embeddings.dtype == np.float32:
+        return embeddings
+    directory = directory or Config.VECTOR_DB_PATH
+    os.makedirs(directory, exist_ok=True)
+    matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+    # 临时文件创建后即被删除，映射关闭后磁盘空间自动释放
+    with tempfile.TemporaryFile(dir=directory) as f:
+        matrix.tofile(f)
+        f.flush()
+        return np.memmap(f, dtype=np.float32, mode="r", shape=matrix.shape)
+
+
+def is_memory_mapped(array: np.ndarray) -> bool:
+    """数组数据是否来自内存映射文件（页面可以被系统回收，不计入常驻内存）"""
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return isinstance(array, mmap.mmap)
+
+
+def _kmeans(x: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest(x, centroids)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.stack([np.bincount(assign, weights=x[:, d], minlength=k) for d in range(x.shape[1])], axis=1)
+        filled = counts > 0
+        # 空簇保留原中心
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def _nearest(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """每行最近的聚类中心下标（||c||² - 2x·c 的最小值）"""
+    norms = (centroids ** 2).sum(axis=1)
+    assign = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), SCAN_CHUNK_ROWS):
+        chunk = x[start:start + SCAN_CHUNK_ROWS]
+        assign[start:start + len(chunk)] = np.argmin(norms - 2 * chunk @ centroids.T, axis=1)
+    return assign
+
+
+class Float16Codes:
+    """float16存储：每维2字节，精度损失很小"""
+
+    name = "float16"
+
+    def __init__(self, embeddings: np.ndarray):
+        self.codes = np.asarray(embeddings, dtype=np.float16)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+    def scores(self, query_embedding: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        codes = self.codes if ids is None else self.codes[ids]
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_CHUNK_ROWS):
+            chunk = codes[start:start + SCAN_CHUNK_ROWS].astype(np.float32)
+            scores[start:start + len(chunk)] = chunk @ query_embedding
+        return scores
+
+    def batch_scores(self, query_embeddings: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """多个查询的近似分数（查询数 × 文档数），每块编码只解码一次"""
+        codes = self.codes if ids is None else self.codes[ids]
+        scores = np.empty((len(query_embeddings), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_CHUNK_ROWS):
+            chunk = codes[start:start + SCAN_CHUNK_ROWS].astype(np.float32)
+            scores[:, start:start + len(chunk)] = query_embeddings @ chunk.T
+        return scores
+
+
+class ProductQuantizer:
+    """乘积量化（PQ）：向量切分为 m 段，每段用最近聚类中心的下标（1字节）表示
+
+    384维、m=48 时每个文档48字节（float32为1536字节）。检索时先按查询计算每段到各聚类中心的
+    内积表，文档分数为各段查表之和（非对称距离计算），不需要解码向量。
+    """
+
+    name = "pq"
+
+    def __init__(self, embeddings: np.ndarray, subquantizers: Optional[int] = None, iterations: int = 10,
+                 train_size: int = 256 * 39, seed: int = 0):
+        n, dim = embeddings.shape
+        m = subquantizers or Config.PQ_SUBQUANTIZERS
+        while dim % m:
+            m -= 1
+        self.m, self.sub_dim = m, dim // m
+        k = min(256, n)
+
+        rng = np.random.default_rng(seed)
+        sample = embeddings[np.sort(rng.choice(n, min(n, train_size), replace=False))]
+        sample = np.asarray(sample, dtype=np.float32).reshape(len(sample), m, self.sub_dim)
+        self.centroids = np.stack([_kmeans(sample[:, j], k, iterations, rng) for j in range(m)])
+
+        self.codes = np.empty((n, m), dtype=np.uint8)
+        for start in range(0, n, SCAN_CHUNK_ROWS):
+            chunk = np.asarray(embeddings[start:start + SCAN_CHUNK_ROWS], dtype=np.float32)
+            chunk = chunk.reshape(len(chunk), m, self.sub_dim)
+            for j in range(m):
+                self.codes[start:start + len(chunk), j] = _nearest(chunk[:, j], self.centroids[j])
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.centroids.nbytes
+
+    def scores(self, query_embedding: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        table = np.einsum("jkd,jd->jk", self.centroids, query_embedding.reshape(self.m, self.sub_dim))
+        columns = np.arange(self.m)
+        codes = self.codes if ids is None else self.codes[ids]
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_CHUNK_ROWS):
+            chunk = codes[start:start + SCAN_CHUNK_ROWS]
+            scores[start:start + len(chunk)] = table[columns, chunk].sum(axis=1)
+        return scores
+
+    def batch_scores(self, query_embeddings: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """多个查询的近似分数（查询数 × 文档数）：一次计算所有查询的内积表，逐段查表累加"""
+        tables = np.einsum("jkd,qjd->jqk", self.centroids,
+                           query_embeddings.reshape(len(query_embeddings), self.m, self.sub_dim))
+        codes = self.codes if ids is None else self.codes[ids]
+        scores = np.zeros((len(query_embeddings), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_CHUNK_ROWS):
+            chunk = codes[start:start + SCAN_CHUNK_ROWS]
+            for j in range(self.m):
+                scores[:, start:start + len(chunk)] += tables[j][:, chunk[:, j]]
+        return scores
+
+
+VECTOR_CODECS = {
+    "float16": Float16Codes,
+    "pq": ProductQuantizer,
+}
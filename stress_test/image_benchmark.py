@@ -0,0 +1,85 @@
+"""Image preprocessing throughput benchmark.
+
+Compares the old inline path (full decode + LANCZOS + JPEG + base64) with
+services.image_pipeline.preprocess_image, single-threaded and in a process
+pool, and reports images/sec and images/sec per core.
+
+Usage:
+    python stress_test/image_benchmark.py --image stress_test/test_data/sample.jpg --workers 4
+"""
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.image_pipeline import preprocess_image  # noqa: E402
+
+
+def legacy_preprocess(image_data: bytes, max_size: int = 1024) -> str:
+    """The previous inline implementation from AIService.process_image_query_async"""
+    image = Image.open(io.BytesIO(image_data))
+    width, height = image.size
+    if width > max_size or height > max_size:
+        if width > height:
+            new_size = (max_size, int(height * max_size / width))
+        else:
+            new_size = (int(width * max_size / height), max_size)
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG")
+    return base64.b64encode(buffered.getvalue()).decode()
+
+
+def run_serial(func, image_data: bytes, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(image_data)
+    return iterations / (time.perf_counter() - start)
+
+
+def run_pool(image_data: bytes, iterations: int, workers: int) -> float:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # warm up worker processes
+        list(pool.map(preprocess_image, [image_data] * workers))
+        start = time.perf_counter()
+        list(pool.map(preprocess_image, [image_data] * iterations))
+        return iterations / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image preprocessing throughput benchmark")
+    parser.add_argument("--image", default=os.path.join(os.path.dirname(__file__), "test_data", "sample.jpg"))
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        image_data = f.read()
+
+    result = preprocess_image(image_data)
+    print(f"Input: {args.image} ({len(image_data) / 1024:.1f}KB, {result['original_format']}, "
+          f"{result['original_size'][0]}x{result['original_size'][1]})")
+    print(f"Output: {result['size'][0]}x{result['size'][1]}, {result['output_bytes'] / 1024:.1f}KB JPEG")
+    print(f"Stage timings (ms): {result['timings_ms']}")
+
+    legacy = run_serial(legacy_preprocess, image_data, args.iterations)
+    pipeline = run_serial(preprocess_image, image_data, args.iterations)
+    pooled = run_pool(image_data, args.iterations * args.workers, args.workers)
+
+    print(f"legacy   (1 core):          {legacy:8.1f} images/sec")
+    print(f"pipeline (1 core):          {pipeline:8.1f} images/sec  ({pipeline / legacy:.2f}x)")
+    print(f"pipeline ({args.workers} workers pool):  {pooled:8.1f} images/sec  "
+          f"({pooled / args.workers:.1f} images/sec/core)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Cold-import budget check for the API module.
+
+Runs `python -X importtime -c "import <module>"` in fresh interpreters and
+fails (exit code 1) when:
+  - the cumulative import time of the module exceeds --budget-ms (the best of
+    --runs runs is used, to reduce noise), or
+  - a heavy dependency that should only load on first use (torch,
+    sentence_transformers, faiss, onnxruntime, openai, PIL, httpx,
+    services.ai_service, ...) is imported.
+
+The slowest direct imports are printed so regressions are easy to trace.
+
+Usage:
+    python stress_test/import_budget.py
+    python stress_test/import_budget.py --module api.main --budget-ms 600 --runs 5
+    python stress_test/import_budget.py --module services.knowledge_base --allow numpy
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported by a cold `import api.main`
+DEFERRED_MODULES = (
+    "torch", "sentence_transformers", "transformers", "faiss", "onnxruntime", "tokenizers",
+    "openai", "PIL", "httpx", "tiktoken", "langdetect", "numpy", "uvicorn", "services.ai_service",
+)
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)")
+
+
+def import_times(module: str):
+    """[(module name, self us, cumulative us, nesting level)] for one cold import"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-import time budget check")
+    parser.add_argument("--module", default="api.main")
+    parser.add_argument("--budget-ms", type=float, default=800.0, help="maximum cumulative import time")
+    parser.add_argument("--runs", type=int, default=3, help="cold imports to run; the fastest one is checked")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest direct imports to print")
+    parser.add_argument("--allow", nargs="*", default=[], help="deferred modules the checked module may import")
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(args.runs):
+        rows = import_times(args.module)
+        total = next((cumulative for name, _, cumulative, _ in rows if name == args.module), None)
+        if total is None:
+            sys.exit(f"{args.module} not found in -X importtime output")
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total_us, rows = best
+
+    print(f"import {args.module}: {total_us / 1000:.1f} ms (budget {args.budget_ms:.0f} ms, best of {args.runs})")
+    print(f"{'cumulative ms':>14}  module")
+    direct = sorted((row for row in rows if row[3] == 1), key=lambda row: row[2], reverse=True)
+    for name, _, cumulative, _ in direct[:args.top]:
+        print(f"{cumulative / 1000:>14.1f}  {name}")
+
+    imported = {name for name, *_ in rows}
+    eager = [name for name in DEFERRED_MODULES if name in imported and name not in args.allow]
+    failed = False
+    if eager:
+        print(f"FAIL: imported eagerly (should load on first use): {', '.join(eager)}")
+        failed = True
+    if total_us / 1000 > args.budget_ms:
+        print(f"FAIL: {total_us / 1000:.1f} ms exceeds the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Ingestion format check against a local fixture server.
+
+Starts an HTTP server on 127.0.0.1 that serves generated knowledge files in
+every layout the streaming parser (`services/kb_ingest.py`) accepts, sent as
+small chunked writes so multi-byte characters and JSON values are split across
+chunks. Each fixture is ingested from its URL with KnowledgeIngestor
+(keyword-only, no embedding model), and the run fails (exit code 1) when a
+source fails or the item / document counts differ from what was served.
+
+Fixtures:
+  - array:            pretty-printed top-level array
+  - faqs-object:      pretty-printed {"faqs": [...]}
+  - one-line-object:  {"faqs": [...]} compressed into a single line
+  - one-line-big:     the same, larger than the format-detection buffer
+  - jsonl:            one FAQ per line
+  - jsonl-containers: one {"faqs": [...]} group per line
+  - jsonl-arrays:     one array of FAQs per line
+
+Usage:
+    python stress_test/ingest_fixtures.py
+    python stress_test/ingest_fixtures.py --items 5000 --chunk-bytes 7
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from services.kb_ingest import _DETECT_MAX_LINE, KnowledgeIngestor  # noqa: E402
+from services.knowledge_base import KnowledgeBase  # noqa: E402
+
+
+def make_faqs(count: int, prefix: str):
+    return [{"question": f"{prefix}问题{i}：退货要多久？", "answer": f"答案{i}：7天内 ✅", "category": "售后"}
+            for i in range(count)]
+
+
+def build_fixtures(items: int):
+    """{name: (body bytes, number of FAQ items)}"""
+    def groups(faqs, size=7):
+        return [faqs[i:i + size] for i in range(0, len(faqs), size)]
+
+    fixtures = {}
+    faqs = make_faqs(items, "array")
+    fixtures["array"] = json.dumps(faqs, ensure_ascii=False, indent=2)
+    faqs = make_faqs(items, "object")
+    fixtures["faqs-object"] = json.dumps({"version": 1, "faqs": faqs}, ensure_ascii=False, indent=2)
+    faqs = make_faqs(items, "oneline")
+    fixtures["one-line-object"] = json.dumps({"faqs": faqs}, ensure_ascii=False)
+    # the single line must be longer than the detection buffer to exercise streaming
+    big = max(items, _DETECT_MAX_LINE // 40)
+    fixtures["one-line-big"] = json.dumps({"faqs": make_faqs(big, "big")}, ensure_ascii=False)
+    faqs = make_faqs(items, "jsonl")
+    fixtures["jsonl"] = "\n".join(json.dumps(faq, ensure_ascii=False) for faq in faqs) + "\n"
+    faqs = make_faqs(items, "groups")
+    fixtures["jsonl-containers"] = "\n".join(
+        json.dumps({"faqs": group}, ensure_ascii=False) for group in groups(faqs)) + "\n"
+    faqs = make_faqs(items, "arrays")
+    fixtures["jsonl-arrays"] = "\n".join(json.dumps(group, ensure_ascii=False) for group in groups(faqs))
+
+    counts = {name: items for name in fixtures}
+    counts["one-line-big"] = big
+    return {name: (body.encode("utf-8"), counts[name]) for name, body in fixtures.items()}
+
+
+def serve(fixtures, chunk_bytes: int) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            name = self.path.strip("/")
+            if name not in fixtures:
+                self.send_error(404)
+                return
+            body = fixtures[name][0]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            # large bodies use bigger chunks so the check stays fast
+            step = chunk_bytes if len(body) < 1 << 20 else 64 * 1024 + chunk_bytes
+            for start in range(0, len(body), step):
+                chunk = body[start:start + step]
+                self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion format check against a local fixture server")
+    parser.add_argument("--items", type=int, default=500, help="FAQ items per fixture")
+    parser.add_argument("--chunk-bytes", type=int, default=13, help="bytes per chunk the server writes")
+    parser.add_argument("--batch-size", type=int, default=64, help="ingestion batch size")
+    args = parser.parse_args()
+
+    fixtures = build_fixtures(args.items)
+    server = serve(fixtures, args.chunk_bytes)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    knowledge_base = KnowledgeBase(load_model=False)
+
+    print(f"{'fixture':<18}{'bytes':>10}{'expected':>10}{'items':>8}{'docs':>8}  result")
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (body, expected) in fixtures.items():
+            ingestor = KnowledgeIngestor(knowledge_base, batch_size=args.batch_size, progress_interval=3600)
+            result = asyncio.run(ingestor.ingest([f"{base}/{name}"], os.path.join(tmp, name)))
+            ok = result["success"] and result["items"] == expected and result["documents"] == expected
+            failed = failed or not ok
+            errors = "; ".join(item["error"] for item in result["failed_sources"])
+            print(f"{name:<18}{len(body):>10}{expected:>10}{result['items']:>8}{result['documents']:>8}  "
+                  f"{'ok' if ok else 'FAIL'} {errors}")
+    server.shutdown()
+
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
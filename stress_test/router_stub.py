@@ -0,0 +1,146 @@
+"""Model router check against local OpenAI-compatible stub servers.
+
+Starts three chat-completions stubs on 127.0.0.1 (fast, slow and failing with
+HTTP 503), routes sync and async requests through ModelRouter
+(`services/model_router.py`) and fails (exit code 1) when:
+  - a request fails although a healthy endpoint was available,
+  - the failing endpoint is not put into cooldown,
+  - the fast endpoint does not get most of the text traffic,
+  - a classification request does not fall back to the text pool, or
+  - a vision request is sent anywhere although no endpoint has a vision model.
+
+Usage:
+    python stress_test/router_stub.py
+    python stress_test/router_stub.py --requests 500 --slow-ms 80
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from services.model_router import ModelEndpoint, ModelRouter  # noqa: E402
+
+
+def stub_server(delay: float, status: int = 200) -> ThreadingHTTPServer:
+    """Chat-completions stub answering with the requested model name after `delay` seconds"""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # headers and body are separate writes
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(delay)
+            if status != 200:
+                payload = json.dumps({"error": {"message": "stub failure"}}).encode("utf-8")
+            else:
+                payload = json.dumps({
+                    "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "ok"}}],
+                }).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model router check against local stub servers")
+    parser.add_argument("--requests", type=int, default=200, help="sync and async text requests each")
+    parser.add_argument("--fast-ms", type=float, default=5.0, help="latency of the fast stub")
+    parser.add_argument("--slow-ms", type=float, default=50.0, help="latency of the slow stub")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent async requests")
+    args = parser.parse_args()
+
+    servers = {
+        "fast": stub_server(args.fast_ms / 1000),
+        "slow": stub_server(args.slow_ms / 1000),
+        "failing": stub_server(0.0, status=503),
+    }
+    endpoints = [
+        ModelEndpoint(name, f"http://127.0.0.1:{server.server_address[1]}/v1", "stub", {"text": f"{name}-text"})
+        for name, server in servers.items()
+    ]
+    router = ModelRouter(endpoints, cooldown=60.0, max_attempts=len(endpoints))
+    messages = [{"role": "user", "content": "ping"}]
+    failures = []
+
+    served = Counter()
+    errors = Counter()
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        try:
+            served[router.chat_completion("text", messages=messages).model] += 1
+        except Exception as e:
+            errors[type(e).__name__] += 1
+
+    async def run_async():
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one():
+            async with semaphore:
+                return await router.achat_completion("text", messages=messages)
+
+        return await asyncio.gather(*(one() for _ in range(args.requests)), return_exceptions=True)
+
+    for result in asyncio.run(run_async()):
+        if isinstance(result, Exception):
+            errors[type(result).__name__] += 1
+        else:
+            served[result.model] += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"{2 * args.requests} text requests in {elapsed:.2f}s")
+    print(f"{'endpoint':<10}{'served':>8}{'errors':>8}{'ewma ms':>10}  healthy")
+    for endpoint in endpoints:
+        stats = endpoint.stats()
+        print(f"{endpoint.name:<10}{served[endpoint.models['text']]:>8}{stats['total_errors']:>8}"
+              f"{str(stats['ewma_latency_ms']):>10}  {stats['healthy']}")
+
+    if errors:
+        failures.append(f"requests failed: {dict(errors)}")
+    if endpoints[2].is_healthy():
+        failures.append("failing endpoint was not put into cooldown")
+    if served["fast-text"] <= served["slow-text"]:
+        failures.append("fast endpoint did not get most of the traffic")
+
+    response = router.chat_completion("classification", messages=messages)
+    if response.model not in ("fast-text", "slow-text"):
+        failures.append(f"classification was served by {response.model}")
+
+    before = sum(endpoint.total_requests for endpoint in endpoints)
+    try:
+        router.chat_completion("vision", messages=messages)
+        failures.append("vision request succeeded without a vision endpoint")
+    except ValueError as e:
+        print(f"vision without a vision pool: {e}")
+    if sum(endpoint.total_requests for endpoint in endpoints) != before:
+        failures.append("vision request was sent to a text endpoint")
+
+    for server in servers.values():
+        server.shutdown()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
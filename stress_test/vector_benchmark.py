@@ -0,0 +1,99 @@
+"""Vector storage benchmark: memory per document and recall@k.
+
+Builds services.retrieval.VectorIndex with each storage option (float32,
+float16, pq) over the same embeddings and compares against exact float32
+search: resident vector bytes per document, build time, query latency and
+recall@k. For pq it also reports recall without the float32 re-scoring step.
+
+Embeddings come from a knowledge base snapshot (ingest_knowledge.py output)
+or are generated as clustered unit vectors.
+
+Usage:
+    python stress_test/vector_benchmark.py --docs 200000 --k 10
+    python stress_test/vector_benchmark.py --snapshot vector_db/snapshot
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.kb_ingest import read_snapshot  # noqa: E402
+from services.retrieval import VectorIndex, top_k_indices  # noqa: E402
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def synthetic_embeddings(docs: int, dim: int, clusters: int, noise: float, seed: int) -> np.ndarray:
+    """Unit vectors around random cluster centers (roughly how sentence embeddings of a FAQ corpus look)"""
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((clusters, dim)))
+    embeddings = np.empty((docs, dim), dtype=np.float32)
+    for start in range(0, docs, 65536):
+        size = min(65536, docs - start)
+        assign = rng.integers(0, clusters, size)
+        embeddings[start:start + size] = normalize(centers[assign] + noise * rng.standard_normal((size, dim)) / np.sqrt(dim))
+    return embeddings
+
+
+def recall(results, exact, k: int) -> float:
+    return float(np.mean([len({i for i, _ in got[:k]} & set(want[:k])) / k for got, want in zip(results, exact)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vector storage benchmark")
+    parser.add_argument("--snapshot", help="knowledge base snapshot directory to take embeddings from")
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--noise", type=float, default=0.6, help="per-document noise norm around its cluster center")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--storages", nargs="+", default=["float32", "float16", "pq"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.snapshot:
+        embeddings = read_snapshot(args.snapshot)["embeddings"]
+        if embeddings is None:
+            sys.exit(f"{args.snapshot} has no embeddings")
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+    else:
+        embeddings = synthetic_embeddings(args.docs, args.dim, args.clusters, args.noise, args.seed)
+    n, dim = embeddings.shape
+
+    # queries: perturbed copies of random documents
+    rng = np.random.default_rng(args.seed + 1)
+    picked = rng.choice(n, args.queries, replace=False)
+    queries = normalize(embeddings[picked] + 0.5 * args.noise * rng.standard_normal((args.queries, dim)) / np.sqrt(dim))
+    exact = [[i for i, _ in top_k_indices(embeddings @ q, args.k)] for q in queries]
+    print(f"Corpus: {n} docs x {dim} dims ({'snapshot' if args.snapshot else 'synthetic'}), "
+          f"{args.queries} queries, k={args.k}")
+    print(f"{'storage':<18}{'bytes/doc':>10}{'build s':>10}{'query ms':>10}{'recall@k':>10}")
+
+    for storage in args.storages:
+        start = time.perf_counter()
+        index = VectorIndex(embeddings, storage)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = [index.search(q, args.k) for q in queries]
+        latency = (time.perf_counter() - start) * 1000 / len(queries)
+        print(f"{index.storage:<18}{index.memory_bytes / n:>10.1f}{build:>10.2f}{latency:>10.2f}"
+              f"{recall(results, exact, args.k):>10.3f}")
+
+        if index.codes is not None:
+            start = time.perf_counter()
+            raw = [top_k_indices(index.codes.scores(q), args.k) for q in queries]
+            latency = (time.perf_counter() - start) * 1000 / len(queries)
+            print(f"{index.storage + ' (no rescore)':<18}{index.memory_bytes / n:>10.1f}{'':>10}{latency:>10.2f}"
+                  f"{recall(raw, exact, args.k):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+知识库离线翻译脚本
+把 knowledge_base/ 下的中文FAQ和商品分类翻译为其他语言，生成按语言分区加载的知识库文件
+
+用法:
+    python translate_knowledge_base.py --langs en hi
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from config import Config  # noqa: E402
+from services.kb_translation import KnowledgeTranslator  # noqa: E402
+from services.model_router import ModelRouter  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库离线翻译")
+    parser.add_argument("--langs", nargs="+", default=[lang for lang in Config.KNOWLEDGE_LANGUAGES
+                                                      if lang != Config.KNOWLEDGE_SOURCE_LANG])
+    parser.add_argument("--batch-size", type=int, default=20, help="每次请求翻译的文本条数")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发请求数")
+    args = parser.parse_args()
+
+    print(f"🌐 开始翻译知识库: {Config.KNOWLEDGE_SOURCE_LANG} -> {', '.join(args.langs)}")
+    start_time = time.time()
+
+    translator = KnowledgeTranslator(
+        ModelRouter.from_config(Config()),
+        batch_size=args.batch_size,
+        concurrency=args.concurrency
+    )
+    result = asyncio.run(translator.translate_knowledge_base(args.langs))
+
+    for path in result["files"]:
+        print(f"✅ 已生成: {path}")
+    print(f"📊 缓存命中 {result['cached']} 条，新翻译 {result['translated']} 条，"
+          f"请求 {result['requests']} 次，失败 {result['failed']} 条")
+    print(f"⏱️ 总耗时: {time.time() - start_time:.2f}秒")
+
+
+if __name__ == "__main__":
+    main()